@@ -0,0 +1,175 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from neural_network.utils import Information
+from neural_network.extracting import DataExtractor
+from core.inference import BACKENDS, make_model_manager
+from core.capture import CAPTURE_BACKENDS, make_capture_backend
+from core.pipeline import PacketManager, PacketQueue
+from core.windowing import PacketWindow
+from core.flows import FlowTable
+from core.rules import RuleTable
+from core.metrics import serve_metrics
+
+
+class VerdictWriter:
+    """
+    Writes the verdicts of the classified samples as JSON lines to stdout or to a file.
+    """
+    labels = {0: 'normal', 1: 'malicious'}
+
+    def __init__(self, output=None, source=None):
+        self.source = source
+        self.lock = threading.Lock()
+        self.file = open(output, 'a') if output else sys.stdout
+
+    def write(self, verdict):
+        """Writes one verdict and flushes it so that consumers see it immediately."""
+        line = dict(verdict, sample=verdict['sample'] + 1, label=self.labels.get(verdict['result']),
+                    source=self.source)
+        with self.lock:
+            self.file.write(json.dumps(line) + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class MeanSharkHeadless:
+    """
+    Headless MeanShark: classifies a live interface or a PCAP file without GUI and without Shodan.
+    """
+    def __init__(self, writer, nbr_of_workers=1, policy='drop-oldest', max_batch_size=32, model_path=None,
+                 backend='eager', stride=None, mode='count', window_time=1.0, flows=None, flow_processes=0,
+                 max_flows=10000, memory_windows=50, spill_directory=None, rules=None, metrics_port=None):
+        self.information = Information()
+        self.writer = writer
+        self.model_manager = make_model_manager(backend, model_path)
+        self.packet_manager = PacketManager(self.model_manager, self.writer.write, policy=policy,
+                                            max_batch_size=max_batch_size, stride=stride, mode=mode,
+                                            window_time=window_time, flows=flows, flow_processes=flow_processes,
+                                            max_flows=max_flows, memory_windows=memory_windows,
+                                            spill_directory=spill_directory, rules=rules)
+        self.capture_backend = None
+        metrics = self.packet_manager.metrics
+        metrics.counter('meanshark_capture_received_total', "Packets seen by the capture.",
+                        lambda: self.capture_backend.stats()['received'])
+        metrics.counter('meanshark_capture_dropped_total', "Packets dropped by the kernel capture.",
+                        lambda: self.capture_backend.stats()['dropped'])
+        if metrics_port is not None:
+            serve_metrics(metrics, metrics_port)
+        self.packet_manager.start_workers(nbr_of_workers)
+
+    def analyze_file(self, file_path):
+        """Streams a PCAP file through the classifier and waits for every sample to be published."""
+        logging.info(f"Analyzing {file_path}")
+        # Windows close on the packet timestamps only, whatever the processing speed
+        self.packet_manager.live = False
+        for packet, _ in DataExtractor.stream_packets(file_path):
+            self.packet_manager.packet_thread(packet, policy='block')
+        self.packet_manager.join()
+        self.packet_manager.flush()
+        self.packet_manager.join()
+        logging.info(f"{file_path} analyzed: {self.packet_manager.sample_index} sample(s)")
+        self.log_rules()
+        logging.info(f"Metrics:\n{self.packet_manager.metrics.report()}")
+
+    def log_rules(self):
+        if self.packet_manager.rules.active:
+            logging.info(f"Exclusion rules:\n{self.packet_manager.rules.summary()}")
+
+    def capture(self, interface, backend='auto', bpf_filter=None, ring_size=4):
+        """Classifies the traffic of a live interface (matching the BPF filter) until interrupted."""
+        self.capture_backend = make_capture_backend(backend, interface, bpf_filter, ring_size)
+        self.packet_manager.live = True
+        logging.info(f"Capturing on {interface} with {self.capture_backend.name}")
+        self.capture_backend.start(self.packet_manager.packet_batch)
+        try:
+            while not self.capture_backend.wait(0.5):
+                pass
+        finally:
+            self.capture_backend.stop()
+            logging.info(f"Capture stopped: {self.capture_backend.stats()} (kernel), "
+                         f"{self.packet_manager.packet_queue.dropped} packet(s) dropped by the queue")
+            self.log_rules()
+            logging.info(f"Metrics:\n{self.packet_manager.metrics.report()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MeanShark headless classifier: writes verdicts as JSON lines.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-i', '--interface', help='Classify the live traffic of this interface.')
+    source.add_argument('-r', '--read', help='Classify the packets of this PCAP or PCAPNG file.')
+    parser.add_argument('-o', '--output', help='Append the verdicts to this file instead of stdout.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker threads.')
+    parser.add_argument('--policy', choices=PacketQueue.policies, default='drop-oldest',
+                        help='Back-pressure policy of the packet queue during live capture.')
+    parser.add_argument('--batch-size', type=int, default=32, help='Maximum number of samples per inference.')
+    parser.add_argument('--stride', type=int, default=None,
+                        help='Classify a 200-packet sample every STRIDE packets (sliding windows, 200 by default).')
+    parser.add_argument('--window', choices=PacketWindow.modes, default='count',
+                        help='Close a sample after 200 packets (count), every --window-time seconds (time) '
+                             'or whichever comes first (first).')
+    parser.add_argument('--window-time', type=float, default=1.0,
+                        help='Duration of the time windows in seconds, short samples are padded.')
+    parser.add_argument('--flows', choices=FlowTable.keys, default=None,
+                        help='Classify every flow (5-tuple) or host pair on its own instead of the whole stream.')
+    parser.add_argument('--flow-processes', type=int, default=0,
+                        help='Shard the flows across this number of processes.')
+    parser.add_argument('--max-flows', type=int, default=10000, help='Maximum number of flows kept in memory.')
+    parser.add_argument('--memory-windows', type=int, default=50,
+                        help='Number of windows of packets kept in memory, older packets are spilled to disk.')
+    parser.add_argument('--spill-dir', default=None,
+                        help='Directory of the rotating pcap segments of the spilled packets (temporary by default).')
+    parser.add_argument('--capture', choices=CAPTURE_BACKENDS, default='auto',
+                        help='Capture backend of the live interface: AF_PACKET memory-mapped ring (Linux, root) '
+                             'or scapy, auto picks the ring when available.')
+    parser.add_argument('--ring-size', type=int, default=4,
+                        help='Size in MiB of the AF_PACKET capture ring, locked in kernel memory.')
+    parser.add_argument('--filter', default=None,
+                        help='BPF filter expression of the live capture (tcpdump syntax, e.g. "not port 873").')
+    parser.add_argument('--rule', action='append', default=[],
+                        help='Allow/deny rule checked before a packet enters a window, e.g. '
+                             '"deny net=10.0.5.0/24 port=22,873 proto=tcp". Can be repeated, the first match wins.')
+    parser.add_argument('--default-action', choices=RuleTable.actions, default='allow',
+                        help='Action for the packets matching no rule.')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve the pipeline metrics in the Prometheus text format on '
+                             'http://127.0.0.1:PORT/metrics.')
+    parser.add_argument('--model', help='Path of the model state dict (model.onnx for the onnx backend).')
+    parser.add_argument('--backend', choices=BACKENDS, default='eager',
+                        help='Inference backend of the model, onnx does not need torch.')
+    args = parser.parse_args()
+    if args.model is None:
+        args.model = os.path.join(os.path.dirname(os.path.abspath(__file__)), "neural_network",
+                                  "model.onnx" if args.backend == 'onnx' else "model.pt")
+
+    if args.ring_size < 1:
+        parser.error("--ring-size must be at least 1 MiB")
+    try:
+        rules = RuleTable(args.rule, args.default_action)
+    except ValueError as e:
+        parser.error(str(e))
+    writer = VerdictWriter(args.output, source=args.interface or args.read)
+    headless = MeanSharkHeadless(writer, args.workers, args.policy, args.batch_size, args.model,
+                                 args.backend, args.stride, args.window, args.window_time,
+                                 args.flows, args.flow_processes, args.max_flows, args.memory_windows,
+                                 args.spill_dir, rules, args.metrics_port)
+    try:
+        if args.read:
+            headless.analyze_file(args.read)
+        else:
+            headless.capture(args.interface, args.capture, args.filter, args.ring_size)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        headless.packet_manager.stop_workers()
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,19 @@ import customtkinter as ctk
 import tkinter as tk
 from tkinter import filedialog
 from ui import customMenu
+from ui.updateBus import UpdateBus
 import scapy.all as scapy
-import torch
 import threading
-from neural_network.model import MeanSharkNet
 import psutil
 import shodan
 import json
 import os
-from neural_network.processing import Processor
 from neural_network.extracting import DataExtractor
 from neural_network.utils import Information
+from core.model_manager import ModelManager
+from core.pipeline import PacketManager
+from core.capture import make_capture_backend
+from core.metrics import serve_metrics
 
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("dark-blue")
@@ -22,94 +24,6 @@ root.geometry("1080x720")
 root.title("MeanShark")
 
 
-class ModelManager:
-    """
-    Manages the MeanSharkNet model: loading the model, making predictions.
-    """
-    def __init__(self, input_size, hidden_size, output_size):
-        self.input_size = input_size
-        self.hidden_size = hidden_size
-        self.output_size = output_size
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.model = MeanSharkNet(self.input_size, self.hidden_size, self.output_size,10).to(self.device)
-        self.model.load_state_dict(torch.load(os.path.join(os.getcwd(), "neural_network/model.pt"), weights_only=True))
-        self.model.eval()
-
-    def predict(self, sample, x_stats):
-        """Predicts the class of a sample using the loaded model."""
-        with torch.no_grad():
-            sample_tensor = sample.clone().detach().requires_grad_(True)
-            x_stats_tensor = x_stats.clone().detach().requires_grad_(True)
-            prediction = self.model(sample_tensor, x_stats_tensor)
-            return prediction.argmax().item()
-
-
-class PacketManager:
-    """
-    Handles packet processing and maintains the list of packets and samples.
-    """
-    def __init__(self, model_manager, listbox, framework):
-        self.framework = framework
-        self.packet_list = []
-        self.current_sample = []
-        self.sample_index = 0
-        self.model_manager = model_manager
-        self.listbox = listbox
-        self.lock = threading.Lock()
-        self.network_health = 1.0
-        self.is_enabled = True
-        self.nbr_of_malicious_sample = 0
-
-    def process_current_sample(self):
-        """
-        Processes the current sample to extract features and make predictions.
-        Updates the listbox and network health display.
-        """
-        if len(self.current_sample) >= 200:
-            extractor = DataExtractor()
-            features = extractor.extract_data(self.current_sample)
-            processor = Processor(features)
-
-            x_features = processor.output.to_array()
-            x_stats = [processor.output.bitrate_normalized, processor.output.ip_amount_normalized,
-                       processor.output.port_amount_normalized, processor.output.total_time_normalized]
-
-            sample_tensor = torch.tensor(x_features, dtype=torch.float32).unsqueeze(0).to(self.model_manager.device)
-            x_stats_tensor = torch.tensor(x_stats, dtype=torch.float32).unsqueeze(0).to(self.model_manager.device)
-
-            result = self.model_manager.predict(sample_tensor, x_stats_tensor)
-
-            self.listbox.insert(self.sample_index, f"Sample {self.sample_index + 1}")
-
-            if result == 1:
-                self.listbox.itemconfig(self.sample_index, {'bg': '#825428', 'fg': 'white'})
-                self.nbr_of_malicious_sample += 1
-            else:
-                self.listbox.itemconfig(self.sample_index, {'bg': '#252526', 'fg': 'white'})
-
-            self.network_health = 1 - (self.nbr_of_malicious_sample / (self.sample_index + 1))
-            self.framework.network_health.set(self.network_health)
-            self.framework.health_percentage.configure(text=str(round(self.framework.network_health.get() * 100,1)) + "%")
-
-            self.current_sample = []
-            self.sample_index += 1
-
-    def reset(self):
-        """Resets the packet list and current sample index."""
-        self.packet_list.clear()
-        self.current_sample.clear()
-        self.sample_index = 0
-
-    def packet_thread(self, packet):
-        """thread that handles the incoming packets and append them to the list and processes them."""
-        with self.lock:
-            if self.is_enabled:
-                self.packet_list.append(packet)
-                self.current_sample.append(packet)
-                self.process_current_sample()
-
-
-
 class MeanSharkFramework:
     """
     The main application framework for managing the GUI, packet capture, and interactions.
@@ -126,7 +40,12 @@ class MeanSharkFramework:
         self.model_manager = ModelManager(input_size=46, hidden_size=70, output_size=2)
         self.side_frame = ctk.CTkFrame(self.root)
         self.upper_side_frame = ctk.CTkFrame(self.side_frame)
-        self.packet_manager = PacketManager(self.model_manager, self.create_listbox(),self)
+        self.create_listbox()
+        # Verdicts come from the worker threads, the bus applies them to the widgets from the Tk main loop
+        self.update_bus = UpdateBus(self.root)
+        self.update_bus.subscribe('verdict', self.show_verdicts)
+        self.update_bus.subscribe('health', self.show_network_health, coalesce=True)
+        self.packet_manager = PacketManager(self.model_manager, self.display_verdict)
         self.last_sample_selected = None
         self.sample_selected = None
         self.last_packet_selected = None
@@ -135,9 +54,40 @@ class MeanSharkFramework:
         for a in psutil.net_if_addrs():
             self.interfaces.append(a)
         self.interface_selected = self.interfaces[0]
+        self.capture_backend = None
+        self.bpf_filter = None
+        self.packet_manager.metrics.counter('meanshark_capture_received_total', "Packets seen by the capture.",
+                                            lambda: self.capture_backend.stats()['received'])
+        self.packet_manager.metrics.counter('meanshark_capture_dropped_total', "Packets dropped by the kernel capture.",
+                                            lambda: self.capture_backend.stats()['dropped'])
+        try:
+            self.metrics_server = serve_metrics(self.packet_manager.metrics,
+                                                int(os.getenv('MEANSHARK_METRICS_PORT', 9109)))
+        except OSError as e:
+            print(f"Metrics endpoint unavailable: {e}")
+            self.metrics_server = None
+        self.packet_manager.start_workers()
         self.start_packet_capture()
 
 
+    def display_verdict(self, verdict):
+        """Called by the worker threads for every classified sample: posts it to the GUI update bus."""
+        self.update_bus.post('verdict', verdict)
+        self.update_bus.post('health', verdict['network_health'])
+
+    def show_verdicts(self, verdicts):
+        """Adds the samples classified since the last frame to the listbox (main thread)."""
+        first_index = self.listbox.size()
+        self.listbox.insert(tk.END, *(f"Sample {verdict['sample'] + 1}" for verdict in verdicts))
+        for i, verdict in enumerate(verdicts):
+            if verdict['result'] == 1:
+                self.listbox.itemconfig(first_index + i, {'bg': '#825428', 'fg': 'white'})
+
+    def show_network_health(self, network_health):
+        """Updates the network health display with the latest value (main thread)."""
+        self.network_health.set(network_health)
+        self.health_percentage.configure(text=str(round(network_health * 100,1)) + "%")
+
     def save_capture(self):
         """Saves the current packet capture to a file."""
         file_destination = filedialog.asksaveasfilename(initialdir=os.getcwd(), defaultextension=".pcap",
@@ -160,9 +110,8 @@ class MeanSharkFramework:
                                                                    ("PCAP files", "*.pcap"),
                                                                    ("All files", "*.*")], title="Save Capture as pcap")
         if file_destination:
-            start_index = self.sample_selected * 200
-            end_index = start_index + 200
-            scapy.wrpcap(file_destination, self.packet_manager.packet_list[start_index:end_index])
+            packets = self.packet_manager.packet_list.take(self.packet_manager.samples[self.sample_selected])
+            scapy.wrpcap(file_destination, [packet for packet in packets if packet is not None])
             print(f"Sample saved to {file_destination}")
         else:
             print("No file selected. The capture was not saved.")
@@ -175,8 +124,9 @@ class MeanSharkFramework:
             print(type(self.sample_selected))
             if self.sample_selected != self.last_sample_selected:
                 self.packet_list.delete(0, tk.END)
-                for i in range(200):
-                    self.packet_list.insert(i, self.packet_manager.packet_list[200*self.sample_selected + i].summary())
+                packets = self.packet_manager.packet_list.take(self.packet_manager.samples[self.sample_selected])
+                for i, packet in enumerate(packets):
+                    self.packet_list.insert(i, packet.summary() if packet is not None else "(no longer retained)")
                     self.packet_list.itemconfig(i, {'bg': '#252526', 'fg': 'white'})
                 self.last_sample_selected = self.sample_selected
             else:
@@ -189,10 +139,10 @@ class MeanSharkFramework:
         if selection:
             self.packet_selected = selection[0]
             if self.packet_selected != self.last_packet_selected:
-                packet_index = 200 * self.sample_selected + self.packet_selected
+                packet_index = self.packet_manager.samples[self.sample_selected][self.packet_selected]
                 if 0 <= packet_index < len(self.packet_manager.packet_list):
                     packet = self.packet_manager.packet_list[packet_index]
-                    packet_info = packet.show(dump=True)
+                    packet_info = packet.show(dump=True) if packet is not None else "Packet no longer retained."
                     self.info.configure(state=tk.NORMAL)
                     self.info.delete(1.0, tk.END)
                     self.info.insert(tk.END, packet_info)
@@ -204,9 +154,10 @@ class MeanSharkFramework:
         state = self.launch_switch.get()
         if state == 1:
             print("Switch is On")
+            self.packet_manager.reset()
+            self.update_bus.clear()
             self.listbox.delete(0, tk.END)
             self.packet_list.delete(0, tk.END)
-            self.packet_manager.reset()
             self.packet_selected = None
             self.last_packet_selected = None
             self.sample_selected = None
@@ -216,6 +167,7 @@ class MeanSharkFramework:
             self.info.delete(1.0, tk.END)
             self.info.configure(state=tk.DISABLED)
             self.packet_manager.is_enabled = True
+            self.packet_manager.live = True
             self.interface_selector.configure(state=tk.DISABLED)
             self.interface_selected = str(self.interface_selector.get())
             self.start_packet_capture()
@@ -229,6 +181,7 @@ class MeanSharkFramework:
     def start(self):
         """Starts the main GUI event loop."""
         self.root.after(100, lambda: self.terminal_input.focus())
+        self.update_bus.start()
         self.root.mainloop()
 
     def post_mortem_analyze(self):
@@ -239,8 +192,8 @@ class MeanSharkFramework:
 
         if file_path:
             print(f"Loading file: {file_path}")
-            packets = scapy.rdpcap(file_path)
             self.packet_manager.reset()
+            self.update_bus.clear()
             self.listbox.delete(0, tk.END)
             self.packet_list.delete(0, tk.END)
             self.packet_selected = None
@@ -253,14 +206,29 @@ class MeanSharkFramework:
             self.info.configure(state=tk.DISABLED)
             self.launch_switch.deselect()
             self.interface_selector.configure(state=tk.NORMAL)
+            # Windows close on the packet timestamps only, whatever the processing speed
+            self.packet_manager.live = False
 
-            for packet in packets:
-                self.packet_manager.packet_thread(packet)
-
-            print("Post-Mortem analysis complete.")
+            threading.Thread(target=self.stream_post_mortem, args=(file_path,), daemon=True).start()
         else:
             print("No file selected. Post-mortem analysis aborted.")
 
+    def stream_post_mortem(self, file_path):
+        """Streams a PCAP file into the packet manager with constant memory, reporting progress in bytes."""
+        file_size = os.path.getsize(file_path)
+        last_report = 0
+        try:
+            for packet, bytes_read in DataExtractor.stream_packets(file_path):
+                self.packet_manager.packet_thread(packet, policy='block')
+                if bytes_read - last_report >= 10000000 or bytes_read == file_size:
+                    last_report = bytes_read
+                    print(f"\rPost-Mortem analysis: {bytes_read / 1e6:.1f}/{file_size / 1e6:.1f} MB "
+                          f"({bytes_read / file_size * 100:.0f}%)", end='')
+        except Exception as e:
+            print(f"\nPost-Mortem analysis failed: {e}")
+            return
+        print("\nPost-Mortem analysis complete.")
+
     def execute_command(self,event):
         """Executes terminal commands entered by the user."""
         command = self.terminal_input.get().strip()
@@ -278,6 +246,13 @@ class MeanSharkFramework:
                 shodan arg1 arg2
                     arg1 = command (info, host, scan)
                     arg2 = query
+                filter [expression | clear]
+                    BPF filter of the live capture (tcpdump syntax)
+                rules [add rule | remove n | clear]
+                    allow/deny rules checked before a packet enters a sample,
+                    e.g. rules add deny net=10.0.5.0/24 port=22,873 proto=tcp
+                metrics
+                    throughput, queue depths, drops and stage latencies
                 exit
             """
         elif command_parser[0] == "clear":
@@ -310,6 +285,16 @@ class MeanSharkFramework:
             output = ("MeanShark Framework - version : " + self.information.info['version'] + " released on " +
                       self.information.info['release_date'] + " - Developped by SupMateo : "
                                                               "https://github.com/SupMateo/MeanShark")
+        elif command_parser[0] == "filter":
+            if len(command_parser) > 1:
+                output = self.set_capture_filter(None if command_parser[1:] == ["clear"] else
+                                                 " ".join(command_parser[1:]))
+            else:
+                output = f"Capture filter: {self.bpf_filter or 'none'}"
+        elif command_parser[0] == "rules":
+            output = self.edit_rules(command_parser[1:])
+        elif command_parser[0] == "metrics":
+            output = self.packet_manager.metrics.report()
         elif command_parser[0] == "exit":
             self.root.quit()
             return
@@ -317,6 +302,47 @@ class MeanSharkFramework:
             output = f"Command not recognized: {command}"
         self.append_output(f"{output}\n")
 
+    def set_capture_filter(self, bpf_filter):
+        """Sets the BPF filter of the live capture and restarts it if it is running."""
+        self.bpf_filter = bpf_filter or None
+        if self.capture_backend is not None and self.packet_manager.is_enabled:
+            try:
+                self.start_packet_capture()
+            except Exception as e:
+                return f"Capture filter error: {e}"
+        return f"Capture filter: {self.bpf_filter or 'none'}"
+
+    def edit_rules(self, arguments):
+        """Terminal 'rules' command: lists, adds or removes the exclusion rules."""
+        rules = self.packet_manager.rules
+        try:
+            if arguments[:1] == ["add"]:
+                rules.add(" ".join(arguments[1:]))
+            elif arguments[:1] == ["remove"] and len(arguments) == 2:
+                rules.remove(int(arguments[1]))
+            elif arguments[:1] == ["clear"]:
+                rules.clear()
+            elif arguments:
+                return "Invalid rules command"
+        except (ValueError, IndexError) as e:
+            return f"Rules error: {e}"
+        return rules.summary()
+
+    def ask_capture_filter(self):
+        """Menu entry: asks the BPF filter of the live capture."""
+        dialog = ctk.CTkInputDialog(text="BPF filter (tcpdump syntax), empty for none:", title="Capture filter")
+        bpf_filter = dialog.get_input()
+        if bpf_filter is not None:
+            self.append_output(f"{self.set_capture_filter(bpf_filter.strip())}\n")
+
+    def ask_rule(self):
+        """Menu entry: asks a new exclusion rule."""
+        dialog = ctk.CTkInputDialog(text="Rule, e.g. deny net=10.0.5.0/24 port=22,873 proto=tcp:",
+                                    title="Exclusion rule")
+        rule = dialog.get_input()
+        if rule:
+            self.append_output(f"{self.edit_rules(['add'] + rule.split())}\n")
+
     def show_about(self):
         """Displays an 'About' window with information."""
         about = ctk.CTkToplevel()
@@ -339,6 +365,11 @@ class MeanSharkFramework:
         file_menu.add_command(label="Post-Mortem Analysis", command=self.post_mortem_analyze)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=root.quit)
+        capture_menu = self.menu.menu_bar(text="Capture", tearoff=0, relief="flat")
+        capture_menu.add_command(label="Capture filter", command=self.ask_capture_filter)
+        capture_menu.add_command(label="Add exclusion rule", command=self.ask_rule)
+        capture_menu.add_command(label="Show exclusion rules",
+                                 command=lambda: self.append_output(f"{self.edit_rules([])}\n"))
         about_menu = self.menu.menu_bar(text="About", tearoff=0, relief="flat")
         about_menu.add_command(label="Show About", command=self.show_about)
         self.root.config(menu=self.menu)
@@ -425,7 +456,8 @@ class MeanSharkFramework:
 
     def create_listbox(self):
         """Creates and configures the sample listbox."""
-        self.listbox = tk.Listbox(self.upper_side_frame, bg="#252526", relief="flat", selectmode=tk.SINGLE)
+        self.listbox = tk.Listbox(self.upper_side_frame, bg="#252526", fg="white", relief="flat",
+                                  selectmode=tk.SINGLE)
         self.listbox.pack(side="left", fill="both", padx=10, pady=10, expand=True)
 
         self.listbox.bind("<ButtonRelease-1>", self.on_listbox_click)
@@ -443,12 +475,11 @@ class MeanSharkFramework:
         return self.packet_list
 
     def start_packet_capture(self):
-        """Starts packet capture in a separate thread."""
-        self.thread_sniff = threading.Thread(target=scapy.sniff,
-                                        kwargs={"prn": self.packet_manager.packet_thread, "iface": str(self.interface_selected)},
-                                        daemon=True)
-        self.thread_sniff.start()
-
+        """Starts packet capture on the selected interface (AF_PACKET ring when available, scapy otherwise)."""
+        if self.capture_backend is not None:
+            self.capture_backend.stop()
+        self.capture_backend = make_capture_backend('auto', str(self.interface_selected), self.bpf_filter)
+        self.capture_backend.start(self.packet_manager.packet_batch)
 
 if __name__ == "__main__":
     app = MeanSharkFramework(root)
@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import argparse
+import logging
+import tempfile
+from neural_network.utils import Information
+from core.inference import BACKENDS
+from benchmarks.suites import DEFAULT_SUITES, SUITES, BenchmarkContext, compare, run_suites
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='MeanShark benchmarks on deterministic synthetic traffic.')
+    parser.add_argument('-n', '--packets', type=int, default=10000,
+                        help='Number of packets of the synthetic capture (10k to 10M).')
+    parser.add_argument('--sample-packets', type=int, default=10000,
+                        help='Number of packets loaded in memory for the per-function suites.')
+    parser.add_argument('--flows', type=int, default=100, help='Number of flows of the synthetic capture.')
+    parser.add_argument('--mix', default=None,
+                        help='Share of every kind of flow, e.g. "tcp=0.6,udp=0.25,arp=0.05,ipv6=0.1".')
+    parser.add_argument('--payload', default='0-1400', help='Range of the payload sizes in bytes, e.g. 0-1400.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic capture.')
+    parser.add_argument('-s', '--suite', action='append', choices=SUITES, default=None,
+                        help=f'Suite to run (can be repeated), all but backends by default: {", ".join(SUITES)}.')
+    parser.add_argument('--backend', choices=BACKENDS, default='eager', help='Inference backend of the model.')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs of every suite, the best one is kept.')
+    parser.add_argument('--pcap-dir', default=os.path.join(tempfile.gettempdir(), 'meanshark-benchmarks'),
+                        help='Directory of the generated captures, reused between runs.')
+    parser.add_argument('-o', '--output', help='Write the results as JSON to this file (stdout by default).')
+    parser.add_argument('-b', '--baseline', help='Compare with the results of a previous run and fail on '
+                                                 'regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Largest accepted slowdown against the baseline, as a fraction (0.2 = 20%%).')
+    args = parser.parse_args()
+    Information()
+
+    traffic_options = {'nbr_of_flows': args.flows,
+                       'payload_sizes': tuple(int(size) for size in args.payload.split('-'))}
+    if args.mix:
+        traffic_options['mix'] = {kind: float(share) for kind, share in
+                                  (item.split('=') for item in args.mix.split(','))}
+    context = BenchmarkContext(args.pcap_dir, args.packets, args.sample_packets, args.seed, args.backend,
+                               args.repeats, **traffic_options)
+    results = run_suites(context, args.suite or DEFAULT_SUITES)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results['regressions'] = compare(results, baseline, args.tolerance)
+        for regression in results['regressions']:
+            logging.error(f"Regression: {regression}")
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if results.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
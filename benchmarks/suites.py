@@ -0,0 +1,253 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import platform
+import numpy as np
+from scapy.utils import PcapReader
+from neural_network.extracting import DataExtractor
+from neural_network.processing import PACKETS_BY_SAMPLE, BatchProcessor, Processor, clear_encoding_caches, \
+    encoding_cache_stats
+from core.capture import PcapReplayBackend
+from core.inference import make_model_manager, measure_startup
+from core.pipeline import PacketManager
+from core.windowing import PacketWindow
+from benchmarks.traffic import synthetic_pcap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BenchmarkContext:
+    """
+    Inputs shared by the suites: the synthetic capture, its first sample_packets packets (in memory) and the
+    model backend. The capture is generated once per set of arguments in directory.
+    """
+    def __init__(self, directory, nbr_of_packets=10000, sample_packets=10000, seed=0, backend='eager', repeats=3,
+                 **traffic_options):
+        self.directory = directory
+        self.nbr_of_packets = nbr_of_packets
+        self.seed = seed
+        self.backend = backend
+        self.repeats = repeats
+        self.traffic_options = traffic_options
+        self.pcap = synthetic_pcap(directory, nbr_of_packets, seed, **traffic_options)
+        with PcapReader(self.pcap) as reader:
+            self.packets = [packet for packet, _ in zip(reader, range(min(sample_packets, nbr_of_packets)))]
+        self._model_manager = None
+        self._windows = None
+
+    @property
+    def model_manager(self):
+        if self._model_manager is None:
+            self._model_manager = make_model_manager(self.backend, model_path(self.backend))
+        return self._model_manager
+
+    @property
+    def windows(self):
+        # (samples, x_stats) of the disjoint windows of the sample packets, as the model consumes them
+        if self._windows is None:
+            samples, x_stats = [], []
+            for start in range(0, len(self.packets) - PACKETS_BY_SAMPLE + 1, PACKETS_BY_SAMPLE):
+                columns = DataExtractor().extract_columns(self.packets[start:start + PACKETS_BY_SAMPLE])
+                processed = BatchProcessor(columns).process()
+                samples.append(processed.to_array())
+                x_stats.append(processed.stats)
+            self._windows = np.stack(samples), np.array(x_stats, dtype=np.float32)
+        return self._windows
+
+
+def model_path(backend):
+    return os.path.join(ROOT, "neural_network", "model.onnx" if backend == 'onnx' else "model.pt")
+
+
+def best_time(function, repeats):
+    """Best wall time of repeats calls of function (after one warm-up call), with its last result."""
+    result = function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def bench_make_packet_obj(context):
+    """DataExtractor.make_packet_obj over the sample packets."""
+    elapsed, _ = best_time(lambda: [DataExtractor.make_packet_obj(packet, i)
+                                    for i, packet in enumerate(context.packets)], context.repeats)
+    return {'packets_per_s': len(context.packets) / elapsed}
+
+
+def bench_processor(context):
+    """Processor (ProcessedPacket per packet) and BatchProcessor over windows of the sample packets."""
+    extractor = DataExtractor()
+    windows = [context.packets[start:start + PACKETS_BY_SAMPLE]
+               for start in range(0, len(context.packets) - PACKETS_BY_SAMPLE + 1, PACKETS_BY_SAMPLE)]
+    data_captures = [extractor.extract_data(split_capture=window) for window in windows]
+    columns = [extractor.extract_columns(window) for window in windows]
+
+    def process():
+        # Cold encoding caches (ip, port, flags, header) at every run, the hit rates are those of one pass
+        clear_encoding_caches()
+        return [Processor(data_capture).output for data_capture in data_captures]
+
+    elapsed, _ = best_time(process, context.repeats)
+    caches = encoding_cache_stats()
+    batch_elapsed, _ = best_time(lambda: [BatchProcessor(window).process() for window in columns], context.repeats)
+    nbr_of_packets = len(windows) * PACKETS_BY_SAMPLE
+    return {'packets_per_s': nbr_of_packets / elapsed,
+            'batch_packets_per_s': nbr_of_packets / batch_elapsed,
+            'ip_cache_hit_rate': caches['ip']['hits'] / max(1, caches['ip']['hits'] + caches['ip']['misses']),
+            'header_cache_hit_rate': caches['header']['hits'] / max(1, caches['header']['hits']
+                                                                    + caches['header']['misses'])}
+
+
+def bench_predict(context):
+    """ModelManager.predict (one window per call) and predict_batch (batches of 32 windows)."""
+    samples, x_stats = context.windows
+    single = context.model_manager.benchmark(samples, x_stats, batch_size=1, repeats=context.repeats)
+    batched = context.model_manager.benchmark(samples, x_stats, batch_size=32, repeats=context.repeats)
+    return {'windows_per_s': single['windows_per_s'], 'latency_ms': single['latency_ms'],
+            'batch_windows_per_s': batched['windows_per_s']}
+
+
+def bench_build_raw_dataset(context):
+    """DatasetMaker.build_raw_dataset in one process over the capture (as malicious) and another seed (normal)."""
+    neural_network = os.path.join(ROOT, "neural_network")
+    if neural_network not in sys.path:
+        # The training modules import each other as top-level modules
+        sys.path.append(neural_network)
+    from dataset_maker import DatasetMaker
+
+    directory = tempfile.mkdtemp(prefix="meanshark-bench-")
+    try:
+        for kind, seed in (('malicious', context.seed), ('normal', context.seed + 1)):
+            os.makedirs(os.path.join(directory, kind))
+            pcap = synthetic_pcap(context.directory, min(context.nbr_of_packets, 10000), seed,
+                                  **context.traffic_options)
+            os.symlink(pcap, os.path.join(directory, kind, os.path.basename(pcap)))
+        maker = DatasetMaker(os.path.join(directory, 'malicious'), os.path.join(directory, 'normal'))
+        elapsed, (features, _, _) = best_time(lambda: maker.build_raw_dataset(nbr_of_workers=1, seed=0),
+                                              context.repeats)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {'samples_per_s': len(features) / elapsed}
+
+
+def bench_sliding_windows(context, stride=20):
+    """PacketWindow with a stride of 20 packets over the sample packets (features computed once)."""
+    columns = DataExtractor().extract_columns(context.packets)
+    features = BatchProcessor(columns).process_features()
+
+    def push():
+        window = PacketWindow(PACKETS_BY_SAMPLE, stride)
+        return sum(len(window.push(columns.take(np.arange(start, min(start + stride, len(columns)))),
+                                   features[start:start + stride]))
+                   for start in range(0, len(columns), stride))
+
+    elapsed, nbr_of_windows = best_time(push, context.repeats)
+    return {'windows_per_s': nbr_of_windows / elapsed, 'packets_per_s': len(columns) / elapsed}
+
+
+def bench_pipeline(context, nbr_of_workers=2):
+    """End-to-end PacketManager: the whole capture replayed, extracted, windowed and classified."""
+    def run():
+        packet_manager = PacketManager(context.model_manager, policy='block', live=False)
+        packet_manager.start_workers(nbr_of_workers)
+        try:
+            backend = PcapReplayBackend(context.pcap)
+            start = time.perf_counter()
+            backend.start(packet_manager.packet_batch)
+            backend.wait()
+            packet_manager.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            # Workers and inference batcher of every repeat
+            packet_manager.stop_workers()
+        return elapsed, packet_manager.sample_index
+
+    elapsed, nbr_of_windows = min(run() for _ in range(context.repeats))
+    return {'packets_per_s': context.nbr_of_packets / elapsed, 'windows_per_s': nbr_of_windows / elapsed}
+
+
+def bench_startup(context):
+    """Startup time and peak memory of the backend in a fresh interpreter (see measure_startup)."""
+    result = measure_startup(context.backend, model_path(context.backend))
+    return {'startup_s': result['startup_s'], 'max_rss_mb': result['max_rss_mb']}
+
+
+def bench_backends(context):
+    """Every inference backend against eager (see compare_backends), on the windows of the sample packets."""
+    from core.model_manager import compare_backends
+    samples, x_stats = context.windows
+    report = compare_backends(samples, x_stats, model_path=model_path('eager'), onnx_path=model_path('onnx'),
+                              repeats=context.repeats)
+    results = {}
+    for backend, values in report.items():
+        for name, value in values.items():
+            if name in ('agreement', 'windows_per_s'):
+                results[f"{backend}_{name}"] = value
+    return results
+
+
+SUITES = {
+    'make_packet_obj': bench_make_packet_obj,
+    'processor': bench_processor,
+    'predict': bench_predict,
+    'build_raw_dataset': bench_build_raw_dataset,
+    'sliding_windows': bench_sliding_windows,
+    'pipeline': bench_pipeline,
+    'startup': bench_startup,
+    'backends': bench_backends,
+}
+# 'backends' loads every PyTorch backend (torch.compile can take minutes), it only runs when asked for
+DEFAULT_SUITES = tuple(name for name in SUITES if name != 'backends')
+
+
+def run_suites(context, names=DEFAULT_SUITES):
+    """Runs the suites and returns the results with the description of the run."""
+    results = {'meta': {'python': platform.python_version(), 'machine': platform.machine(),
+                        'cpus': os.cpu_count(), 'packets': context.nbr_of_packets,
+                        'sample_packets': len(context.packets), 'seed': context.seed, 'backend': context.backend,
+                        'traffic': {key: str(value) for key, value in context.traffic_options.items()},
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'suites': {}}
+    for name in names:
+        logging.info(f"Running {name}...")
+        try:
+            results['suites'][name] = SUITES[name](context)
+        except Exception as e:
+            logging.error(f"{name} failed: {e}")
+            results['suites'][name] = {'error': str(e)}
+        logging.info(f"{name}: {results['suites'][name]}")
+    return results
+
+
+def higher_is_better(metric):
+    # Throughputs, hit rates and agreements must not drop, times and memory must not grow
+    return not metric.endswith(('_s', '_ms', '_mb')) or metric.endswith('_per_s')
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares results with a baseline run. Returns the regressions: metrics more than tolerance (a fraction)
+    worse than in the baseline, and suites that failed while they ran in the baseline.
+    """
+    regressions = []
+    for suite, baseline_metrics in baseline.get('suites', {}).items():
+        metrics = results['suites'].get(suite)
+        if metrics is None or 'error' in baseline_metrics:
+            continue
+        if 'error' in metrics:
+            regressions.append(f"{suite}: failed ({metrics['error']})")
+            continue
+        for metric, reference in baseline_metrics.items():
+            value = metrics.get(metric)
+            if value is None or not reference:
+                continue
+            change = (value - reference) / abs(reference)
+            if (change < -tolerance) if higher_is_better(metric) else (change > tolerance):
+                regressions.append(f"{suite}.{metric}: {value:.4g} vs {reference:.4g} ({change:+.1%})")
+    return regressions
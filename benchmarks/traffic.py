@@ -0,0 +1,126 @@
+import os
+import random
+import itertools
+import struct
+import logging
+import ipaddress
+import collections
+from scapy.utils import RawPcapWriter, checksum
+
+
+# Share of every kind of packet in the generated traffic
+DEFAULT_MIX = {'tcp': 0.6, 'udp': 0.25, 'arp': 0.05, 'ipv6': 0.1}
+# TCP flags of the packets of a flow (mostly ACK and PSH-ACK, like real traffic)
+TCP_FLAGS = {0x10: 50, 0x18: 30, 0x02: 5, 0x12: 5, 0x11: 5, 0x04: 3, 0x19: 2}
+
+Flow = collections.namedtuple('Flow', ['kind', 'mac_src', 'mac_dst', 'ip_src', 'ip_dst', 'port_src', 'port_dst',
+                                       'protocol'])
+
+
+def make_flow(rng, kind):
+    """Draws the endpoints of a flow of the given kind ('tcp', 'udp', 'arp' or 'ipv6')."""
+    mac_src, mac_dst = (b'\x02' + rng.randbytes(5) for _ in range(2))
+    if kind == 'ipv6':
+        ip_src, ip_dst = (ipaddress.IPv6Address(b'\xfd\x00' + rng.randbytes(14)).packed for _ in range(2))
+        protocol = rng.choice((6, 17))
+    else:
+        ip_src, ip_dst = (bytes((10, rng.randrange(4), rng.randrange(256), rng.randrange(1, 255))) for _ in range(2))
+        protocol = {'tcp': 6, 'udp': 17, 'arp': 0}[kind]
+    port_dst = rng.choice((53, 80, 123, 443, 445, 873, 3306, 8080)) if rng.random() < 0.7 else rng.randrange(1, 65536)
+    return Flow(kind, mac_src, mac_dst, ip_src, ip_dst, rng.randrange(1024, 65536), port_dst, protocol)
+
+
+def transport_header(flow, ip_src, ip_dst, port_src, port_dst, payload, rng, pseudo_header):
+    """TCP or UDP header of a packet, with its checksum."""
+    if flow.protocol == 6:
+        flags = rng.choices(list(TCP_FLAGS), weights=list(TCP_FLAGS.values()))[0]
+        header = struct.pack('!HHIIBBHHH', port_src, port_dst, rng.getrandbits(32), rng.getrandbits(32), 5 << 4,
+                             flags, 65535, 0, 0)
+        offset = 16
+    else:
+        header = struct.pack('!HHHH', port_src, port_dst, 8 + len(payload), 0)
+        offset = 6
+    segment = header + payload
+    value = checksum(pseudo_header(len(segment)) + segment)
+    if flow.protocol == 17 and value == 0:
+        value = 0xffff
+    return header[:offset] + struct.pack('!H', value) + header[offset + 2:]
+
+
+def make_frame(flow, payload, rng):
+    """Builds the raw Ethernet frame of a packet of a flow, in a random direction."""
+    reverse = rng.random() < 0.4
+    mac_src, mac_dst = (flow.mac_dst, flow.mac_src) if reverse else (flow.mac_src, flow.mac_dst)
+    ip_src, ip_dst = (flow.ip_dst, flow.ip_src) if reverse else (flow.ip_src, flow.ip_dst)
+    port_src, port_dst = (flow.port_dst, flow.port_src) if reverse else (flow.port_src, flow.port_dst)
+
+    if flow.kind == 'arp':
+        arp = struct.pack('!HHBBH6s4s6s4s', 1, 0x0800, 6, 4, 2 if reverse else 1, mac_src, ip_src,
+                          mac_dst if reverse else b'\x00' * 6, ip_dst)
+        return (mac_dst if reverse else b'\xff' * 6) + mac_src + b'\x08\x06' + arp
+
+    if flow.kind == 'ipv6':
+        def pseudo_header(length):
+            return ip_src + ip_dst + struct.pack('!I3xB', length, flow.protocol)
+
+        segment = transport_header(flow, ip_src, ip_dst, port_src, port_dst, payload, rng, pseudo_header) + payload
+        ip = struct.pack('!IHBB', 6 << 28, len(segment), flow.protocol, 64) + ip_src + ip_dst
+        return mac_dst + mac_src + b'\x86\xdd' + ip + segment
+
+    def pseudo_header(length):
+        return ip_src + ip_dst + struct.pack('!xBH', flow.protocol, length)
+
+    segment = transport_header(flow, ip_src, ip_dst, port_src, port_dst, payload, rng, pseudo_header) + payload
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(segment), rng.getrandbits(16), 0x4000, 64,
+                     flow.protocol, 0, ip_src, ip_dst)
+    ip = ip[:10] + struct.pack('!H', checksum(ip)) + ip[12:]
+    return mac_dst + mac_src + b'\x08\x00' + ip + segment
+
+
+def generate_pcap(path, nbr_of_packets=10000, mix=None, payload_sizes=(0, 1400), nbr_of_flows=100, seed=0,
+                  rate=2000.0, start_time=1700000000.0):
+    """
+    Writes a deterministic synthetic capture: nbr_of_packets Ethernet frames of nbr_of_flows flows drawn with the
+    mix of packet kinds (see DEFAULT_MIX), payloads of payload_sizes (min, max) bytes (text or binary), about
+    rate packets per second. A few flows carry most of the packets, like real traffic.
+    The same arguments always give the same file. Frames are packed directly (building them with scapy would
+    take hours for 10M packets) and written with scapy's pcap writer.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=nbr_of_flows)
+    flows = [make_flow(rng, kind) for kind in kinds]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(nbr_of_flows)))
+    packet_time = start_time
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    writer = RawPcapWriter(path, linktype=1, sync=False)
+    writer.write_header(None)
+    try:
+        for i in range(nbr_of_packets):
+            flow = rng.choices(flows, cum_weights=cum_weights)[0]
+            size = rng.randint(*payload_sizes) if flow.kind != 'arp' else 0
+            if rng.random() < 0.3:
+                payload = bytes(rng.choices(b'abcdefghijklmnopqrstuvwxyz0123456789 =&/', k=size))
+            else:
+                payload = rng.randbytes(size)
+            packet_time += rng.expovariate(rate)
+            sec = int(packet_time)
+            writer.write_packet(make_frame(flow, payload, rng), sec=sec, usec=int((packet_time - sec) * 1e6))
+            if (i + 1) % 1000000 == 0:
+                logging.info(f"{i + 1}/{nbr_of_packets} packets generated")
+    finally:
+        writer.close()
+    return path
+
+
+def synthetic_pcap(directory, nbr_of_packets=10000, seed=0, **options):
+    """Path of a generated capture in directory, generated on the first call with these arguments only."""
+    name = "_".join([f"synthetic_{nbr_of_packets}_{seed}"] +
+                    [f"{key}-{value}" for key, value in sorted(options.items())])
+    path = os.path.join(directory, "".join(c if c.isalnum() or c in '_-.' else '-' for c in name) + ".pcap")
+    if not os.path.isfile(path):
+        logging.info(f"Generating {path}")
+        generate_pcap(path + ".part", nbr_of_packets, seed=seed, **options)
+        os.replace(path + ".part", path)
+    return path
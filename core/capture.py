@@ -0,0 +1,299 @@
+import sys
+import mmap
+import time
+import select
+import socket
+import struct
+import logging
+import threading
+from scapy.config import conf
+from scapy.layers.l2 import Ether
+from scapy.sendrecv import AsyncSniffer
+from scapy.utils import RawPcapReader
+
+
+# 'auto' uses the AF_PACKET ring on Linux when the socket can be opened (root or CAP_NET_RAW), scapy otherwise
+CAPTURE_BACKENDS = ('auto', 'af_packet', 'scapy')
+
+# linux/if_ether.h and linux/if_packet.h
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+DLT_EN10MB = 1
+
+
+class RawFrame(bytes):
+    """
+    Raw Ethernet frame with its capture time (epoch seconds), as delivered by the capture backends.
+    It is dissected only when needed (feature extraction, packet inspection in the GUI).
+    """
+    def __new__(cls, data, time):
+        frame = super().__new__(cls, data)
+        frame.time = time
+        return frame
+
+    def dissect(self):
+        packet = Ether(bytes(self))
+        packet.time = self.time
+        return packet
+
+
+class CaptureBackend:
+    """
+    Common interface of the capture backends: start(on_packets) runs the capture in a thread and calls
+    on_packets with every batch of packets (RawFrame or scapy packets), stop() ends it.
+    stats() returns the packets received and dropped by the kernel (None when the backend cannot tell).
+    bpf_filter is a BPF filter expression (tcpdump syntax) applied in the kernel, it needs libpcap to be compiled.
+    """
+    name = None
+
+    def __init__(self, interface=None, bpf_filter=None):
+        self.interface = interface
+        self.bpf_filter = bpf_filter
+        self.received = 0
+        self.dropped = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def open(self):
+        """Opens the capture, errors (e.g. missing privileges) are raised here rather than in the thread."""
+
+    def close(self):
+        """Releases the capture resources once the thread ended."""
+
+    def run(self, on_packets):
+        raise NotImplementedError
+
+    def start(self, on_packets):
+        """Opens the capture and runs it in a daemon thread."""
+        self.stopping.clear()
+        self.open()
+        self.thread = threading.Thread(target=self.capture, args=(on_packets,), daemon=True)
+        self.thread.start()
+
+    def capture(self, on_packets):
+        try:
+            self.run(on_packets)
+        except Exception as e:
+            logging.error(f"{self.name} capture failed: {e}")
+        finally:
+            self.close()
+
+    def wait(self, timeout=None):
+        """Waits for the end of the capture (end of a replay), returns whether it ended."""
+        if self.thread is not None:
+            self.thread.join(timeout)
+            return not self.thread.is_alive()
+        return True
+
+    def stop(self):
+        """Stops the capture and waits for its thread."""
+        self.stopping.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def stats(self):
+        return {'received': self.received, 'dropped': self.dropped}
+
+
+class AfPacketBackend(CaptureBackend):
+    """
+    Linux AF_PACKET capture with a TPACKET_V3 memory-mapped ring of block_count blocks of block_size bytes
+    (4 MiB by default, the ring is locked in kernel memory).
+    The kernel fills whole blocks of frames (or retires a block after block_timeout ms), the backend hands every
+    block to on_packets as one batch of RawFrame and gives it back to the kernel: there is no system call per
+    packet, only a poll() when the ring is empty. Drops are read from the kernel PACKET_STATISTICS counters.
+    """
+    name = 'af_packet'
+
+    def __init__(self, interface=None, bpf_filter=None, block_size=2 ** 20, block_count=4, frame_size=2048,
+                 block_timeout=64):
+        super().__init__(interface, bpf_filter)
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self.block_timeout = block_timeout
+        self.socket = None
+        self.ring = None
+        self.freeze_q = 0
+
+    def open(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError("AF_PACKET capture is only available on Linux")
+        self.received = self.dropped = self.freeze_q = 0
+        # A socket of protocol 0 receives nothing until it is bound to the interface, so that the ring only ever
+        # holds the frames of this interface. Without interface, the frames of every interface are captured.
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                                    0 if self.interface else socket.htons(ETH_P_ALL))
+        try:
+            if self.bpf_filter:
+                # Attached before the bind and the ring so that no unfiltered frame gets in
+                from scapy.arch.linux import attach_filter
+                attach_filter(self.socket, self.bpf_filter, self.interface)
+            if self.interface:
+                self.socket.bind((self.interface, ETH_P_ALL))
+            self.socket.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            # struct tpacket_req3: block size, block count, frame size, frame count, block timeout (ms),
+            # private area size, features
+            request = struct.pack('IIIIIII', self.block_size, self.block_count, self.frame_size,
+                                  self.block_size * self.block_count // self.frame_size, self.block_timeout, 0, 0)
+            self.socket.setsockopt(SOL_PACKET, PACKET_RX_RING, request)
+            self.ring = mmap.mmap(self.socket.fileno(), self.block_size * self.block_count, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+        except (OSError, ImportError):
+            self.close()
+            raise
+
+    def close(self):
+        if self.socket is not None:
+            self.update_stats()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def read_block(self, block):
+        """Returns the frames of a block released by the kernel, None if the kernel still owns it."""
+        base = block * self.block_size
+        # struct tpacket_block_desc: version, offset_to_priv, then block_status, num_pkts, offset_to_first_pkt
+        status, nbr_of_packets, offset = struct.unpack_from('III', self.ring, base + 8)
+        if not status & TP_STATUS_USER:
+            return None
+        frames = []
+        offset += base
+        for _ in range(nbr_of_packets):
+            # struct tpacket3_hdr: next_offset, sec, nsec, snaplen, len, status, mac, net
+            next_offset, sec, nsec, snaplen, _, _, mac, _ = struct.unpack_from('IIIIIIHH', self.ring, offset)
+            frames.append(RawFrame(self.ring[offset + mac:offset + mac + snaplen], sec + nsec / 1e9))
+            offset += next_offset
+        struct.pack_into('I', self.ring, base + 8, TP_STATUS_KERNEL)
+        return frames
+
+    def run(self, on_packets):
+        poller = select.poll()
+        poller.register(self.socket.fileno(), select.POLLIN | select.POLLERR)
+        block = 0
+        while not self.stopping.is_set():
+            frames = self.read_block(block)
+            if frames is None:
+                poller.poll(100)
+                continue
+            block = (block + 1) % self.block_count
+            if frames:
+                on_packets(frames)
+
+    def update_stats(self):
+        # struct tpacket_stats_v3: packets (drops included), drops, freeze_q_cnt, reset by every read
+        packets, drops, freeze_q = struct.unpack('III', self.socket.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12))
+        self.received += packets
+        self.dropped += drops
+        self.freeze_q += freeze_q
+
+    def stats(self):
+        if self.socket is not None:
+            self.update_stats()
+        return dict(super().stats(), freeze_q=self.freeze_q)
+
+
+class ScapySniffBackend(CaptureBackend):
+    """Portable fallback: scapy's sniffer, every packet is dissected and delivered on its own."""
+    name = 'scapy'
+
+    def __init__(self, interface=None, bpf_filter=None):
+        super().__init__(interface, bpf_filter)
+        self.dropped = None
+
+    def run(self, on_packets):
+        def on_packet(packet):
+            self.received += 1
+            on_packets([packet])
+
+        sniffer = AsyncSniffer(iface=self.interface, filter=self.bpf_filter, prn=on_packet, store=False)
+        sniffer.start()
+        self.stopping.wait()
+        if sniffer.running:
+            sniffer.stop()
+
+
+class PcapReplayBackend(CaptureBackend):
+    """
+    Replays a capture file as a capture backend (tests, benchmarks), by batches of batch_size RawFrame read
+    without dissection. speed=None replays as fast as possible, speed=1.0 at the pace of the capture.
+    """
+    name = 'replay'
+
+    def __init__(self, path, speed=None, batch_size=256):
+        super().__init__(path)
+        self.path = path
+        self.speed = speed
+        self.batch_size = batch_size
+
+    def frames(self):
+        """Yields the packets of the file, as RawFrame for Ethernet captures."""
+        with RawPcapReader(self.path) as reader:
+            for data, metadata in reader:
+                if hasattr(metadata, 'sec'):
+                    packet_time = metadata.sec + metadata.usec / (1e9 if reader.nano else 1e6)
+                else:
+                    packet_time = ((metadata.tshigh << 32) + metadata.tslow) / metadata.tsresol
+                linktype = getattr(metadata, 'linktype', reader.linktype)
+                if linktype == DLT_EN10MB:
+                    yield RawFrame(data, packet_time)
+                else:
+                    packet = conf.l2types.num2layer[linktype](data)
+                    packet.time = packet_time
+                    yield packet
+
+    def run(self, on_packets):
+        batch = []
+        first_time = start = None
+        for packet in self.frames():
+            if self.stopping.is_set():
+                return
+            if self.speed:
+                if first_time is None:
+                    first_time, start = float(packet.time), time.monotonic()
+                delay = (float(packet.time) - first_time) / self.speed - (time.monotonic() - start)
+                if delay > 0:
+                    if batch:
+                        on_packets(batch)
+                        batch = []
+                    time.sleep(delay)
+            batch.append(packet)
+            self.received += 1
+            if len(batch) >= self.batch_size:
+                on_packets(batch)
+                batch = []
+        if batch:
+            on_packets(batch)
+
+
+def make_capture_backend(name='auto', interface=None, bpf_filter=None, ring_size=4):
+    """
+    Returns the capture backend of an interface. 'auto' falls back to scapy when the AF_PACKET ring cannot be
+    opened (not Linux, not enough privileges, no libpcap to compile the BPF filter).
+    ring_size is the size of the AF_PACKET ring in MiB (blocks of 1 MiB).
+    """
+    if name not in CAPTURE_BACKENDS:
+        raise ValueError(f"Unknown capture backend {name!r}, expected one of {CAPTURE_BACKENDS}")
+    if name == 'scapy':
+        return ScapySniffBackend(interface, bpf_filter)
+    if ring_size < 1:
+        raise ValueError(f"The capture ring needs at least 1 MiB, got {ring_size}")
+    backend = AfPacketBackend(interface, bpf_filter, block_size=2 ** 20, block_count=int(ring_size))
+    if name == 'auto':
+        try:
+            backend.open()
+        except (OSError, ImportError, AttributeError) as e:
+            logging.warning(f"AF_PACKET capture unavailable ({e}), falling back to scapy")
+            return ScapySniffBackend(interface, bpf_filter)
+        backend.close()
+    return backend
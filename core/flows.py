@@ -0,0 +1,264 @@
+import struct
+import socket
+import zlib
+import logging
+import collections
+import multiprocessing
+import numpy as np
+from neural_network.processing import BatchProcessor
+from neural_network.extracting import DataExtractor
+from core.windowing import PacketWindow
+
+
+class FlowTable:
+    """
+    Per-flow windows: packets are grouped by flow and every flow has its own PacketWindow, so that a noisy host
+    does not dilute the samples of the others. A flow is keyed by '5-tuple' (both endpoints with their ports and
+    the protocol) or by 'host' pair, in both directions.
+    Flows are evicted, least recently used first, when idle for idle_timeout seconds (packet time), when there
+    are more than max_flows flows, or when the estimated memory of the table exceeds memory_budget bytes.
+    An evicted flow is classified with the packets it holds that were not classified yet, padded (see
+    PacketWindow.flush), so that short flows get a verdict too.
+    """
+    keys = ('5-tuple', 'host')
+    # Rough memory held by a packet in a window (features row + WindowPacket) and by an empty flow
+    packet_bytes = 46 * 4 + 250
+    flow_bytes = 2000
+
+    def __init__(self, key='5-tuple', window_size=200, mode='first', window_time=1.0, max_flows=10000,
+                 idle_timeout=60.0, memory_budget=256 * 2 ** 20):
+        if key not in self.keys:
+            raise ValueError(f"Unknown flow key {key}, expected one of {self.keys}")
+        self.key = key
+        self.window_size = window_size
+        self.mode = mode
+        self.window_time = window_time
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.memory_budget = memory_budget
+        self.stride = window_size
+        # flow -> PacketWindow, least recently used first
+        self.flows = collections.OrderedDict()
+        self.held_packets = 0
+        self.evicted = 0
+        self.last_time = None
+
+    def __len__(self):
+        return len(self.flows)
+
+    @property
+    def memory_usage(self):
+        # Estimated bytes held by the windows of the table
+        return self.held_packets * self.packet_bytes + len(self.flows) * self.flow_bytes
+
+    @staticmethod
+    def endpoint(ip, port):
+        return f"{ip}:{int(port)}" if port == port else str(ip)
+
+    def flow_keys(self, columns):
+        """Flow of every packet of a ColumnarCapture, the same in both directions."""
+        keys = []
+        for ip_src, ip_dst, port_src, port_dst, protocol in zip(columns.ip_src, columns.ip_dst,
+                                                                  columns.port_src.tolist(),
+                                                                  columns.port_dst.tolist(),
+                                                                  columns.protocol.tolist()):
+            if self.key == 'host':
+                keys.append("-".join(sorted((str(ip_src), str(ip_dst)))))
+            else:
+                endpoints = sorted((self.endpoint(ip_src, port_src), self.endpoint(ip_dst, port_dst)))
+                keys.append(f"{endpoints[0]}-{endpoints[1]}/{int(protocol) if protocol == protocol else '-'}")
+        return keys
+
+    def push(self, columns, features, indices):
+        """
+        Dispatches packets (ColumnarCapture, BatchProcessor features, indices in the packet list) to the windows of
+        their flows. Returns the samples completed meanwhile, including those of evicted flows (see
+        PacketWindow.make_sample, the flow is the last item).
+        """
+        rows_by_flow = collections.defaultdict(list)
+        for row, flow in enumerate(self.flow_keys(columns)):
+            rows_by_flow[flow].append(row)
+        indices = np.asarray(indices)
+
+        samples = []
+        for flow, rows in rows_by_flow.items():
+            window = self.flows.get(flow)
+            if window is None:
+                window = PacketWindow(self.window_size, None, self.mode, self.window_time, flow)
+                self.flows[flow] = window
+            else:
+                self.flows.move_to_end(flow)
+            rows = np.asarray(rows)
+            held = len(window)
+            samples += window.push(columns.take(rows), features[rows], indices[rows])
+            self.held_packets += len(window) - held
+        if len(columns):
+            self.last_time = float(columns.time.max())
+        samples += self.evict()
+        return samples
+
+    def evict(self):
+        """Evicts the idle flows, then the least recently used ones while the table is over its limits."""
+        samples = []
+        while self.flows:
+            flow, window = next(iter(self.flows.items()))
+            idle = (window.packets and self.last_time is not None
+                    and self.last_time - window.packets[-1].time >= self.idle_timeout)
+            over_limits = len(self.flows) > self.max_flows or self.memory_usage > self.memory_budget
+            if not (idle or over_limits or not window.packets):
+                break
+            del self.flows[flow]
+            self.held_packets -= len(window)
+            self.evicted += 1
+            samples += window.flush()
+        return samples
+
+    def expire(self):
+        """Time modes: returns the samples of the flows whose interval elapsed on the local clock."""
+        samples = []
+        if self.mode != 'count':
+            for window in self.flows.values():
+                held = len(window)
+                samples += window.expire()
+                self.held_packets -= held - len(window)
+        return samples
+
+    def flush(self):
+        """Returns the samples of the packets not classified yet of every flow and empties the table."""
+        samples = []
+        for window in self.flows.values():
+            samples += window.flush()
+        self.flows.clear()
+        self.held_packets = 0
+        return samples
+
+
+def frame_fields(frame):
+    """
+    (ip_src, ip_dst, port_src, port_dst, protocol) of a raw Ethernet frame, read directly from the IPv4/IPv6/ARP
+    and TCP/UDP/SCTP headers without dissecting it. Addresses are packed bytes, missing fields are None and ARP has
+    the protocol 0 (like in DataExtractor.make_packet_row).
+    """
+    ether_type = struct.unpack_from('!H', frame, 12)[0] if len(frame) >= 14 else None
+    offset = 14
+    while ether_type in (0x8100, 0x88a8) and len(frame) >= offset + 4:
+        ether_type = struct.unpack_from('!H', frame, offset + 2)[0]
+        offset += 4
+    ports_offset = None
+    if ether_type == 0x0800 and len(frame) >= offset + 20:
+        protocol = frame[offset + 9]
+        addresses = (frame[offset + 12:offset + 16], frame[offset + 16:offset + 20])
+        ports_offset = offset + (frame[offset] & 0x0f) * 4
+    elif ether_type == 0x86dd and len(frame) >= offset + 40:
+        protocol = frame[offset + 6]
+        addresses = (frame[offset + 8:offset + 24], frame[offset + 24:offset + 40])
+        ports_offset = offset + 40
+    elif ether_type == 0x0806 and len(frame) >= offset + 28:
+        protocol = 0
+        addresses = (frame[offset + 14:offset + 18], frame[offset + 24:offset + 28])
+    else:
+        return None, None, None, None, None
+
+    port_src = port_dst = None
+    if protocol in (socket.IPPROTO_TCP, socket.IPPROTO_UDP, 132) and len(frame) >= ports_offset + 4:
+        port_src, port_dst = struct.unpack_from('!HH', frame, ports_offset)
+    return addresses[0], addresses[1], port_src, port_dst, protocol
+
+
+def frame_flow_hash(frame, key='5-tuple'):
+    """
+    Stable hash of the flow of a raw Ethernet frame, the same in both directions (see frame_fields), so that
+    packets can be sharded without being dissected.
+    """
+    ip_src, ip_dst, port_src, port_dst, protocol = frame_fields(frame)
+    if ip_src is None:
+        return 0
+    endpoints = [ip_src, ip_dst]
+    if key == '5-tuple' and port_src is not None:
+        endpoints = [ip_src + struct.pack('!H', port_src), ip_dst + struct.pack('!H', port_dst)]
+    return zlib.crc32(b"".join(sorted(endpoints)) + bytes([protocol]))
+
+
+def flow_shard(inbox, outbox, table_options):
+    """
+    Shard process: extracts the packets of its flows, runs their FlowTable and sends the samples back.
+    Messages in: ('packets', generation, indices, frames, times), ('expire', generation), ('flush', generation),
+    ('reset', generation) or None to stop. Messages out: (generation, samples, acknowledged message or not).
+    """
+    extractor = DataExtractor()
+    table = FlowTable(**table_options)
+    while True:
+        message = inbox.get()
+        if message is None:
+            return
+        kind, generation = message[0], message[1]
+        if kind == 'packets':
+            _, _, indices, frames, times = message
+            columns = extractor.extract_columns(frames, times)
+            features = BatchProcessor(columns).process_features()
+            outbox.put((generation, table.push(columns, features, indices), True))
+        elif kind == 'expire':
+            outbox.put((generation, table.expire(), True))
+        elif kind == 'flush':
+            outbox.put((generation, table.flush(), True))
+        elif kind == 'reset':
+            table = FlowTable(**table_options)
+
+
+class FlowShards:
+    """
+    Shards a FlowTable across nbr_of_processes processes by flow hash (see frame_flow_hash). Every process
+    extracts and windows its own flows, the samples come back through the outbox queue.
+    """
+    def __init__(self, nbr_of_processes, **table_options):
+        context = multiprocessing.get_context('spawn')
+        self.key = table_options.get('key', '5-tuple')
+        self.inboxes = [context.Queue() for _ in range(nbr_of_processes)]
+        self.outbox = context.Queue()
+        self.processes = [context.Process(target=flow_shard, args=(inbox, self.outbox, table_options), daemon=True)
+                          for inbox in self.inboxes]
+        for process in self.processes:
+            process.start()
+        logging.info(f"Flow table sharded across {nbr_of_processes} processes")
+
+    def dispatch(self, generation, indices, packets, rules=None):
+        """Sends packets (with their indices in the packet list) to the shards of their flows, leaving out the
+        packets rejected by the rules (RuleTable). Returns the number of messages sent, each one is acknowledged
+        on the outbox."""
+        frames = [bytes(packet) for packet in packets]
+        fields = [frame_fields(frame) for frame in frames]
+        allowed = rules.filter(fields) if rules is not None and rules.active else [True] * len(frames)
+        shards = collections.defaultdict(lambda: ([], [], []))
+        for index, packet, frame, packet_allowed in zip(indices, packets, frames, allowed):
+            if not packet_allowed:
+                continue
+            shard = shards[frame_flow_hash(frame, self.key) % len(self.inboxes)]
+            shard[0].append(index)
+            shard[1].append(frame)
+            shard[2].append(float(packet.time))
+        for shard, (shard_indices, frames, times) in shards.items():
+            self.inboxes[shard].put(('packets', generation, shard_indices, frames, times))
+        return len(shards)
+
+    def expire(self, generation):
+        """Asks every shard for the samples due on the local clock (live capture), returns the number of messages
+        sent."""
+        for inbox in self.inboxes:
+            inbox.put(('expire', generation))
+        return len(self.inboxes)
+
+    def flush(self, generation):
+        """Asks every shard for its pending samples, returns the number of messages sent."""
+        for inbox in self.inboxes:
+            inbox.put(('flush', generation))
+        return len(self.inboxes)
+
+    def reset(self, generation):
+        for inbox in self.inboxes:
+            inbox.put(('reset', generation))
+
+    def close(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import logging
+import subprocess
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+# 'onnx' runs the exported model with ONNX Runtime, the other backends run the PyTorch model (core.model_manager)
+BACKENDS = ('eager', 'torchscript', 'compile', 'int8', 'amp', 'onnx')
+
+
+class BaseModelManager:
+    """
+    Common interface of the model managers: predict_batch(samples, x_stats) -> (labels, probabilities).
+    This module does not import torch, so that the ONNX Runtime path stays light.
+    """
+    def predict(self, sample, x_stats):
+        """Predicts the class of a sample using the loaded model."""
+        labels, _ = self.predict_batch(sample, x_stats)
+        return labels[0]
+
+    def predict_batch(self, samples, x_stats):
+        raise NotImplementedError
+
+    def compare(self, reference, samples, x_stats):
+        """
+        Checks this backend against a reference model manager (normally 'eager') on the same samples.
+        Returns the label agreement rate and the largest absolute difference of the class probabilities.
+        """
+        labels, probabilities = self.predict_batch(samples, x_stats)
+        reference_labels, reference_probabilities = reference.predict_batch(samples, x_stats)
+        return {
+            'agreement': float(np.mean(np.asarray(labels) == np.asarray(reference_labels))),
+            'max_abs_diff': float(np.max(np.abs(probabilities - reference_probabilities))),
+        }
+
+    def benchmark(self, samples, x_stats, batch_size=32, repeats=5):
+        """
+        Times predict_batch over the samples by batches of batch_size (after one warm-up pass).
+        Returns the mean latency per window in milliseconds and the number of windows per second.
+        """
+        def run():
+            for start in range(0, len(samples), batch_size):
+                self.predict_batch(samples[start:start + batch_size], x_stats[start:start + batch_size])
+
+        run()
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            run()
+        elapsed = time.perf_counter() - start_time
+        windows = len(samples) * repeats
+        return {'latency_ms': 1000 * elapsed / windows, 'windows_per_s': windows / elapsed}
+
+
+class OnnxModelManager(BaseModelManager):
+    """
+    Runs the MeanSharkNet model exported to ONNX (see neural_network.model.export_onnx) with ONNX Runtime,
+    without torch.
+    """
+    backend = 'onnx'
+
+    def __init__(self, model_path=None, num_threads=None):
+        if onnxruntime is None:
+            raise ImportError("The onnx backend needs onnxruntime (pip install onnxruntime)")
+        if model_path is None:
+            model_path = os.path.join(os.getcwd(), "neural_network/model.onnx")
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+
+    def predict_batch(self, samples, x_stats):
+        """
+        Predicts the classes of K samples with a single run of the session.
+        samples is (K, sequence_length, input_size) and x_stats is (K, 4) arrays.
+        Returns the list of K class labels and the (K, output_size) array of class probabilities.
+        """
+        logits = self.session.run(None, {'x_packets': np.asarray(samples, dtype=np.float32),
+                                         'x_stats': np.asarray(x_stats, dtype=np.float32)})[0]
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities = exp / exp.sum(axis=1, keepdims=True)
+        return probabilities.argmax(axis=1).tolist(), probabilities
+
+
+def make_model_manager(backend='eager', model_path=None):
+    """
+    Returns the model manager of a backend. torch is only imported for the PyTorch backends.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+    if backend == 'onnx':
+        return OnnxModelManager(model_path)
+    from core.model_manager import ModelManager
+    return ModelManager(input_size=46, hidden_size=70, output_size=2, model_path=model_path, backend=backend)
+
+
+def measure_startup(backend='eager', model_path=None):
+    """
+    Loads a backend in a fresh interpreter and scores one window.
+    Returns the startup time in seconds, the peak RSS in MB and whether torch was imported.
+    """
+    script = (
+        "import json, resource, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import numpy as np\n"
+        "from core.inference import make_model_manager\n"
+        f"model_manager = make_model_manager({backend!r}, {model_path!r})\n"
+        "model_manager.predict(np.zeros((1, 400, 46), np.float32), np.zeros((1, 4), np.float32))\n"
+        "print(json.dumps({'startup_s': time.perf_counter() - start,\n"
+        "                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,\n"
+        "                  'torch_imported': 'torch' in sys.modules}))\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True, text=True, check=True)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    logging.info(f"{backend} startup: {result}")
+    return result
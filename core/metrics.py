@@ -0,0 +1,208 @@
+import time
+import bisect
+import logging
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class Counter:
+    """Monotonic counter, or a function returning the current total of a counter kept elsewhere."""
+    def __init__(self, name, help, function=None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge:
+    """Current value of something (queue depth, memory), read from a function when collected."""
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def get(self):
+        return self.function()
+
+
+class Histogram:
+    """Latency histogram in seconds, with the cumulative buckets of Prometheus."""
+    default_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                       2.5, 5.0)
+
+    def __init__(self, name, help, buckets=None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets or self.default_buckets)
+        # counts[i] is the number of observations in (buckets[i - 1], buckets[i]], the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextlib.contextmanager
+    def time(self):
+        """Observes the duration of a with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile (None without observations)."""
+        with self.lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+                total += count
+                if total >= rank:
+                    return bound
+
+    def lines(self):
+        with self.lock:
+            counts, total_sum, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{"+Inf" if bound == float("inf") else bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total_sum}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class Metrics:
+    """
+    Registry of the pipeline metrics: counters, gauges and latency histograms, exported in the Prometheus text
+    format (see serve_metrics) and as a readable report with the rates since the previous report.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.start_time = time.monotonic()
+        self.last_report = (self.start_time, {})
+        self.gauge('meanshark_resident_memory_bytes', "Resident memory of the process.", self.resident_memory)
+
+    @staticmethod
+    def resident_memory():
+        if psutil is not None:
+            return psutil.Process().memory_info().rss
+        import resource
+        # Peak resident memory when psutil is missing (ru_maxrss is in kilobytes on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, function=None):
+        return self.register(Counter(name, help, function))
+
+    def gauge(self, name, help, function):
+        return self.register(Gauge(name, help, function))
+
+    def histogram(self, name, help, buckets=None):
+        return self.register(Histogram(name, help, buckets))
+
+    def __getitem__(self, name):
+        return self.metrics[name]
+
+    def values(self):
+        """Current value of every counter and gauge, None when its source is unavailable."""
+        values = {}
+        for name, metric in list(self.metrics.items()):
+            if isinstance(metric, Histogram):
+                continue
+            try:
+                values[name] = metric.get()
+            except Exception:
+                values[name] = None
+        return values
+
+    def prometheus(self):
+        """Text exposition format of Prometheus."""
+        lines = []
+        values = self.values()
+        for name, metric in list(self.metrics.items()):
+            kind = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}[type(metric)]
+            if kind != 'histogram' and values.get(name) is None:
+                continue
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines += metric.lines() if kind == 'histogram' else [f"{name} {values[name]}"]
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Readable summary: every value, the rates of the counters since the previous report and the median
+        and 99th percentile of the histograms."""
+        now = time.monotonic()
+        values = self.values()
+        last_time, last_values = self.last_report
+        self.last_report = (now, values)
+        lines = []
+        for name, metric in list(self.metrics.items()):
+            short_name = name.replace('meanshark_', '')
+            if isinstance(metric, Histogram):
+                p50, p99 = metric.quantile(0.5), metric.quantile(0.99)
+                if p50 is not None:
+                    lines.append(f"{short_name}: p50 <= {p50 * 1000:g} ms, p99 <= {p99 * 1000:g} ms, "
+                                 f"mean {metric.sum / metric.count * 1000:.3f} ms ({metric.count})")
+            elif values[name] is None:
+                continue
+            elif isinstance(metric, Counter):
+                rate = max(0, values[name] - (last_values.get(name) or 0)) / max(now - last_time, 1e-9)
+                lines.append(f"{short_name}: {values[name]} ({rate:.1f}/s)")
+            elif name == 'meanshark_resident_memory_bytes':
+                lines.append(f"resident_memory: {values[name] / 2 ** 20:.1f} MB")
+            else:
+                lines.append(f"{short_name}: {values[name]}")
+        return "\n".join(lines)
+
+
+def serve_metrics(metrics, port=9109, host='127.0.0.1'):
+    """
+    Serves the metrics in the Prometheus text format on http://host:port/metrics from a daemon thread.
+    Returns the server (server.shutdown() stops it).
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Metrics served on http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,130 @@
+import os
+import copy
+import logging
+import torch
+from neural_network.model import MeanSharkNet
+from core.inference import BACKENDS, BaseModelManager, OnnxModelManager
+
+
+class ModelManager(BaseModelManager):
+    """
+    Manages the MeanSharkNet model: loading the model, making predictions.
+    The inference backend is one of:
+    - 'eager': the PyTorch model as is (fp32, reference).
+    - 'torchscript': the model traced and frozen with TorchScript.
+    - 'compile': the model compiled with torch.compile (dynamic batch size).
+    - 'int8': dynamic int8 quantization of the fully connected layers (CPU only), see quantize_model.
+    - 'amp': mixed precision with autocast (float16 on CUDA, bfloat16 on CPU).
+    """
+    backends = ('eager', 'torchscript', 'compile', 'int8', 'amp')
+
+    def __init__(self, input_size, hidden_size, output_size, model_path=None, backend='eager', sequence_length=400):
+        if backend not in self.backends:
+            raise ValueError(f"Unknown inference backend {backend!r}, expected one of {self.backends}")
+        self.input_size = input_size
+        self.hidden_size = hidden_size
+        self.output_size = output_size
+        self.backend = backend
+        self.sequence_length = sequence_length
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        if backend == 'int8':
+            # Dynamically quantized kernels only exist on CPU
+            self.device = torch.device('cpu')
+        self.model = MeanSharkNet(self.input_size, self.hidden_size, self.output_size,10).to(self.device)
+        if model_path is None:
+            model_path = os.path.join(os.getcwd(), "neural_network/model.pt")
+        self.model.load_state_dict(torch.load(model_path, weights_only=True, map_location=self.device))
+        self.model.eval()
+        self.engine = self.make_engine()
+
+    def make_engine(self):
+        """Builds the callable running the forward pass for the selected backend."""
+        if self.backend == 'torchscript':
+            example = (torch.zeros(2, self.sequence_length, self.input_size, device=self.device),
+                       torch.zeros(2, 4, device=self.device))
+            with torch.inference_mode():
+                return torch.jit.freeze(torch.jit.trace(self.model, example, check_trace=False))
+        if self.backend == 'compile':
+            return torch.compile(self.model, dynamic=True)
+        if self.backend == 'int8':
+            return quantize_model(self.model)
+        return self.model
+
+    def forward(self, samples_tensor, x_stats_tensor):
+        """Runs the forward pass of the selected backend and returns the fp32 logits."""
+        if self.backend == 'amp':
+            dtype = torch.float16 if self.device.type == 'cuda' else torch.bfloat16
+            with torch.autocast(device_type=self.device.type, dtype=dtype):
+                return self.engine(samples_tensor, x_stats_tensor).float()
+        return self.engine(samples_tensor, x_stats_tensor)
+
+    def predict_batch(self, samples, x_stats):
+        """
+        Predicts the classes of K samples with a single forward pass.
+        samples is (K, sequence_length, input_size) and x_stats is (K, 4), as tensors or arrays.
+        Returns the list of K class labels and the (K, output_size) array of class probabilities.
+        """
+        with torch.inference_mode():
+            samples_tensor = torch.as_tensor(samples, dtype=torch.float32, device=self.device)
+            x_stats_tensor = torch.as_tensor(x_stats, dtype=torch.float32, device=self.device)
+            probabilities = torch.softmax(self.forward(samples_tensor, x_stats_tensor), dim=1).cpu()
+        return probabilities.argmax(dim=1).tolist(), probabilities.numpy()
+
+
+class SplitStatsLinear(torch.nn.Module):
+    """
+    fc1 of MeanSharkNet cut in two Linear layers with the same result: one over the attention features, one over
+    the nbr_of_stats window statistics that end its input.
+    """
+    def __init__(self, linear, nbr_of_stats=4):
+        super().__init__()
+        nbr_of_features = linear.in_features - nbr_of_stats
+        self.nbr_of_stats = nbr_of_stats
+        self.features = torch.nn.Linear(nbr_of_features, linear.out_features)
+        self.stats = torch.nn.Linear(nbr_of_stats, linear.out_features, bias=False)
+        with torch.no_grad():
+            self.features.weight.copy_(linear.weight[:, :nbr_of_features])
+            self.features.bias.copy_(linear.bias)
+            self.stats.weight.copy_(linear.weight[:, nbr_of_features:])
+
+    def forward(self, combined):
+        return (self.features(combined[:, :-self.nbr_of_stats])
+                + self.stats(combined[:, -self.nbr_of_stats:]))
+
+
+def quantize_model(model):
+    """
+    Dynamic int8 quantization of MeanSharkNet, on a copy of the model.
+    Dynamic quantization scales each input tensor as a whole, so only the layers with bounded inputs are
+    quantized: the attention features part of fc1 (see SplitStatsLinear) and fc2. The LSTM input holds the raw
+    packet length and the statistics hold the raw port count (tens to hundreds, next to features in [-1, 1]):
+    quantized, they flip the verdicts of whole windows, so they stay in fp32.
+    """
+    model = copy.deepcopy(model)
+    model.fc1 = SplitStatsLinear(model.fc1)
+    return torch.ao.quantization.quantize_dynamic(model, {'fc1.features', 'fc2'}, dtype=torch.qint8, inplace=True)
+
+
+def compare_backends(samples, x_stats, backends=BACKENDS, model_path=None, onnx_path=None, batch_size=32,
+                     repeats=5):
+    """
+    Loads the model with each backend, checks it against eager and benchmarks it on the same windows.
+    Returns {backend: {'agreement', 'max_abs_diff', 'latency_ms', 'windows_per_s'}}; a backend that cannot be
+    built here (e.g. torch.compile without a compiler, onnxruntime not installed) gets {'error': message}.
+    """
+    reference = ModelManager(46, 70, 2, model_path=model_path)
+    report = {}
+    for backend in backends:
+        try:
+            if backend == 'onnx':
+                model_manager = OnnxModelManager(onnx_path)
+            else:
+                model_manager = ModelManager(46, 70, 2, model_path=model_path, backend=backend,
+                                             sequence_length=samples.shape[1])
+            report[backend] = dict(model_manager.compare(reference, samples, x_stats),
+                                   **model_manager.benchmark(samples, x_stats, batch_size, repeats))
+        except Exception as e:
+            logging.warning(f"Backend {backend} unavailable: {e}")
+            report[backend] = {'error': str(e)}
+        logging.info(f"{backend}: {report[backend]}")
+    return report
@@ -0,0 +1,487 @@
+import time
+import queue
+import functools
+import logging
+import threading
+import collections
+from concurrent.futures import Future
+import numpy as np
+from neural_network.processing import PACKETS_BY_SAMPLE, BatchProcessor
+from neural_network.extracting import DataExtractor
+from core.windowing import PacketWindow
+from core.flows import FlowShards, FlowTable
+from core.retention import PacketRetention
+from core.rules import RuleTable
+from core.metrics import Metrics
+
+
+class InferenceBatcher:
+    """
+    Groups the samples submitted by the workers into micro-batches for the model manager's predict_batch.
+    A batch runs as soon as max_batch_size samples are waiting or the oldest one has waited max_wait seconds.
+    The inference time of every batch is recorded in metrics.
+    """
+    def __init__(self, model_manager, max_batch_size=32, max_wait=0.05, metrics=None):
+        self.model_manager = model_manager
+        self.inference_time = (metrics or Metrics()).histogram('meanshark_inference_seconds',
+                                                               "Inference time of a batch of windows.")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        """Starts the batching thread."""
+        if self.thread is None:
+            self.stopping = False
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stops the batching thread once the samples already submitted are classified."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def submit(self, features, x_stats):
+        """Queues a sample for inference and returns a Future resolved with its (label, probabilities)."""
+        future = Future()
+        with self.condition:
+            self.pending.append((time.monotonic(), features, x_stats, future))
+            self.condition.notify_all()
+        return future
+
+    def next_batch(self):
+        """
+        Waits until a batch is full or its oldest sample reached max_wait, then dequeues it.
+        Returns an empty batch once the batcher is stopping and nothing is pending.
+        """
+        with self.condition:
+            while not self.pending and not self.stopping:
+                self.condition.wait()
+            deadline = self.pending[0][0] + self.max_wait if self.pending else 0
+            while len(self.pending) < self.max_batch_size and not self.stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return [self.pending.popleft() for _ in range(min(self.max_batch_size, len(self.pending)))]
+
+    def run(self):
+        """Batching loop: one forward pass per batch, then resolves each sample's Future."""
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                return
+            try:
+                with self.inference_time.time():
+                    labels, probabilities = self.model_manager.predict_batch(np.stack([item[1] for item in batch]),
+                                                                             np.array([item[2] for item in batch]))
+            except Exception as e:
+                for item in batch:
+                    item[3].set_exception(e)
+                continue
+            for item, label, sample_probabilities in zip(batch, labels, probabilities):
+                item[3].set_result((label, sample_probabilities))
+
+
+class PacketQueue:
+    """
+    Bounded ring buffer between the sniff callback (producer) and the inference workers (consumers).
+    When full, the back-pressure policy decides what happens to a new packet:
+    'drop-oldest' evicts the oldest queued packet, 'drop-newest' discards the new one, 'block' waits for room.
+    """
+    policies = ('drop-oldest', 'drop-newest', 'block')
+
+    def __init__(self, max_size=20000, policy='drop-oldest'):
+        if policy not in self.policies:
+            raise ValueError(f"Unknown back-pressure policy {policy}, expected one of {self.policies}")
+        self.max_size = max_size
+        self.policy = policy
+        self.buffer = collections.deque()
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.processed = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def queued(self):
+        # Number of packets waiting for a worker
+        return len(self.buffer)
+
+    def put(self, packet, policy=None):
+        """
+        Enqueues a packet, applying the back-pressure policy (the queue's own one by default) when full.
+        Returns the number of packets dropped.
+        """
+        return self.put_batch([packet], policy)
+
+    def put_batch(self, packets, policy=None):
+        """
+        Enqueues a batch of packets (e.g. a block of the capture ring) under a single lock acquisition.
+        Returns the number of packets dropped.
+        """
+        policy = policy or self.policy
+        dropped = 0
+        with self.condition:
+            for packet in packets:
+                if len(self.buffer) >= self.max_size:
+                    if policy == 'drop-newest':
+                        dropped += 1
+                        continue
+                    elif policy == 'drop-oldest':
+                        self.buffer.popleft()
+                        dropped += 1
+                    else:
+                        self.condition.notify_all()
+                        while len(self.buffer) >= self.max_size:
+                            self.condition.wait()
+                self.buffer.append(packet)
+            self.dropped += dropped
+            self.condition.notify_all()
+        return dropped
+
+    def wait(self, timeout=None):
+        """Waits up to timeout seconds for a packet to be queued, returns whether packets are waiting."""
+        with self.condition:
+            if not self.buffer:
+                self.condition.wait(timeout)
+            return bool(self.buffer)
+
+    def get_batch(self, max_items, timeout=None):
+        """Dequeues up to max_items packets, waiting up to timeout seconds for at least one."""
+        with self.condition:
+            if not self.buffer:
+                self.condition.wait(timeout)
+            batch = [self.buffer.popleft() for _ in range(min(max_items, len(self.buffer)))]
+            if batch:
+                self.condition.notify_all()
+            return batch
+
+    def clear(self):
+        """Discards the queued packets and resets the counters."""
+        with self.condition:
+            self.buffer.clear()
+            self.dropped = 0
+            self.processed = 0
+            self.condition.notify_all()
+
+
+class PacketManager:
+    """
+    Handles packet processing and maintains the list of packets and samples.
+    The sniff callback only enqueues packets, worker threads extract the features of chunks of packets and
+    push them, in arrival order, into a PacketWindow that cuts them into samples (by default disjoint samples of
+    window_size packets). With flows ('5-tuple' or 'host'), packets go to the per-flow windows of a FlowTable
+    instead, optionally sharded across flow_processes processes. Every verdict is passed, in sample order,
+    to on_verdict (the GUI display or the headless writer).
+    samples[i] is the array of the indices in packet_list of the packets of sample i.
+    packet_list keeps the packets of the last memory_windows windows in memory and spills the older ones to
+    rotating pcap segments (see PacketRetention).
+    Throughput, queue depths, drops and the latency of every stage are recorded in metrics (see core.metrics).
+    Packets rejected by the rules (RuleTable) are kept in packet_list but never enter a window.
+    live tells whether the packets come from a live capture: the time windows of a live capture also close on the
+    local clock when the link is quiet. Those of a file or a replay close on the packet timestamps and flush()
+    only, so that their verdicts do not depend on the processing speed.
+    """
+    def __init__(self, model_manager, on_verdict=None, max_queue_size=20000, policy='drop-oldest',
+                 max_batch_size=32, max_wait=0.05, window_size=PACKETS_BY_SAMPLE, stride=None, mode='count',
+                 window_time=1.0, flows=None, flow_processes=0, max_flows=10000, idle_timeout=60.0,
+                 memory_budget=256 * 2 ** 20, memory_windows=50, spill_directory=None, segment_size=64 * 2 ** 20,
+                 max_segments=16, rules=None, live=True):
+        self.on_verdict = on_verdict
+        self.live = live
+        self.extractor = DataExtractor()
+        self.packet_list = PacketRetention(memory_windows * window_size, spill_directory, segment_size,
+                                           max_segments)
+        if flows is None:
+            self.make_window = functools.partial(PacketWindow, window_size, stride, mode, window_time)
+        else:
+            self.make_window = functools.partial(FlowTable, flows, window_size, mode, window_time, max_flows,
+                                                 idle_timeout, memory_budget)
+        self.window = self.make_window()
+        self.chunk_size = self.window.stride
+        self.rules = rules if rules is not None else RuleTable()
+        self.samples = []
+        self.sample_index = 0
+        self.model_manager = model_manager
+        self.lock = threading.Lock()
+        # Chunks are extracted concurrently but pushed into the window in the order they were dequeued
+        self.window_condition = threading.Condition(self.lock)
+        self.chunk_count = 0
+        self.next_chunk = 0
+        self.shards = None
+        if flow_processes:
+            self.shards = FlowShards(flow_processes, key=flows or '5-tuple', window_size=window_size, mode=mode,
+                                     window_time=window_time, max_flows=max_flows, idle_timeout=idle_timeout,
+                                     memory_budget=memory_budget)
+        self.publish_lock = threading.Lock()
+        self.published_index = 0
+        self.pending_results = {}
+        self.generation = 0
+        self.network_health = 1.0
+        self.is_enabled = True
+        self.nbr_of_malicious_sample = 0
+        self.packet_queue = PacketQueue(max_queue_size, policy)
+        self.metrics = Metrics()
+        self.received_packets = self.metrics.counter('meanshark_packets_received_total',
+                                                     "Packets received from the capture.")
+        self.dropped_packets = self.metrics.counter('meanshark_packets_dropped_total',
+                                                    "Packets dropped by the packet queue (back-pressure).")
+        self.processed_packets = self.metrics.counter('meanshark_packets_processed_total',
+                                                      "Packets extracted and pushed into the windows.")
+        self.classified_windows = self.metrics.counter('meanshark_windows_classified_total',
+                                                       "Windows classified and published.")
+        self.malicious_windows = self.metrics.counter('meanshark_windows_malicious_total',
+                                                      "Windows classified as malicious.")
+        self.metrics.gauge('meanshark_packet_queue_depth', "Packets waiting for a worker.",
+                           lambda: self.packet_queue.queued)
+        self.metrics.gauge('meanshark_inference_queue_depth', "Windows waiting for the inference batcher.",
+                           lambda: len(self.batcher.pending))
+        self.metrics.gauge('meanshark_network_health', "Share of the windows classified as normal.",
+                           lambda: self.network_health)
+        self.extract_time = self.metrics.histogram('meanshark_extract_seconds',
+                                                   "Feature extraction time of a chunk of packets.")
+        self.process_time = self.metrics.histogram('meanshark_process_seconds',
+                                                   "Feature processing time of a chunk of packets.")
+        self.batcher = InferenceBatcher(model_manager, max_batch_size, max_wait, self.metrics)
+        self.workers = []
+        self.is_running = False
+
+    def start_workers(self, nbr_of_workers=1):
+        """Starts the worker threads and the inference batcher (and the shard collector with flow processes)."""
+        self.batcher.start()
+        self.is_running = True
+        targets = [self.worker] * nbr_of_workers
+        if self.shards is not None:
+            targets.append(self.collect_shards)
+        for target in targets:
+            worker = threading.Thread(target=target, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop_workers(self):
+        """Stops the worker threads once they finish their current sample, then the inference batcher."""
+        self.is_running = False
+        for worker in self.workers:
+            worker.join()
+        self.workers.clear()
+        self.batcher.stop()
+        if self.shards is not None:
+            self.shards.close()
+        self.packet_list.close()
+
+    def worker(self):
+        """
+        Worker loop: dequeues a chunk of packets (at most stride) and processes it.
+        When no packet comes during a live capture, the time windows that are due on the local clock are closed.
+        Packets are awaited outside the lock, so that the other workers keep pushing their chunks meanwhile.
+        A chunk that fails is logged and skipped, the worker carries on with the next one.
+        """
+        while self.is_running:
+            try:
+                if not self.packet_queue.wait(timeout=0.1):
+                    if self.live and self.window.mode != 'count':
+                        self.expire_windows()
+                    continue
+                with self.lock:
+                    # Dequeued and numbered under the lock, so that chunks are pushed in arrival order
+                    packets = self.packet_queue.get_batch(self.chunk_size, timeout=0)
+                    if not packets:
+                        continue
+                    first_index = len(self.packet_list)
+                    # Spilled to disk below, once the lock is released
+                    self.packet_list.extend(packets, spill=False)
+                    chunk = self.chunk_count
+                    generation = self.generation
+                    if self.shards is not None:
+                        # The shard processes extract the packets, collect_shards submits their samples
+                        self.chunk_count += self.shards.dispatch(generation,
+                                                                 range(first_index, first_index + len(packets)),
+                                                                 packets, self.rules)
+                        self.packet_queue.processed += len(packets)
+                        self.processed_packets.inc(len(packets))
+                    else:
+                        self.chunk_count += 1
+                try:
+                    self.packet_list.spill()
+                except Exception as e:
+                    # The packets stay in memory, the chunk keeps its turn
+                    logging.error(f"Spilling packets to disk failed: {e}")
+                if self.shards is None:
+                    self.process_chunk(packets, chunk, generation, first_index)
+            except Exception as e:
+                logging.error(f"Worker failed on a chunk of packets: {e}")
+
+    def expire_windows(self):
+        """Closes the time windows that are due on the local clock, once every chunk is pushed."""
+        with self.lock:
+            if self.next_chunk != self.chunk_count:
+                return
+            if self.shards is not None:
+                self.chunk_count += self.shards.expire(self.generation)
+            else:
+                self.submit_samples(self.window.expire(), self.generation)
+
+    def process_chunk(self, packets, chunk, generation, first_index):
+        """
+        Extracts the features of a chunk of packets, pushes them into the window once the previous chunks are
+        pushed, and submits every completed sample to the inference batcher.
+        A chunk that cannot be processed (e.g. a malformed packet) is logged and dropped, its turn is always
+        handed to the next chunk.
+        """
+        try:
+            with self.extract_time.time():
+                columns = self.extractor.extract_columns(packets)
+            with self.process_time.time():
+                features = BatchProcessor(columns).process_features()
+        except Exception as e:
+            logging.error(f"Feature extraction failed for {len(packets)} packet(s) from {first_index}: {e}")
+            columns = features = None
+        with self.window_condition:
+            while self.next_chunk != chunk and generation == self.generation:
+                self.window_condition.wait()
+            if generation != self.generation:
+                # The capture was reset while this chunk was being extracted
+                return
+            try:
+                if columns is not None:
+                    indices = np.arange(first_index, first_index + len(packets))
+                    if self.rules.active:
+                        rows = np.flatnonzero(self.rules.filter_columns(columns))
+                        if len(rows) < len(indices):
+                            columns, features, indices = columns.take(rows), features[rows], indices[rows]
+                    self.submit_samples(self.window.push(columns, features, indices), generation)
+            except Exception as e:
+                logging.error(f"Windowing failed for {len(packets)} packet(s) from {first_index}: {e}")
+            finally:
+                self.packet_queue.processed += len(packets)
+                self.processed_packets.inc(len(packets))
+                self.next_chunk += 1
+                self.window_condition.notify_all()
+
+    def collect_shards(self):
+        """Collector loop of the flow processes: submits their samples and counts their acknowledgements."""
+        while self.is_running:
+            try:
+                generation, samples, acknowledged = self.shards.outbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            with self.window_condition:
+                if generation != self.generation:
+                    continue
+                self.submit_samples(samples, generation)
+                if acknowledged:
+                    self.next_chunk += 1
+                    self.window_condition.notify_all()
+
+    def submit_samples(self, samples, generation):
+        """Records the samples of the window (lock held) and submits them to the inference batcher."""
+        for indices, processed_sample, start_time, end_time, flow in samples:
+            verdict = {'sample': self.sample_index, 'packets': len(indices), 'first_packet': int(indices[0]),
+                       'start_time': start_time, 'end_time': end_time}
+            if flow is not None:
+                verdict['flow'] = flow
+            self.samples.append(indices)
+            self.sample_index += 1
+            future = self.batcher.submit(processed_sample.to_array(), processed_sample.stats)
+            future.add_done_callback(lambda done, verdict=verdict: self.on_inference_done(verdict, generation,
+                                                                                          done))
+
+    def flush(self):
+        """Classifies the packets not classified yet as partial windows now (e.g. at the end of a PCAP file)."""
+        with self.window_condition:
+            while self.next_chunk != self.chunk_count:
+                self.window_condition.wait()
+            if self.shards is not None:
+                self.chunk_count += self.shards.flush(self.generation)
+            else:
+                self.submit_samples(self.window.flush(), self.generation)
+
+    def on_inference_done(self, verdict, generation, future):
+        """Callback of the inference Future: a failed inference is published without result."""
+        try:
+            result, probabilities = future.result()
+        except Exception as e:
+            logging.error(f"Inference failed for sample {verdict['sample'] + 1}: {e}")
+            result, probabilities = None, None
+        self.publish_result(verdict, generation, result, probabilities)
+
+    def publish_result(self, verdict, generation, result, probabilities):
+        """
+        Records the prediction of a sample and hands the verdict to on_verdict.
+        Results can arrive out of order, they are published in sample order. An error of on_verdict (e.g. a
+        closed output pipe) is logged, the sample still counts as published.
+        """
+        with self.publish_lock:
+            if generation != self.generation:
+                # The capture was reset while this sample was being processed
+                return
+            verdict['result'] = result
+            verdict['probabilities'] = probabilities.tolist() if probabilities is not None else None
+            self.pending_results[verdict['sample']] = verdict
+
+            while self.published_index in self.pending_results:
+                verdict = self.pending_results.pop(self.published_index)
+                self.classified_windows.inc()
+                if verdict['result'] == 1:
+                    self.nbr_of_malicious_sample += 1
+                    self.malicious_windows.inc()
+                self.network_health = 1 - (self.nbr_of_malicious_sample / (verdict['sample'] + 1))
+                verdict['network_health'] = self.network_health
+                try:
+                    if self.on_verdict is not None:
+                        self.on_verdict(verdict)
+                except Exception as e:
+                    logging.error(f"Publishing the verdict of sample {verdict['sample'] + 1} failed: {e}")
+                finally:
+                    self.published_index += 1
+
+    def join(self, poll_interval=0.05):
+        """Waits until every queued packet is processed and every full sample is published."""
+        while True:
+            with self.lock:
+                with self.publish_lock:
+                    idle = (not self.packet_queue.queued and self.next_chunk == self.chunk_count
+                            and self.published_index >= self.sample_index)
+            if idle:
+                return
+            time.sleep(poll_interval)
+
+    def reset(self):
+        """Resets the packet list, the queue and current sample index."""
+        with self.lock:
+            self.packet_queue.clear()
+            self.packet_list.clear()
+            self.window = self.make_window()
+            self.samples.clear()
+            self.sample_index = 0
+            self.chunk_count = 0
+            self.next_chunk = 0
+            with self.publish_lock:
+                self.generation += 1
+                self.published_index = 0
+                self.pending_results.clear()
+                self.nbr_of_malicious_sample = 0
+            if self.shards is not None:
+                self.shards.reset(self.generation)
+            self.window_condition.notify_all()
+
+    def packet_thread(self, packet, policy=None):
+        """Sniff callback: only enqueues the incoming packet for the workers."""
+        if self.is_enabled:
+            self.received_packets.inc()
+            self.dropped_packets.inc(self.packet_queue.put(packet, policy))
+
+    def packet_batch(self, packets, policy=None):
+        """Capture backend callback: enqueues a batch of packets (RawFrame or scapy packets) for the workers."""
+        if self.is_enabled:
+            self.received_packets.inc(len(packets))
+            self.dropped_packets.inc(self.packet_queue.put_batch(packets, policy))
@@ -0,0 +1,224 @@
+import os
+import bisect
+import shutil
+import logging
+import tempfile
+import itertools
+import threading
+import collections
+from scapy.utils import PcapReader, PcapWriter
+from core.capture import DLT_EN10MB, RawFrame
+
+
+# Rotating pcap file holding the spilled packets [first_index, first_index + len(offsets))
+Segment = collections.namedtuple('Segment', ['path', 'first_index', 'offsets'])
+
+
+class PacketRetention:
+    """
+    Packet list of PacketManager with bounded memory. The memory_packets most recent packets stay in memory
+    (the ring of the last windows), older ones are spilled to rotating pcap segment files of about segment_size
+    bytes in directory, with the file offset of every packet. Only the max_segments most recent segments are
+    kept, the packets of a deleted segment are no longer available (None).
+    It reads like a list: len(), packets[index] and iteration, from memory or disk transparently. The raw frames
+    of the capture backends are kept raw and dissected when read.
+    """
+    def __init__(self, memory_packets=10000, directory=None, segment_size=64 * 2 ** 20, max_segments=16):
+        self.memory_packets = memory_packets
+        self.directory = directory
+        # A temporary directory is created at the first spill and removed by close()
+        self.temporary = directory is None
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.memory = collections.deque()
+        # Index of memory[0] in the whole capture
+        self.first_memory_index = 0
+        self.segments = []
+        self.writer = None
+        self.spilled = 0
+        self.lock = threading.RLock()
+        # Held while the segment files are written, see spill()
+        self.spill_lock = threading.RLock()
+
+    def __len__(self):
+        return self.first_memory_index + len(self.memory)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("packet index out of range")
+        return self.take([index])[0]
+
+    def __iter__(self):
+        """Yields every retained packet, oldest first, from the segments then from memory."""
+        with self.lock:
+            segments = [(segment.path, len(segment.offsets)) for segment in self.segments]
+            memory = list(self.memory)
+        for path, nbr_of_packets in segments:
+            yield from self.read_segment(path, nbr_of_packets)
+        for packet in memory:
+            yield self.dissect(packet)
+
+    @property
+    def first_index(self):
+        # Index of the oldest packet still available
+        with self.lock:
+            return self.segments[0].first_index if self.segments else self.first_memory_index
+
+    def extend(self, packets, spill=True):
+        """
+        Appends packets, spilling the oldest ones to disk beyond memory_packets. With spill=False the packets are
+        only appended in memory and spill() writes them later, e.g. once the caller released its own lock.
+        """
+        with self.lock:
+            self.memory.extend(packets)
+        if spill:
+            self.spill()
+
+    def append(self, packet):
+        self.extend([packet])
+
+    def spill(self):
+        """
+        Writes the packets beyond memory_packets, oldest first, at the end of the current segment.
+        The files are written outside the lock of the list: the packets stay readable in memory until they are
+        on disk, and appending or reading packets meanwhile does not wait for the disk.
+        """
+        with self.spill_lock:
+            with self.lock:
+                packets = list(itertools.islice(self.memory, max(0, len(self.memory) - self.memory_packets)))
+            offsets = []
+            for packet in packets:
+                if self.writer is None or self.writer.f.tell() >= self.segment_size:
+                    self.commit(offsets)
+                    offsets = []
+                    self.rotate()
+                if not self.writer.header_present:
+                    if isinstance(packet, RawFrame):
+                        self.writer.linktype = DLT_EN10MB
+                    self.writer.write_header(packet)
+                offsets.append(self.writer.f.tell())
+                if isinstance(packet, RawFrame):
+                    # Raw frames carry their capture time beside the bytes, written as the pcap timestamp
+                    sec = int(packet.time)
+                    self.writer.write_packet(bytes(packet), sec=sec, usec=int(round((packet.time - sec) * 1e6)))
+                else:
+                    self.writer.write(packet)
+            self.commit(offsets)
+
+    def commit(self, offsets):
+        """Moves the packets just written at the given offsets from memory to the current segment (spill lock held)."""
+        if not offsets:
+            return
+        self.writer.flush()
+        with self.lock:
+            for _ in offsets:
+                self.memory.popleft()
+            self.segments[-1].offsets.extend(offsets)
+            self.first_memory_index += len(offsets)
+            self.spilled += len(offsets)
+
+    def rotate(self):
+        """Starts a new segment file and deletes the oldest ones beyond max_segments (spill lock held)."""
+        if self.writer is not None:
+            self.writer.close()
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="meanshark-")
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"segment_{self.first_memory_index:012d}.pcap")
+        self.writer = PcapWriter(path)
+        with self.lock:
+            self.segments.append(Segment(path, self.first_memory_index, []))
+            dropped = self.segments[:max(0, len(self.segments) - self.max_segments)]
+            del self.segments[:len(dropped)]
+        for segment in dropped:
+            os.remove(segment.path)
+            logging.info(f"Packets {segment.first_index} to {segment.first_index + len(segment.offsets) - 1} "
+                         f"dropped with {segment.path}")
+
+    def locate(self, index):
+        """(segment, file offset) of a spilled packet, None if its segment was deleted."""
+        position = bisect.bisect_right([segment.first_index for segment in self.segments], index) - 1
+        if position < 0:
+            return None
+        segment = self.segments[position]
+        if index - segment.first_index >= len(segment.offsets):
+            return None
+        return segment, segment.offsets[index - segment.first_index]
+
+    def take(self, indices):
+        """
+        Returns the packets at the given indices (e.g. PacketManager.samples[i]) in the same order, reading each
+        segment file once. Packets that are no longer retained are None.
+        Only the locations are resolved under the lock, the packets are dissected and the segments read once it is
+        released, so that reading old packets does not stall the workers appending new ones. Committed packets are
+        never rewritten, a segment deleted meanwhile by a rotation gives None.
+        """
+        packets = {}
+        in_memory = {}
+        on_disk = collections.defaultdict(list)
+        with self.lock:
+            for index in indices:
+                index = int(index)
+                if index >= self.first_memory_index:
+                    in_memory[index] = self.memory[index - self.first_memory_index]
+                else:
+                    location = self.locate(index)
+                    if location is None:
+                        packets[index] = None
+                    else:
+                        on_disk[location[0].path].append((index, location[1]))
+        for index, packet in in_memory.items():
+            packets[index] = self.dissect(packet)
+        for path, locations in on_disk.items():
+            try:
+                with PcapReader(path) as reader:
+                    for index, offset in locations:
+                        reader.f.seek(offset)
+                        packets[index] = reader.read_packet()
+            except FileNotFoundError:
+                packets.update((index, None) for index, _ in locations)
+        return [packets[int(index)] for index in indices]
+
+    @staticmethod
+    def dissect(packet):
+        return packet.dissect() if isinstance(packet, RawFrame) else packet
+
+    @staticmethod
+    def read_segment(path, nbr_of_packets):
+        """Yields the first nbr_of_packets packets of a segment, nothing if it was deleted meanwhile."""
+        try:
+            with PcapReader(path) as reader:
+                for packet, _ in zip(reader, range(nbr_of_packets)):
+                    yield packet
+        except FileNotFoundError:
+            return
+
+    def clear(self):
+        """Forgets every packet and deletes the segment files."""
+        with self.spill_lock, self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            for segment in self.segments:
+                if os.path.isfile(segment.path):
+                    os.remove(segment.path)
+            self.segments.clear()
+            self.memory.clear()
+            self.first_memory_index = 0
+            self.spilled = 0
+
+    def close(self):
+        """
+        Closes the current segment. A temporary directory is removed with its segments, the segments of a given
+        directory are kept.
+        """
+        with self.spill_lock, self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            if self.temporary and self.directory is not None:
+                self.clear()
+                shutil.rmtree(self.directory, ignore_errors=True)
+                self.directory = None
@@ -0,0 +1,212 @@
+import bisect
+import ipaddress
+import threading
+import collections
+import numpy as np
+
+
+# A rule matches a packet when one of its addresses is in one of the networks, one of its ports is in one of the
+# port ranges and its protocol is one of the protocols, an empty field matches everything
+Rule = collections.namedtuple('Rule', ['action', 'networks', 'ports', 'protocols', 'text'])
+
+# IP protocol numbers, ARP packets have the protocol 0 like in DataExtractor.make_packet_row
+PROTOCOLS = {'arp': 0, 'icmp': 1, 'tcp': 6, 'udp': 17, 'icmpv6': 58, 'sctp': 132}
+
+
+class IntervalIndex:
+    """
+    Bit masks of the rules covering a set of integer intervals (port ranges, CIDR blocks), cut into disjoint
+    segments so that the mask of a value is found with a single bisection.
+    """
+    def __init__(self, intervals):
+        # intervals: (first, last, bit) with first and last included
+        self.bounds = sorted({first for first, _, _ in intervals} | {last + 1 for _, last, _ in intervals})
+        self.masks = []
+        for bound in self.bounds:
+            mask = 0
+            for first, last, bit in intervals:
+                if first <= bound <= last:
+                    mask |= bit
+            self.masks.append(mask)
+
+    def lookup(self, value):
+        position = bisect.bisect_right(self.bounds, value) - 1
+        return self.masks[position] if position >= 0 else 0
+
+
+class RuleTable:
+    """
+    Allow/deny rules applied to every packet before it enters a window, e.g. to keep the backup and management
+    traffic out of the samples. The first matching rule decides, packets matching no rule get the default action.
+    Rules are written as 'deny net=10.0.0.0/8,192.168.1.10 port=22,8000-8080 proto=tcp,udp'.
+    The table is compiled into interval indexes so that a packet is checked with one bisection per address and
+    port (O(log n)) and one dict lookup for its protocol, whatever the number of rules. Every rule counts its hits.
+    """
+    actions = ('allow', 'deny')
+
+    def __init__(self, rules=(), default='allow'):
+        if default not in self.actions:
+            raise ValueError(f"Unknown default action {default}, expected one of {self.actions}")
+        self.default = default
+        self.rules = []
+        self.hits = []
+        self.default_hits = 0
+        self.lock = threading.Lock()
+        self.compiled = None
+        for rule in rules:
+            self.add(rule)
+        self.compile()
+
+    def __len__(self):
+        return len(self.rules)
+
+    @property
+    def active(self):
+        # Whether the table can reject a packet (an empty table with the 'allow' default lets everything through)
+        return bool(self.rules) or self.default == 'deny'
+
+    @staticmethod
+    def parse(text):
+        """Parses the text of a rule into a Rule, raises ValueError when it is invalid."""
+        words = text.split()
+        if not words or words[0] not in RuleTable.actions:
+            raise ValueError(f"Invalid rule {text!r}: it must start with one of {RuleTable.actions}")
+        fields = {'net': [], 'port': [], 'proto': []}
+        for word in words[1:]:
+            name, _, values = word.partition('=')
+            if name not in fields or not values:
+                raise ValueError(f"Invalid rule {text!r}: expected net=, port= or proto=, got {word!r}")
+            fields[name] += values.split(',')
+
+        networks = [ipaddress.ip_network(network, strict=False) for network in fields['net']]
+        ports = []
+        for port in fields['port']:
+            first, _, last = port.partition('-')
+            first, last = int(first), int(last or first)
+            if not 0 <= first <= last <= 65535:
+                raise ValueError(f"Invalid rule {text!r}: bad port range {port!r}")
+            ports.append((first, last))
+        protocols = []
+        for protocol in fields['proto']:
+            if protocol.lower() in PROTOCOLS:
+                protocols.append(PROTOCOLS[protocol.lower()])
+            elif protocol.isdigit():
+                protocols.append(int(protocol))
+            else:
+                raise ValueError(f"Invalid rule {text!r}: unknown protocol {protocol!r}, expected a number or "
+                                 f"one of {tuple(PROTOCOLS)}")
+        return Rule(words[0], networks, ports, protocols, " ".join(words))
+
+    def add(self, text):
+        """Appends a rule (lowest priority) and recompiles the table."""
+        rule = self.parse(text)
+        with self.lock:
+            self.rules.append(rule)
+            self.hits.append(0)
+            self.compile()
+        return rule
+
+    def remove(self, position):
+        """Removes the rule at the given position (0 is the first rule)."""
+        with self.lock:
+            rule = self.rules.pop(position)
+            self.hits.pop(position)
+            self.compile()
+        return rule
+
+    def clear(self):
+        with self.lock:
+            self.rules.clear()
+            self.hits.clear()
+            self.default_hits = 0
+            self.compile()
+
+    def compile(self):
+        """Builds the indexes of the rules: the bit i of a mask stands for the rule i."""
+        networks = {4: [], 6: []}
+        ports = []
+        protocols = collections.defaultdict(int)
+        any_network = any_port = any_protocol = 0
+        for i, rule in enumerate(self.rules):
+            bit = 1 << i
+            if not rule.networks:
+                any_network |= bit
+            for network in rule.networks:
+                networks[network.version].append((int(network.network_address),
+                                                  int(network.broadcast_address), bit))
+            if not rule.ports:
+                any_port |= bit
+            for first, last in rule.ports:
+                ports.append((first, last, bit))
+            if not rule.protocols:
+                any_protocol |= bit
+            for protocol in rule.protocols:
+                protocols[protocol] |= bit
+        self.compiled = ({version: IntervalIndex(intervals) for version, intervals in networks.items()},
+                         IntervalIndex(ports), dict(protocols), any_network, any_port, any_protocol)
+
+    @staticmethod
+    def address(ip):
+        """(version, integer) of an address given as text (ColumnarCapture) or packed bytes (raw frames)."""
+        if isinstance(ip, bytes):
+            return 4 if len(ip) == 4 else 6, int.from_bytes(ip, 'big')
+        address = ipaddress.ip_address(ip)
+        return address.version, int(address)
+
+    def match(self, ip_src, ip_dst, port_src, port_dst, protocol):
+        """Returns the position of the first rule matching a packet, None if no rule matches."""
+        networks, ports, protocols, any_network, any_port, any_protocol = self.compiled
+        mask = any_protocol
+        if protocol is not None:
+            mask |= protocols.get(protocol, 0)
+        if not mask:
+            return None
+        network_mask = any_network
+        for ip in (ip_src, ip_dst):
+            if ip is not None:
+                version, value = self.address(ip)
+                network_mask |= networks[version].lookup(value)
+        mask &= network_mask
+        if not mask:
+            return None
+        port_mask = any_port
+        for port in (port_src, port_dst):
+            if port is not None:
+                port_mask |= ports.lookup(port)
+        mask &= port_mask
+        if not mask:
+            return None
+        return (mask & -mask).bit_length() - 1
+
+    def filter(self, packets):
+        """
+        Checks packets given as (ip_src, ip_dst, port_src, port_dst, protocol), None for a missing field.
+        Returns whether each packet is allowed and counts the hits of the rules.
+        """
+        allowed = []
+        with self.lock:
+            for packet in packets:
+                position = self.match(*packet)
+                if position is None:
+                    self.default_hits += 1
+                    allowed.append(self.default == 'allow')
+                else:
+                    self.hits[position] += 1
+                    allowed.append(self.rules[position].action == 'allow')
+        return allowed
+
+    def filter_columns(self, columns):
+        """filter() over the packets of a ColumnarCapture, returns a boolean array."""
+        def missing_to_none(values):
+            return [None if value != value else int(value) for value in values.tolist()]
+
+        return np.array(self.filter(zip(columns.ip_src, columns.ip_dst, missing_to_none(columns.port_src),
+                                         missing_to_none(columns.port_dst), missing_to_none(columns.protocol))),
+                        dtype=bool)
+
+    def summary(self):
+        """One line per rule with its hits, then the default action."""
+        with self.lock:
+            lines = [f"{i}: {rule.text} ({hits} hits)" for i, (rule, hits) in enumerate(zip(self.rules, self.hits))]
+            lines.append(f"default: {self.default} ({self.default_hits} hits)")
+        return "\n".join(lines)
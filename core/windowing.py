@@ -0,0 +1,155 @@
+import time
+import collections
+import numpy as np
+from neural_network.processing import BatchProcessedCapture
+from neural_network.extracting import Statistics
+
+
+# Fields of a packet needed by the window statistics (see Statistics.add_packet) and the time windows
+WindowPacket = collections.namedtuple('WindowPacket', ['index', 'ip_src', 'ip_dst', 'port_src', 'port_dst', 'length',
+                                                       'time'])
+
+
+class PacketWindow:
+    """
+    Windowing engine of PacketManager, it cuts the packet stream into samples according to mode:
+    - 'count': the last window_size packets, emitted every stride packets (disjoint windows when
+      stride == window_size, overlapping ones with a smaller stride).
+    - 'time': a sample every window_time seconds, measured from the first packet of the interval. An interval
+      holding more than window_size packets is cut into samples of window_size packets.
+    - 'first': a sample as soon as window_size packets arrived or window_time seconds elapsed, whichever comes
+      first.
+    The features of a packet are computed once, when it enters the window. The window statistics are
+    updated incrementally with Statistics.add_packet and remove_packet, so overlapping packets are never
+    extracted again. Short samples are padded to window_size packets (see BatchProcessedCapture).
+    """
+    modes = ('count', 'time', 'first')
+
+    def __init__(self, window_size=200, stride=None, mode='count', window_time=1.0, flow=None):
+        if mode not in self.modes:
+            raise ValueError(f"Unknown windowing mode {mode}, expected one of {self.modes}")
+        if mode != 'count' and stride not in (None, window_size):
+            raise ValueError("Only the count windowing mode can slide with a stride")
+        self.window_size = window_size
+        self.stride = stride or window_size
+        if not 0 < self.stride <= window_size:
+            raise ValueError(f"The stride must be between 1 and the window size {window_size}, got {self.stride}")
+        self.mode = mode
+        self.window_time = window_time
+        # Flow of the packets when the window belongs to a FlowTable
+        self.flow = flow
+        self.packets = collections.deque()
+        self.stats = Statistics(self.packets)
+        self.features = np.empty((0, 46), dtype=np.float32)
+        self.total_packets = 0
+        self.new_packets = 0
+        # Start of the current time interval, as packet timestamp and as local clock (for idle links)
+        self.interval_start = None
+        self.interval_clock = None
+
+    def __len__(self):
+        return len(self.packets)
+
+    # Statistics of the current window, read by BatchProcessedCapture like those of a ColumnarCapture
+    @property
+    def ip_amount(self):
+        return self.stats.ip_amount
+
+    @property
+    def port_amount(self):
+        return self.stats.port_amount
+
+    @property
+    def bitrate(self):
+        return self.stats.bitrate
+
+    @property
+    def total_time(self):
+        return self.stats.total_time
+
+    @staticmethod
+    def missing_to_none(column):
+        """Numeric column with NaN for missing values -> list with None, as Statistics expects."""
+        return [None if np.isnan(value) else value for value in column.tolist()]
+
+    def make_sample(self, features):
+        """
+        Returns the current window as (indices of its packets, BatchProcessedCapture, start time, end time, flow).
+        features are the rows of the packets of the window.
+        """
+        indices = np.fromiter((packet.index for packet in self.packets), dtype=np.int64, count=len(self.packets))
+        return (indices, BatchProcessedCapture(features, self, self.window_size),
+                self.packets[0].time, self.packets[-1].time, self.flow)
+
+    def clear(self, new_interval):
+        """Empties the window after a tumbling sample, new_interval also restarts the time interval."""
+        self.packets.clear()
+        self.stats.recount()
+        self.new_packets = 0
+        if new_interval:
+            self.interval_start = None
+            self.interval_clock = None
+
+    def push(self, columns, features, indices=None):
+        """
+        Adds packets (their ColumnarCapture, BatchProcessor features and indices in the packet list, consecutive
+        by default) at the end of the window. Returns the samples completed meanwhile (see make_sample).
+        """
+        all_features = np.concatenate((self.features, features))
+        offset = len(self.features)
+        if indices is None:
+            indices = range(self.total_packets, self.total_packets + len(columns))
+        rows = zip(indices, columns.ip_src, columns.ip_dst, self.missing_to_none(columns.port_src),
+                   self.missing_to_none(columns.port_dst), columns.length.tolist(), columns.time.tolist())
+        samples = []
+        for i, row in enumerate(rows):
+            packet = WindowPacket(*row)
+            if (self.mode != 'count' and self.packets
+                    and packet.time - self.interval_start >= self.window_time):
+                samples.append(self.make_sample(all_features[offset + i - len(self.packets):offset + i]))
+                self.clear(new_interval=True)
+            if self.interval_start is None:
+                self.interval_start = packet.time
+                self.interval_clock = time.monotonic()
+
+            self.packets.append(packet)
+            self.stats.add_packet(packet)
+            if len(self.packets) > self.window_size:
+                self.stats.remove_packet(self.packets.popleft())
+            self.total_packets += 1
+            self.new_packets += 1
+            if len(self.packets) == self.window_size and self.new_packets >= self.stride:
+                end = offset + i + 1
+                samples.append(self.make_sample(all_features[end - self.window_size:end]))
+                if self.mode == 'count':
+                    self.new_packets = 0
+                else:
+                    self.clear(new_interval=self.mode == 'first')
+        self.features = all_features[len(all_features) - len(self.packets):]
+        return samples
+
+    def expire(self):
+        """
+        Time modes: returns the current window as a sample (see make_sample) in a list if its interval elapsed on
+        the local clock, so that quiet links still get verdicts. Returns an empty list otherwise.
+        """
+        if (self.mode == 'count' or not self.packets
+                or time.monotonic() - self.interval_clock < self.window_time):
+            return []
+        return self.flush()
+
+    def flush(self):
+        """
+        Returns the packets of the window not classified yet as a sample (see make_sample) in a list, whatever their
+        number or age, padded like a time window (e.g. at the end of a PCAP file or when a flow is evicted).
+        Returns an empty list when every packet of the window was already classified.
+        """
+        if not self.new_packets:
+            return []
+        # In count mode the window still holds packets of the previous sample, they are not classified again
+        while len(self.packets) > self.new_packets:
+            self.stats.remove_packet(self.packets.popleft())
+        sample = self.make_sample(self.features[len(self.features) - len(self.packets):])
+        self.clear(new_interval=True)
+        self.features = self.features[:0]
+        return [sample]
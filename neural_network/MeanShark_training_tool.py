@@ -4,8 +4,10 @@ from extracting import DataExtractor
 import utils
 from processing import Processor
 from dataset_maker import DatasetMaker, MeanSharkDataset
+from dataset_store import DatasetStore
 import gc
 from training import Trainer
+from model import MeanSharkNet, export_onnx
 import argparse
 
 #a = test_extract.extract_data()
@@ -25,48 +27,71 @@ import argparse
 #print(torch.cuda.is_available())
 
 
-def make_dataset():
+def make_dataset(jobs=None, seed=None):
     dataset_maker = DatasetMaker("malicious","normal")
-    o = dataset_maker.make()
+    o = dataset_maker.make(jobs, seed)
     gc.collect()
-    o.save_dataset_to_json()
+    o.save_dataset()
 
 
-def add_data_to_dataset():
+def add_data_to_dataset(jobs=None, seed=None):
     dataset_maker = DatasetMaker("malicious","normal")
-    dataset_maker.add_data_to_dataset()
+    dataset_maker.add_data_to_dataset(jobs, seed)
 
 
-def train():
+def convert_dataset():
+    DatasetStore.from_json()
+
+
+def train(resume=None):
     mean_shark_dataset = MeanSharkDataset()
     trainer = Trainer(mean_shark_dataset)
-    trainer.train()
+    trainer.train(resume=resume)
     trainer.test()
     trainer.save_model()
 
+
+def export_model():
+    model = MeanSharkNet(46, 70, 2, 10)
+    model.load_state_dict(torch.load('model.pt', weights_only=True, map_location='cpu'))
+    export_onnx(model, 'model.onnx')
+    print("model.pt exported to model.onnx")
+
 utils.welcome()
 
 
 parser = argparse.ArgumentParser(description='Exécute une fonction différente en fonction de l\'argument.')
 
 
-parser.add_argument('-m','--make', action='store_true', help='Make a new dataset (json file) with data in Datasets folder.')
-parser.add_argument('-a','--add', action='store_true', help='Add data from Datasets folder to the current dataset (json file).')
-parser.add_argument('-t','--train', action='store_true', help='Train the model with the data encoded in the dataset (json file).')
+parser.add_argument('-m','--make', action='store_true', help='Make a new dataset (raw_dataset store) with data in Datasets folder.')
+parser.add_argument('-a','--add', action='store_true', help='Add data from Datasets folder to the current dataset (raw_dataset store).')
+parser.add_argument('-t','--train', action='store_true', help='Train the model with the data encoded in the dataset (raw_dataset store).')
+parser.add_argument('-r','--resume', default=None, help='Resume the training from this checkpoint (e.g. checkpoints/last.pt).')
+parser.add_argument('-e','--export', action='store_true', help='Export model.pt to model.onnx for the onnx inference backend.')
+parser.add_argument('-c','--convert', action='store_true', help='Convert the dataset json file to the binary dataset store.')
+parser.add_argument('-j','--jobs', type=int, default=None, help='Number of processes building the dataset (all cores by default).')
+parser.add_argument('-s','--seed', type=int, default=None, help='Seed of the IP anonymization, for a reproducible dataset.')
 
 
 args = parser.parse_args()
 
 if args.make:
-    make_dataset()
+    make_dataset(args.jobs, args.seed)
 elif args.add:
-    add_data_to_dataset()
-elif args.train:
-    train()
+    add_data_to_dataset(args.jobs, args.seed)
+elif args.train or args.resume:
+    train(args.resume)
+elif args.convert:
+    convert_dataset()
+elif args.export:
+    export_model()
 else:
-    print("-m or --make : Make a new dataset (json file) with data in Datasets folder.")
-    print("-a or --add : Add data from Datasets folder to the current dataset (json file).")
-    print("-t or --train : Train the model with the data encoded in the dataset (json file).")
+    print("-m or --make : Make a new dataset (raw_dataset store) with data in Datasets folder.")
+    print("-a or --add : Add data from Datasets folder to the current dataset (raw_dataset store).")
+    print("-t or --train : Train the model with the data encoded in the dataset (raw_dataset store).")
+    print("-r or --resume : Resume the training from a checkpoint file.")
+    print("-c or --convert : Convert the dataset json file to the binary dataset store.")
+    print("-e or --export : Export model.pt to model.onnx for the onnx inference backend.")
 
 
 
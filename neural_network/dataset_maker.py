@@ -1,51 +1,84 @@
 import gc
 import os
+import random
+import multiprocessing
 import utils
 import json
 import logging
 from extracting import DataExtractor
-from processing import Processor
+from processing import PACKETS_BY_SAMPLE, Processor
+from dataset_store import DatasetStore
 import numpy as np
-from sklearn.model_selection import train_test_split
 import math
 
 
 class MeanSharkDataset:
     """
-    Manages and processes the dataset including features, stats, and labels.
-    Handles initialization, loading from JSON, saving to JSON, and splitting data into train, validation, and test sets.
+    Manages the dataset including features, stats, and labels, as a list of (features, stats, labels) shards.
+    Handles initialization, loading from the binary store (memory-mapped) or legacy JSON, and saving.
     """
     def __init__(self, features=None, stats=None, labels=None):
         """
-        Initializes the dataset by loading features, stats, and labels from input or JSON.
-        Splits the data into training, validation, and test sets.
+        Initializes the dataset from input, the binary store or JSON.
+        Nothing is copied when loading from the store: shards stay memory-mapped until the samples are read.
         """
         if features is not None and stats is not None and labels is not None:
-            self.features = np.array(features, dtype=np.float32)
-            self.stats = np.array(stats, dtype=np.float32)
-            self.labels = np.array(labels, dtype=np.int64)
+            self.shards = [(np.array(features, dtype=np.float32), np.array(stats, dtype=np.float32),
+                            np.array(labels, dtype=np.int64))]
+        elif DatasetStore().exists():
+            self.load_dataset()
         else:
-            self.load_dataset_from_json()  # Load dataset from JSON if not provided
+            self.load_dataset_from_json()  # Load dataset from JSON if there is no binary store
 
-        if self.features is None or self.stats is None or self.labels is None:
+        if not self.shards:
             raise ValueError("Features, stats, or labels are None after initialization or loading from JSON")
 
-        # Combine features and stats, then split data into train, validation, and test sets
-        combined_features = np.concatenate((self.features.reshape(self.features.shape[0], -1), self.stats), axis=1)
-        X_train_val, X_test, y_train_val, y_test = train_test_split(
-            combined_features, self.labels, test_size=0.2, random_state=42
-        )
-        X_train, X_val, y_train, y_val = train_test_split(
-            X_train_val, y_train_val, test_size=0.25, random_state=42
-        )
+        logging.info(f"Dataset size: {len(self)}")
 
-        logging.info(f"Training set size: {X_train.shape[0]}")
-        logging.info(f"Validation set size: {X_val.shape[0]}")
-        logging.info(f"Test set size: {X_test.shape[0]}")
+    def __len__(self):
+        return sum(len(shard[2]) for shard in self.shards)
 
-        self.training_set = X_train
-        self.validation_set = X_val
-        self.testing_set = X_test
+    @property
+    def feature_shape(self):
+        # Shape of the features of one sample (sequence length, number of features)
+        return self.shards[0][0].shape[1:]
+
+    @property
+    def features(self):
+        # Features of every sample; concatenating the shards copies them in memory
+        return self.concatenate(0)
+
+    @property
+    def stats(self):
+        return self.concatenate(1)
+
+    @property
+    def labels(self):
+        return self.concatenate(2)
+
+    def concatenate(self, array_index):
+        """Returns one array (0: features, 1: stats, 2: labels) of the whole dataset."""
+        if len(self.shards) == 1:
+            return self.shards[0][array_index]
+        return np.concatenate([shard[array_index] for shard in self.shards])
+
+    def load_dataset(self, path="raw_dataset"):
+        """
+        Loads the dataset (features, stats, labels) from the binary store, memory-mapped.
+        """
+        logging.info(f"Loading dataset from {path}")
+        self.shards = DatasetStore(path).load_shards()
+        logging.info("Raw dataset loaded successfully!")
+
+    def save_dataset(self, path="raw_dataset"):
+        """
+        Saves the current dataset (features, stats, labels) into the binary store, replacing its content.
+        """
+        store = DatasetStore(path)
+        store.clear()
+        for features, stats, labels in self.shards:
+            store.append(features, stats, labels)
+        logging.info("Raw data saved")
 
     def load_dataset_from_json(self):
         """
@@ -60,14 +93,14 @@ class MeanSharkDataset:
             logging.error("raw_dataset.json not found. Try to make it")
             exit(1)
 
-        self.features = np.array(data_loaded.get('dataset'), dtype=np.float32)
-        self.stats = np.array(data_loaded.get('stats'), dtype=np.float32)
-        self.labels = np.array(data_loaded.get('labels'), dtype=np.int64)
-
-        if self.features is None or self.stats is None or self.labels is None:
+        if data_loaded.get('dataset') is None or data_loaded.get('stats') is None or data_loaded.get('labels') is None:
             logging.error("Failed to load features, stats, or labels from JSON.")
             exit(1)
 
+        self.shards = [(np.array(data_loaded.get('dataset'), dtype=np.float32),
+                        np.array(data_loaded.get('stats'), dtype=np.float32),
+                        np.array(data_loaded.get('labels'), dtype=np.int64))]
+
         logging.info("Raw dataset loaded successfully!")
 
     def save_dataset_to_json(self):
@@ -86,16 +119,62 @@ class MeanSharkDataset:
         logging.info("Raw data saved")
 
 
+def process_shard(shard):
+    """
+    Worker task: extracts, anonymizes and processes the samples [first_sample, first_sample + nbr_of_samples)
+    of a capture, streaming it from disk. The anonymization of each sample is seeded by
+    (seed, capture name, sample number) when a seed is given.
+    """
+    cap_path, label, first_sample, nbr_of_samples, seed, packets_by_sample = shard
+    shard_dataset = []
+    shard_stats = []
+    shard_labels = []
+    extractor = DataExtractor()
+    packets = []
+    sample_index = first_sample
+
+    def process_sample(sample):
+        data_sample = extractor.extract_data(split_capture=sample)
+        rng = random.Random(f"{seed}:{os.path.basename(cap_path)}:{sample_index}") if seed is not None else None
+        data_sample.randomize_ips(rng)
+        processed_sample = Processor(data_sample).output
+        shard_dataset.append(np.array(processed_sample.to_array(), dtype=np.float32))
+        sample_stats = [
+            processed_sample.bitrate_normalized or 0,
+            processed_sample.ip_amount_normalized or 0,
+            processed_sample.port_amount_normalized or 0,
+            processed_sample.total_time_normalized or 0
+        ]
+        assert not any(math.isnan(value) for value in sample_stats), "sample_stats contain NaN"
+        shard_stats.append(sample_stats)
+        shard_labels.append(label)
+
+    for packet, _ in DataExtractor.stream_packets(cap_path, skip=first_sample * packets_by_sample):
+        packets.append(packet)
+        if len(packets) >= packets_by_sample:
+            process_sample(packets)
+            packets = []
+            sample_index += 1
+            if sample_index >= first_sample + nbr_of_samples:
+                break
+
+    # Like split_raw_capture, the last incomplete sample of a capture is kept (it is filtered out later)
+    if len(packets) > 0:
+        process_sample(packets)
+    return shard_dataset, shard_stats, shard_labels
+
+
 class DatasetMaker:
     """
     Creates and processes datasets from raw malicious and normal network traffic data.
     Extracts features and stats from pcap files, labels data, and manages dataset updates.
     """
-    def __init__(self, path_malicious, path_normal):
+    def __init__(self, path_malicious, path_normal, packets_by_sample=PACKETS_BY_SAMPLE):
         """
-        Initializes DatasetMaker with the paths for malicious and normal datasets.
-        Verifies the existence of the directories.
+        Initializes DatasetMaker with the paths for malicious and normal datasets and the number of packets of
+        a sample. Verifies the existence of the directories.
         """
+        self.packets_by_sample = packets_by_sample
         if os.path.isdir(path_malicious) and os.path.isdir(path_normal):
             self.path_malicious = path_malicious
             self.path_normal = path_normal
@@ -113,88 +192,66 @@ class DatasetMaker:
         #Creates and returns a MeanSharkDataset instance.
         return self.make()
 
-    def make(self):
+    def make(self, nbr_of_workers=None, seed=None):
         """
         Builds the raw dataset and returns a MeanSharkDataset object.
         """
-        features, stats, labels = self.build_raw_dataset()
+        features, stats, labels = self.build_raw_dataset(nbr_of_workers, seed)
         return MeanSharkDataset(features, stats, labels)
 
-    def build_raw_dataset(self):
+    def plan_shards(self, max_nbr_of_samples, samples_by_shard, seed):
+        """
+        Lists the shards of work: every capture is split in ranges of samples_by_shard samples,
+        up to max_nbr_of_samples samples per capture. Malicious captures (label 1) come first, then normal ones (0).
+        """
+        shards = []
+        for directory, label, kind in ((self.path_malicious, 1, 'MALICIOUS'), (self.path_normal, 0, 'NORMAL')):
+            for capture in os.listdir(directory):
+                if capture.split('.')[-1] in ['pcap', 'pcapng']:
+                    logging.info(f'Adding {capture} ({kind}) data to the raw dataset...')
+                    for first_sample in range(0, max_nbr_of_samples, samples_by_shard):
+                        nbr_of_samples = min(samples_by_shard, max_nbr_of_samples - first_sample)
+                        shards.append((os.path.join(directory, capture), label, first_sample, nbr_of_samples, seed,
+                                       self.packets_by_sample))
+                else:
+                    logging.info(f'{capture} is not a pcap or pcapng file. This file is ignored')
+        return shards
+
+    def build_raw_dataset(self, nbr_of_workers=None, seed=None, max_nbr_of_samples=200, samples_by_shard=25):
         """
         Processes the raw data from pcap files, extracts features and stats, and labels them as
         malicious (1) or normal (0).
+        Shards (ranges of samples of a capture) are processed by a pool of nbr_of_workers processes
+        (all cores by default, 1 to stay in this process) and gathered in a deterministic order: with the same seed,
+        the output does not depend on the number of workers.
         """
         raw_dataset = []
         raw_stats = []
         raw_labels = []
-        malicious_capture = os.listdir(self.path_malicious)
-        normal_capture = os.listdir(self.path_normal)
-        nbr_of_samples = 200
-
-        # Process malicious captures
-        for capture in malicious_capture:
-            if capture.split('.')[-1] in ['pcap', 'pcapng']:
-                print()
-                logging.info(f'Adding {capture} (MALICIOUS) data to the raw dataset...')
-                extractor = DataExtractor(os.path.join(self.path_malicious, capture))
-                samples = extractor.split_raw_capture(200, max_nbr_of_samples=nbr_of_samples)
-                total_samples_in_file = len(samples)
-
-                for i, sample in enumerate(samples):
-                    data_sample = extractor.extract_data(split_capture=sample)
-                    data_sample.randomize_ips()
-                    processor = Processor(data_sample)
-                    processed_sample = processor.output
-                    sample_array = processed_sample.to_array()
-                    raw_dataset.append(sample_array)
-                    sample_stats = [
-                        processed_sample.bitrate_normalized or 0,
-                        processed_sample.ip_amount_normalized or 0,
-                        processed_sample.port_amount_normalized or 0,
-                        processed_sample.total_time_normalized or 0
-                    ]
-                    assert not any(math.isnan(value) for value in sample_stats), "sample_stats contain NaN"
-                    raw_stats.append(sample_stats)
-                    raw_labels.append(1)
-                    progress = int(((i + 1) / total_samples_in_file) * 100)
-                    bar = "█" * (progress // 2)
-                    print(f"\rsamples processed : {bar.ljust(50)} {progress}% [{i + 1}/{total_samples_in_file}]", end='')
-                print("")
-            else:
-                logging.info(f'{capture} is not a pcap or pcapng file. This file is ignored')
-
-        # Process normal captures (similar to malicious, with label 0)
-        for capture in normal_capture:
-            if capture.split('.')[-1] in ['pcap', 'pcapng']:
-                print()
-                logging.info(f'Adding {capture} (NORMAL) data to the raw dataset...')
-                extractor = DataExtractor(os.path.join(self.path_normal, capture))
-                samples = extractor.split_raw_capture(200, max_nbr_of_samples=nbr_of_samples)
-                total_samples_in_file = len(samples)
-
-                for i, sample in enumerate(samples):
-                    data_sample = extractor.extract_data(split_capture=sample)
-                    data_sample.randomize_ips()
-                    processor = Processor(data_sample)
-                    processed_sample = processor.output
-                    sample_array = processed_sample.to_array()
-                    raw_dataset.append(sample_array)
-                    sample_stats = [
-                        processed_sample.bitrate_normalized or 0,
-                        processed_sample.ip_amount_normalized or 0,
-                        processed_sample.port_amount_normalized or 0,
-                        processed_sample.total_time_normalized or 0
-                    ]
-                    assert not any(math.isnan(value) for value in sample_stats), "sample_stats contain NaN"
-                    raw_stats.append(sample_stats)
-                    raw_labels.append(0)
-                    progress = int(((i + 1) / total_samples_in_file) * 100)
-                    bar = "█" * (progress // 2)
-                    print(f"\rSamples processed : {bar.ljust(50)} {progress}% [{i + 1}/{total_samples_in_file}]", end='')
-                print("")
-            else:
-                logging.info(f'{capture} is not a pcap or pcapng file. This file is ignored')
+        shards = self.plan_shards(max_nbr_of_samples, samples_by_shard, seed)
+        nbr_of_workers = nbr_of_workers or os.cpu_count()
+
+        if nbr_of_workers == 1 or len(shards) <= 1:
+            results = map(process_shard, shards)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(min(nbr_of_workers, len(shards)))
+            results = pool.imap(process_shard, shards)
+
+        try:
+            for i, (shard_dataset, shard_stats, shard_labels) in enumerate(results):
+                raw_dataset.extend(shard_dataset)
+                raw_stats.extend(shard_stats)
+                raw_labels.extend(shard_labels)
+                progress = int(((i + 1) / len(shards)) * 100)
+                bar = "█" * (progress // 2)
+                print(f"\rShards processed : {bar.ljust(50)} {progress}% [{i + 1}/{len(shards)}] "
+                      f"{len(raw_dataset)} samples", end='')
+            print("")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
         logging.info("Raw data built successfully")
 
@@ -206,40 +263,21 @@ class DatasetMaker:
 
         return filtered_dataset, filtered_stats, filtered_labels
 
-    def add_data_to_dataset(self):
+    def add_data_to_dataset(self, nbr_of_workers=None, seed=None):
         """
-        Adds new data to the existing dataset saved in JSON by loading, updating, and saving it.
+        Adds new data to the existing dataset store as a new shard. A legacy raw_dataset.json is converted first.
         """
         logging.info(f"Adding data to dataset.")
-        new_features, new_stats, new_labels = self.build_raw_dataset()
+        new_features, new_stats, new_labels = self.build_raw_dataset(nbr_of_workers, seed)
         gc.collect()
 
-        try:
-            logging.info("Loading dataset from JSON.")
-            with open("raw_dataset.json", 'r') as f:
-                data_loaded = json.load(f)
-        except FileNotFoundError:
-            logging.error("raw_dataset.json not found. Exiting add_data_to_dataset.")
-            exit(1)
-
-        # Load and update the existing dataset
-        existing_features = np.array(data_loaded.get('dataset'), dtype=np.float32)
-        existing_stats = np.array(data_loaded.get('stats'), dtype=np.float32)
-        existing_labels = np.array(data_loaded.get('labels'), dtype=np.int64)
-
-        updated_features = np.concatenate((existing_features, new_features), axis=0)
-        updated_stats = np.concatenate((existing_stats, new_stats), axis=0)
-        updated_labels = np.concatenate((existing_labels, new_labels), axis=0)
-
-        # Save updated dataset
-        data_to_save = {
-            'dataset': updated_features.tolist(),
-            'stats': updated_stats.tolist(),
-            'labels': updated_labels.tolist()
-        }
-
-        with open("raw_dataset.json", 'w') as f:
-            logging.info("Saving dataset to JSON. This may take a while...")
-            json.dump(data_to_save, f, indent=4)
+        store = DatasetStore()
+        if not store.exists():
+            if not os.path.isfile("raw_dataset.json"):
+                logging.error("No dataset found (raw_dataset or raw_dataset.json). Exiting add_data_to_dataset.")
+                exit(1)
+            store = DatasetStore.from_json()
 
-        logging.info("New data added and raw_dataset.json updated")
+        # New samples are written as a new shard, the existing ones are not read
+        store.append(new_features, new_stats, new_labels)
+        logging.info("New data added to the raw_dataset store")
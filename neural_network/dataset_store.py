@@ -0,0 +1,113 @@
+import os
+import json
+import logging
+import numpy as np
+
+
+class DatasetStore:
+    """
+    Binary on-disk dataset: a directory of .npy shards (features, stats and labels of a batch of samples)
+    and a small metadata.json header listing them.
+    Appending writes a new shard and rewrites only the header, and shards can be loaded memory-mapped.
+    """
+    version = 1
+
+    def __init__(self, path="raw_dataset"):
+        self.path = path
+        self.metadata_path = os.path.join(path, "metadata.json")
+        if os.path.isfile(self.metadata_path):
+            with open(self.metadata_path, 'r') as f:
+                self.metadata = json.load(f)
+        else:
+            self.metadata = {'version': self.version, 'feature_shape': None, 'size': 0, 'shards': []}
+
+    def __len__(self):
+        return self.metadata['size']
+
+    def exists(self):
+        """True if the store holds at least one shard."""
+        return bool(self.metadata['shards'])
+
+    @property
+    def feature_shape(self):
+        # Shape of the features of one sample (sequence length, number of features)
+        return tuple(self.metadata['feature_shape']) if self.metadata['feature_shape'] else None
+
+    def shard_path(self, shard_name, array_name):
+        """Path of one array (features, stats or labels) of a shard."""
+        return os.path.join(self.path, f"{shard_name}.{array_name}.npy")
+
+    def write_metadata(self):
+        """Writes the header atomically, so that an interrupted append leaves the store consistent."""
+        tmp_path = self.metadata_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.metadata, f, indent=4)
+        os.replace(tmp_path, self.metadata_path)
+
+    def append(self, features, stats, labels):
+        """Adds a shard of samples to the store."""
+        features = np.asarray(features, dtype=np.float32)
+        stats = np.asarray(stats, dtype=np.float32)
+        labels = np.asarray(labels, dtype=np.int64)
+        if not (len(features) == len(stats) == len(labels)):
+            raise ValueError("Features, stats and labels must have the same number of samples")
+        if len(features) == 0:
+            logging.warning("No sample to append to the dataset store")
+            return
+        if self.feature_shape is not None and features.shape[1:] != self.feature_shape:
+            raise ValueError(f"Samples of shape {features.shape[1:]} cannot be added to a dataset of samples "
+                             f"of shape {self.feature_shape}")
+
+        os.makedirs(self.path, exist_ok=True)
+        shard_name = f"shard_{len(self.metadata['shards']):05d}"
+        np.save(self.shard_path(shard_name, 'features'), features)
+        np.save(self.shard_path(shard_name, 'stats'), stats)
+        np.save(self.shard_path(shard_name, 'labels'), labels)
+
+        self.metadata['feature_shape'] = list(features.shape[1:])
+        self.metadata['shards'].append({'name': shard_name, 'size': len(features)})
+        self.metadata['size'] += len(features)
+        self.write_metadata()
+        logging.info(f"{len(features)} samples added to {self.path} ({shard_name})")
+
+    def clear(self):
+        """Removes every shard of the store."""
+        for shard in self.metadata['shards']:
+            for array_name in ('features', 'stats', 'labels'):
+                path = self.shard_path(shard['name'], array_name)
+                if os.path.isfile(path):
+                    os.remove(path)
+        self.metadata = {'version': self.version, 'feature_shape': None, 'size': 0, 'shards': []}
+        if os.path.isdir(self.path):
+            self.write_metadata()
+
+    def load_shards(self, mmap_mode='r'):
+        """Returns the lists of (features, stats, labels) arrays of every shard, memory-mapped by default."""
+        shards = []
+        for shard in self.metadata['shards']:
+            shards.append(tuple(np.load(self.shard_path(shard['name'], array_name), mmap_mode=mmap_mode)
+                                for array_name in ('features', 'stats', 'labels')))
+        return shards
+
+    def load(self, mmap_mode='r'):
+        """
+        Returns the features, stats and labels of the whole store. A single shard stays memory-mapped,
+        several shards are concatenated in memory.
+        """
+        shards = self.load_shards(mmap_mode)
+        if not shards:
+            raise FileNotFoundError(f"No dataset found in {self.path}")
+        if len(shards) == 1:
+            return shards[0]
+        return tuple(np.concatenate([shard[i] for shard in shards]) for i in range(3))
+
+    @classmethod
+    def from_json(cls, json_path="raw_dataset.json", path="raw_dataset"):
+        """One-shot conversion of a raw_dataset.json file into a new store."""
+        logging.info(f"Converting {json_path} to {path}. This may take a while...")
+        with open(json_path, 'r') as f:
+            data_loaded = json.load(f)
+        store = cls(path)
+        store.clear()
+        store.append(data_loaded.get('dataset'), data_loaded.get('stats'), data_loaded.get('labels'))
+        return store
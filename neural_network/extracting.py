@@ -3,6 +3,7 @@ import logging
 from datetime import datetime
 from scapy.all import *
 from scapy.layers.l2 import Ether
+import numpy as np
 
 import random
 
@@ -14,6 +15,8 @@ data_path = os.path.join(dirname, 'Dataset')
 class Statistics:
     """
     Class to calculate various statistics from a list of captured packets.
+    Counters are updated incrementally as packets are added to or removed from the capture, so reading a
+    statistic is constant time.
     """
     def __init__(self, capture_list):
         self.capture_list = capture_list
@@ -21,6 +24,7 @@ class Statistics:
         self.ip_amount_normalized = None
         self.port_amount_normalized = None
         self.total_time_normalized = None
+        self.recount()
 
     @property
     def ip_amount(self):
@@ -42,65 +46,74 @@ class Statistics:
         # Calculate the total time of the capture
         return self.calculate_total_time()
 
+    def recount(self):
+        """Rebuild the counters from the whole capture list (e.g. after its packets were modified in place)."""
+        self.ip_counts = {}
+        self.port_counts = {}
+        self.total_size = 0
+        for data_packet in self.capture_list:
+            self.add_packet(data_packet)
+
+    @staticmethod
+    def _increment(counts, key):
+        counts[key] = counts.get(key, 0) + 1
+
+    @staticmethod
+    def _decrement(counts, key):
+        if counts[key] == 1:
+            del counts[key]
+        else:
+            counts[key] -= 1
+
+    def add_packet(self, data_packet):
+        """Account for a packet appended to the capture list."""
+        if data_packet.ip_src is not None and data_packet.ip_dst is not None:
+            self._increment(self.ip_counts, data_packet.ip_src)
+            self._increment(self.ip_counts, data_packet.ip_dst)
+        if data_packet.port_src is not None and data_packet.port_dst is not None:
+            self._increment(self.port_counts, data_packet.port_src)
+            self._increment(self.port_counts, data_packet.port_dst)
+        self.total_size += data_packet.length
+
+    def remove_packet(self, data_packet):
+        """Account for a packet removed from the capture list, used by sliding windows."""
+        if data_packet.ip_src is not None and data_packet.ip_dst is not None:
+            self._decrement(self.ip_counts, data_packet.ip_src)
+            self._decrement(self.ip_counts, data_packet.ip_dst)
+        if data_packet.port_src is not None and data_packet.port_dst is not None:
+            self._decrement(self.port_counts, data_packet.port_src)
+            self._decrement(self.port_counts, data_packet.port_dst)
+        self.total_size -= data_packet.length
+
     def calculate_ip_amount(self):
         """Calculate the number of unique IP addresses."""
-        ip_list = []
-        for data_packet in self.capture_list:
-            if data_packet.ip_src is not None and data_packet.ip_dst is not None:
-                if data_packet.ip_src not in ip_list:
-                    ip_list.append(data_packet.ip_src)
-                if data_packet.ip_dst not in ip_list:
-                    ip_list.append(data_packet.ip_dst)
-        ip_amount = len(ip_list)
-        assert not math.isnan(ip_amount), "ip_amount est NaN"
-        return ip_amount
+        return len(self.ip_counts)
 
     def calculate_port_amount(self):
         """Calculate the number of unique ports."""
-        port_list = []
-        for data_packet in self.capture_list:
-            if data_packet.port_src is not None and data_packet.port_dst is not None:
-                if data_packet.port_src not in port_list:
-                    port_list.append(data_packet.port_src)
-                if data_packet.port_dst not in port_list:
-                    port_list.append(data_packet.port_dst)
-        port_amount = len(port_list)
-        assert not math.isnan(port_amount), "port_amount est NaN"
-        return port_amount
+        return len(self.port_counts)
+
+    @property
+    def times(self):
+        # Epoch timestamps of the captured packets as a NumPy column
+        return np.fromiter((data_packet.time for data_packet in self.capture_list), dtype=np.float64,
+                           count=len(self.capture_list))
+
+    @property
+    def inter_arrival_times(self):
+        # Time elapsed between consecutive packets of the capture
+        return np.diff(self.times)
 
     def calculate_bitrate(self):
         """Calculate the bitrate based on packet sizes and capture duration."""
         if not self.capture_list:
             return 0
-        first_time = self.capture_list[0].time
-        last_time = self.capture_list[-1].time
-        times = [first_time, last_time]
-        time_objs = []
-        for timers in times:
-            time_objs.append(datetime.strptime(str(timers), "%H:%M:%S:%f"))
-        times.clear()
-        for time_obj in time_objs:
-            times.append(time_obj.hour * 3600 + time_obj.minute * 60 + time_obj.second + time_obj.microsecond / 1e6)
-
-        total_size = sum(data_packet.length for data_packet in self.capture_list)
-        total_time = times[-1] - times[0]
-        if total_time <= 0:
-            total_time = -total_time
-        return total_size / total_time if total_time != 0 else 0
+        total_time = abs(self.calculate_total_time())
+        return self.total_size / total_time if total_time != 0 else 0
 
     def calculate_total_time(self):
         """Calculate the total time of packet capture sample."""
-        first_time = self.capture_list[0].time
-        last_time = self.capture_list[-1].time
-        times = [first_time, last_time]
-        time_objs = []
-        for timers in times:
-            time_objs.append(datetime.strptime(str(timers), "%H:%M:%S:%f"))
-        times.clear()
-        for time_obj in time_objs:
-            times.append(time_obj.hour * 3600 + time_obj.minute * 60 + time_obj.second + time_obj.microsecond / 1e6)
-        total_time = times[-1] - times[0]
-        return total_time
+        return self.capture_list[-1].time - self.capture_list[0].time
 
 
 class DataCapture:
@@ -135,12 +148,20 @@ class DataCapture:
         try:
             if isinstance(data_packet, DataPacket):
                 self.capture_list.append(data_packet)
+                self.stats.add_packet(data_packet)
                 self.size = len(self.capture_list)
             else:
                 raise TypeError
         except TypeError:
             logging.error(f'Object of type {type(data_packet).__name__} is not of type DataPacket')
 
+    def remove_packet(self, index=0):
+        """Remove a packet (the oldest one by default) from the capture list, e.g. to slide the window."""
+        data_packet = self.capture_list.pop(index)
+        self.stats.remove_packet(data_packet)
+        self.size = len(self.capture_list)
+        return data_packet
+
     def get_packet(self, index):
         """Retrieve a packet at a specific index."""
         return self.capture_list[index]
@@ -182,12 +203,17 @@ class DataCapture:
         print("\033[94m---------------------------------------------------\033[0m")
         print()
 
-    def randomize_ips(self):
-        """Anonymize the IP addresses by randomizing the last three octets."""
+    def randomize_ips(self, rng=None):
+        """
+        Anonymize the IP addresses by randomizing the last three octets.
+        rng is an optional random.Random instance, to make the anonymization reproducible.
+        """
+        rng = rng or random
+
         def generate_anonymized_ip(ip):
             ip_parts = ip.split('.')
             first_octet = ip_parts[0]
-            return f"{first_octet}.{random.randint(1, 254)}.{random.randint(1, 254)}.{random.randint(1, 254)}"
+            return f"{first_octet}.{rng.randint(1, 254)}.{rng.randint(1, 254)}.{rng.randint(1, 254)}"
 
         for packet in self.capture_list:
             if packet.ip_src:
@@ -200,6 +226,8 @@ class DataCapture:
                     self.ip_mapping[packet.ip_dst] = generate_anonymized_ip(packet.ip_dst)
                 packet.ip_dst = self.ip_mapping[packet.ip_dst]
 
+        self.stats.recount()
+
 
 class DataPacket:
     """
@@ -232,13 +260,19 @@ class DataPacket:
         else:
             print(f"{none_color}{field_name} : X")
 
+    def format_time(self):
+        """Human-readable form of the epoch timestamp, only built for display."""
+        if self.time is None:
+            return None
+        return datetime.fromtimestamp(self.time).strftime('%H:%M:%S:%f')
+
     def show(self):
         """Display details of the packet."""
         present_color = '\033[94m'
         reset_color = '\033[0m'
         fields = [
             ("TYPE", self.type),
-            ("TIME (h:m:s:f)", self.time),
+            ("TIME (h:m:s:f)", self.format_time()),
             ("LENGTH", self.length),
             ("PROTOCOL", self.protocol),
             ("ACK", self.ack),
@@ -256,11 +290,75 @@ class DataPacket:
         print("")
 
 
+class ColumnarCapture:
+    """
+    Column-oriented capture: one array per DataPacket field instead of one DataPacket object per packet.
+    Missing numeric fields are stored as NaN (flags as -1), missing IPs and payloads as None.
+    """
+    def __init__(self, type, protocol, length, data, ip_src, ip_dst, port_src, port_dst, ack, flags, time):
+        self.type = np.asarray(type, dtype=np.float64)
+        self.protocol = np.asarray(protocol, dtype=np.float64)
+        self.length = np.asarray(length, dtype=np.int64)
+        self.data = data
+        self.ip_src = ip_src
+        self.ip_dst = ip_dst
+        self.port_src = np.asarray(port_src, dtype=np.float64)
+        self.port_dst = np.asarray(port_dst, dtype=np.float64)
+        self.ack = np.asarray(ack, dtype=np.float64)
+        self.flags = np.asarray(flags, dtype=np.int64)
+        self.time = np.asarray(time, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.length)
+
+    def __str__(self):
+        return f"ColumnarCapture<{len(self)} packets>"
+
+    @property
+    def ip_amount(self):
+        # Unique IPs of the packets carrying both a source and a destination address
+        ips = set()
+        for ip_src, ip_dst in zip(self.ip_src, self.ip_dst):
+            if ip_src is not None and ip_dst is not None:
+                ips.add(ip_src)
+                ips.add(ip_dst)
+        return len(ips)
+
+    @property
+    def port_amount(self):
+        # Unique ports of the packets carrying both a source and a destination port
+        has_ports = ~(np.isnan(self.port_src) | np.isnan(self.port_dst))
+        return len(np.union1d(self.port_src[has_ports], self.port_dst[has_ports]))
+
+    @property
+    def bitrate(self):
+        total_time = abs(self.total_time) if len(self) else 0
+        return int(self.length.sum()) / total_time if total_time != 0 else 0
+
+    @property
+    def total_time(self):
+        return float(self.time[-1] - self.time[0])
+
+    @property
+    def inter_arrival_times(self):
+        return np.diff(self.time)
+
+    def take(self, rows):
+        """Returns a ColumnarCapture with only the given rows (e.g. the packets of one flow)."""
+        return ColumnarCapture(self.type[rows], self.protocol[rows], self.length[rows],
+                               [self.data[i] for i in rows], [self.ip_src[i] for i in rows],
+                               [self.ip_dst[i] for i in rows], self.port_src[rows], self.port_dst[rows],
+                               self.ack[rows], self.flags[rows], self.time[rows])
+
+
 class DataExtractor:
     """
     Class to extract data packets from a PCAP file and create DataPacket objects.
+    In streaming mode the file is not loaded in memory: packets are read lazily with PcapReader.
     """
-    def __init__(self, raw_capture=None):
+    def __init__(self, raw_capture=None, streaming=False):
+        self.raw_capture = None
+        self.capture_path = None
         if raw_capture is not None:
             try:
                 cap_path = os.path.join(data_path, raw_capture)
@@ -274,8 +372,12 @@ class DataExtractor:
                     exit(1)
             if raw_capture.split('.')[-1] in ['pcap', 'pcapng']:
                 try:
-                    self.raw_capture = rdpcap(cap_path)
-                    logging.info(f"{cap_path} loaded successfully !")
+                    if streaming:
+                        self.capture_path = cap_path
+                        self.capture_size = os.path.getsize(cap_path)
+                    else:
+                        self.raw_capture = rdpcap(cap_path)
+                        logging.info(f"{cap_path} loaded successfully !")
                 except Exception as e:
                     logging.error("capture could not be loaded")
                     exit(1)
@@ -301,7 +403,7 @@ class DataExtractor:
         p_dst = None
         ack = None
         flags = None
-        timestamp = datetime.fromtimestamp(float(simple_packet.time)).strftime('%H:%M:%S:%f')
+        timestamp = float(simple_packet.time)
 
         if ARP in simple_packet:
             ip_src = simple_packet[ARP].psrc
@@ -342,8 +444,147 @@ class DataExtractor:
                 data_capture.add_packet(self.make_packet_obj(packet, data_capture.size))
         return data_capture
 
+    @staticmethod
+    def find_layers(simple_packet):
+        """
+        Walk a packet once and map each layer class to its first occurrence, in the same order as scapy's
+        getlayer (layer, then packets nested in its fields, then payload).
+        """
+        found = {}
+        layer = simple_packet
+        while not isinstance(layer, NoPayload):
+            found.setdefault(layer.__class__, layer)
+            for field in layer.packetfields:
+                value = layer.getfieldval(field.name)
+                if value is None:
+                    continue
+                for nested in (value if field.islist else [value]):
+                    if isinstance(nested, Packet):
+                        for cls, nested_layer in DataExtractor.find_layers(nested).items():
+                            found.setdefault(cls, nested_layer)
+            layer = layer.payload
+        return found
+
+    @staticmethod
+    def make_packet_row(simple_packet):
+        """
+        Read the DataPacket fields of a raw packet as a tuple, with a single walk over its layers.
+        Same values as make_packet_obj, with NaN (-1 for flags) instead of None for missing numeric fields.
+        """
+        layers = DataExtractor.find_layers(simple_packet)
+        ether = layers.get(Ether)
+        type = ether.type if ether is not None else math.nan
+        ip_src = None
+        ip_dst = None
+        protocol = math.nan
+        p_src = math.nan
+        p_dst = math.nan
+        ack = math.nan
+        flags = -1
+        data = None
+
+        arp = layers.get(ARP)
+        if arp is not None:
+            ip_src = arp.psrc
+            ip_dst = arp.pdst
+            protocol = 0
+
+        ip = layers.get(IP)
+        if ip is not None:
+            ip_src = ip.src
+            ip_dst = ip.dst
+            protocol = ip.proto
+
+        ipv6 = layers.get(IPv6)
+        if ipv6 is not None:
+            ip_src = ipv6.src
+            ip_dst = ipv6.dst
+            protocol = ipv6.nh
+
+        tcp = layers.get(TCP)
+        transport_layer = tcp or layers.get(UDP) or layers.get(SCTP)
+        if transport_layer is not None:
+            p_src = transport_layer.sport
+            p_dst = transport_layer.dport
+            if tcp is not None:
+                ack = tcp.ack
+                flags = int(tcp.flags)
+
+        raw = layers.get(Raw)
+        if raw is not None:
+            data = raw.load
+        return (type, protocol, len(simple_packet), data, ip_src, ip_dst, p_src, p_dst, ack, flags,
+                float(simple_packet.time))
+
+    def extract_columns(self, split_capture=None, timestamps=None):
+        """
+        Extract a raw capture (or a split of it) into a ColumnarCapture, without building DataPacket objects.
+        Items can also be raw Ethernet frames (bytes), in which case timestamps gives their epoch times (by default
+        their time attribute, see core.capture.RawFrame).
+        """
+        packets = self.raw_capture if split_capture is None else split_capture
+        rows = []
+        for i, packet in enumerate(packets):
+            if isinstance(packet, (bytes, bytearray, memoryview)):
+                packet_time = timestamps[i] if timestamps is not None else getattr(packet, 'time', None)
+                packet = Ether(bytes(packet))
+                if packet_time is not None:
+                    packet.time = packet_time
+            rows.append(self.make_packet_row(packet))
+        if not rows:
+            return ColumnarCapture(*([] for _ in range(11)))
+        return ColumnarCapture(*(list(column) for column in zip(*rows)))
+
+    @staticmethod
+    def stream_packets(cap_path, skip=0):
+        """
+        Yields the packets of a capture file one by one with constant memory, with the bytes read so far.
+        The first skip packets are read without being dissected.
+        """
+        with PcapReader(cap_path) as reader:
+            for _ in range(skip):
+                try:
+                    if reader._read_packet() is None:
+                        return
+                except EOFError:
+                    return
+            for packet in reader:
+                yield packet, reader.f.tell()
+
+    def iter_samples(self, packet_by_capture, max_nbr_of_samples=None):
+        """Lazily yields sets of packets from the capture file (streaming mode), reporting progress in bytes."""
+        logging.info("Stream capture in samples of " + str(packet_by_capture) + " packets...")
+        nbr_of_samples = 0
+        packets = []
+        bytes_read = 0
+        for packet, bytes_read in self.stream_packets(self.capture_path):
+            packets.append(packet)
+            if len(packets) >= packet_by_capture:
+                yield packets
+                packets = []
+                nbr_of_samples += 1
+
+                progress = min(bytes_read / self.capture_size * 100, 100) if self.capture_size else 100
+                bar = "█" * (int(progress) // 2)
+                print(f"\rBytes processed: {bar.ljust(50)} {int(progress)}% "
+                      f"[{bytes_read / 1e6:.1f}/{self.capture_size / 1e6:.1f} MB]", end='')
+
+                if max_nbr_of_samples is not None and nbr_of_samples >= max_nbr_of_samples:
+                    break
+
+        if len(packets) > 0:
+            yield packets
+
+        print("")
+        logging.info(f"Capture streamed: {bytes_read / 1e6:.1f} MB read")
+
     def split_raw_capture(self, packet_by_capture, max_nbr_of_samples=None):
-        """Split the raw capture into smaller sets of packets."""
+        """
+        Split the raw capture into smaller sets of packets.
+        In streaming mode the sets are yielded lazily (see iter_samples), iterate over them rather than indexing.
+        """
+        if self.raw_capture is None:
+            return self.iter_samples(packet_by_capture, max_nbr_of_samples)
         logging.info("Split capture in samples of " + str(packet_by_capture) + " packets...")
         split_cap = []
         packets = []
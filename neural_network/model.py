@@ -1,3 +1,4 @@
+import copy
 import torch
 import torch.nn as nn
 
@@ -31,3 +32,17 @@ class MeanSharkNet(nn.Module):
         out = self.relu2(out)
         out = self.fc2(out)
         return out
+
+
+def export_onnx(model, path, input_size=46, sequence_length=400):
+    """
+    Exports the model to ONNX with its two inputs x_packets (batch, sequence, input_size) and x_stats (batch, 4).
+    The batch dimension is dynamic, the sequence length is fixed by the attention layer at export time.
+    A CPU copy in eval mode is exported, the model keeps its device and mode.
+    """
+    exported = copy.deepcopy(model).cpu().eval()
+    example = (torch.zeros(2, sequence_length, input_size), torch.zeros(2, 4))
+    torch.onnx.export(exported, example, path, dynamo=False,
+                      input_names=['x_packets', 'x_stats'], output_names=['logits'],
+                      dynamic_axes={'x_packets': {0: 'batch'}, 'x_stats': {0: 'batch'},
+                                    'logits': {0: 'batch'}})
@@ -1,5 +1,32 @@
 import logging
 import math
+import functools
+import numpy as np
+
+
+# Number of packets of a sample, as the model was trained
+PACKETS_BY_SAMPLE = 200
+
+
+class EncodingCache:
+    """
+    Bounded LRU memoization of a field encoding, shared by every packet: on real traffic the same few hundred
+    addresses, ports and flag combinations repeat constantly. Thread-safe (functools.lru_cache).
+    """
+    def __init__(self, function, max_size=4096):
+        self.function = function
+        self.cached = functools.lru_cache(maxsize=max_size)(function)
+
+    def __call__(self, *args):
+        return self.cached(*args)
+
+    def stats(self):
+        """Hits, misses and size since the last clear, as counted by lru_cache."""
+        info = self.cached.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize}
+
+    def clear(self):
+        self.cached.cache_clear()
 
 
 class ProcessedPacket:
@@ -9,16 +36,15 @@ class ProcessedPacket:
 
     def __init__(self, data_packet):
         # Initialize packet attributes and process various fields (e.g., IPs, ports, flags, etc.)
-        self.type = self.process_type(data_packet.type)
-        self.protocol = self.process_protocol(data_packet.protocol)
+        # The IP and header encodings are memoized across packets (see encoding_cache_stats)
+        self.type, self.protocol, self.port_src, self.port_dst, flags = header_cache(
+            data_packet.type, data_packet.protocol, data_packet.port_src, data_packet.port_dst, data_packet.flags)
         self.length = data_packet.length
         self.data = self.process_data(data_packet.data)
-        self.ip_src = self.process_ip(data_packet.ip_src)
-        self.ip_dst = self.process_ip(data_packet.ip_dst)
-        self.port_src = self.process_port(data_packet.port_src)
-        self.port_dst = self.process_port(data_packet.port_dst)
+        self.ip_src = ip_cache(data_packet.ip_src)
+        self.ip_dst = ip_cache(data_packet.ip_dst)
         self.ack = self.process_ack(data_packet.ack)
-        self.flags = self.process_flags(data_packet.flags)
+        self.flags = list(flags)
         # Vector representation of the packet for easy access.
         self.vector = self.vectorize()
 
@@ -71,7 +97,8 @@ class ProcessedPacket:
         else:
             return [-1.0] * target_length
 
-    def process_ip(self, ip):
+    @staticmethod
+    def process_ip(ip):
         """Converts and normalizes an IP address"""
         processed_ip = -1
         if ip is not None:
@@ -90,35 +117,40 @@ class ProcessedPacket:
                 processed_ip = processed_ip / (4294967295 * 30)
         return processed_ip
 
-    def process_port(self, port):
+    @staticmethod
+    def process_port(port):
         """Normalizes a port number to a value between 0 and 1."""
         if port is not None:
             return port / 65535
         else:
             return -1
 
-    def process_type(self, type):
+    @staticmethod
+    def process_type(type):
         """Normalizes the type field."""
         if type is not None:
             return type / 65535
         else:
             return -1
 
-    def process_protocol(self, protocol):
+    @staticmethod
+    def process_protocol(protocol):
         """Normalizes the protocol."""
         if protocol is not None:
             return protocol / 255
         else:
             return -1
 
-    def process_ack(self, ack):
+    @staticmethod
+    def process_ack(ack):
         """Normalizes the acknowledgment number"""
         if ack is not None:
             return ack / 4294967295
         else:
             return -1
 
-    def process_flags(self, flags):
+    @staticmethod
+    def process_flags(flags):
         """Encodes packet flags (TCP/UDP flags) into a binary vector."""
         processed_flags = [-1] * 8
         if flags is not None:
@@ -132,6 +164,12 @@ class ProcessedPacket:
             if 'E' in flags: processed_flags[7] = 1
         return processed_flags
 
+    @staticmethod
+    def encode_header(type, protocol, port_src, port_dst, flags):
+        """Encodes the header fields of a packet, the flags as a tuple so that the result can be cached."""
+        return (ProcessedPacket.process_type(type), ProcessedPacket.process_protocol(protocol),
+                port_cache(port_src), port_cache(port_dst), flags_cache(flags))
+
     def vectorize(self):
         """Combines all processed fields into a vector representation for analysis."""
         vector = []
@@ -148,6 +186,26 @@ class ProcessedPacket:
         return vector
 
 
+# Shared caches of the ProcessedPacket encodings: a header tuple (type, protocol, ports, flags) is encoded from
+# the port and flag caches on a miss
+ip_cache = EncodingCache(ProcessedPacket.process_ip, 4096)
+port_cache = EncodingCache(ProcessedPacket.process_port, 4096)
+flags_cache = EncodingCache(lambda flags: tuple(ProcessedPacket.process_flags(flags)), 256)
+header_cache = EncodingCache(ProcessedPacket.encode_header, 8192)
+
+
+def encoding_cache_stats():
+    """Hits, misses and size of every encoding cache."""
+    return {'ip': ip_cache.stats(), 'port': port_cache.stats(), 'flags': flags_cache.stats(),
+            'header': header_cache.stats()}
+
+
+def clear_encoding_caches():
+    """Empties every encoding cache and resets its counters."""
+    for cache in (ip_cache, port_cache, flags_cache, header_cache):
+        cache.clear()
+
+
 class ProcessedCapture:
     """
     Represents a collection of processed network packets for analysis.
@@ -195,8 +253,11 @@ class ProcessedCapture:
             logging.error(f'Object of type {type(processed_packet).__name__} is not of type ProcessedPacket')
 
     def to_array(self):
-        """Converts the processed packets into an array format."""
-        return self.processed_packets
+        """
+        Converts the processed packets into an array format, as the model consumes them: the window followed
+        by itself (2 * N rows). model.pt was trained on this doubled sequence, so it must be kept.
+        """
+        return self.processed_packets + self.processed_packets
 
 
 class Processor:
@@ -206,16 +267,159 @@ class Processor:
     def __init__(self, data_capture):
         """Initialize the processor with the raw data capture."""
         self.data_capture = data_capture
+        self._output = None
 
     @property
     def output(self):
-        # Property that triggers the packet processing and returns the processed capture.
-        return self.process()
+        # Property that triggers the packet processing on first access and returns the cached processed capture.
+        if self._output is None:
+            self._output = self.process()
+        return self._output
 
     def process(self):
         """Processes the data capture into a ProcessedCapture."""
-        processed_capture = ProcessedCapture(self.data_capture)
-        for data_packet in self.data_capture:
-            processed_packet = ProcessedPacket(data_packet)
-            processed_capture.add_processed_packet(processed_packet)
-        return processed_capture
+        return ProcessedCapture(self.data_capture)
+
+
+class BatchProcessedCapture:
+    """
+    Processed window built column-wise: a (N, 46) float32 feature matrix plus the 4 normalized statistics.
+    Features match ProcessedPacket.vectorize() column for column.
+    A window shorter than length packets (e.g. closed by a timer) is normalized as a window of length packets
+    and padded to it by to_array().
+    """
+
+    def __init__(self, features, columnar_capture, length=None):
+        self.features = features
+        self.length = length or len(features)
+
+        # Same normalization as ProcessedCapture, the model was trained with these exact formulas.
+        self.bitrate_normalized = columnar_capture.bitrate / 100000000
+        self.ip_amount_normalized = (columnar_capture.ip_amount - 2) / (self.length * 2 - 2)
+        self.port_amount_normalized = columnar_capture.port_amount - 2 / (self.length * 2 - 2)
+        self.total_time_normalized = columnar_capture.total_time / 60
+
+        assert not math.isnan(self.bitrate_normalized), "bitrate_normalized is NaN"
+        assert not math.isnan(self.ip_amount_normalized), "ip_amount_normalized is NaN"
+        assert not math.isnan(self.port_amount_normalized), "port_amount_normalized is NaN"
+        assert not math.isnan(self.total_time_normalized), "total_time_normalized is NaN"
+
+    def __len__(self):
+        return len(self.features)
+
+    def __str__(self):
+        return f"BatchProcessedCapture<{self.features.shape}>"
+
+    @property
+    def stats(self):
+        # Statistics in the order expected by the model's x_stats input
+        return [self.bitrate_normalized, self.ip_amount_normalized, self.port_amount_normalized,
+                self.total_time_normalized]
+
+    def to_array(self):
+        """
+        Returns the features as the model consumes them, same contract as ProcessedCapture.to_array().
+        Short windows are front-padded with rows of missing values (-1), so the last positions stay real packets.
+        """
+        features = self.features
+        if len(features) < self.length:
+            features = np.full((self.length, features.shape[1]), -1, dtype=np.float32)
+            features[self.length - len(self.features):] = self.features
+        return np.concatenate((features, features))
+
+
+class BatchProcessor:
+    """
+    Vectorized counterpart of Processor: processes a ColumnarCapture without any ProcessedPacket object.
+    """
+    # Bit of each TCP flag in the order of ProcessedPacket.process_flags (A, S, P, F, R, U, C, E)
+    flag_bits = np.array([4, 1, 3, 0, 2, 5, 7, 6])
+
+    def __init__(self, columnar_capture):
+        """Initialize the processor with the columnar capture."""
+        self.columnar_capture = columnar_capture
+        self._output = None
+
+    @property
+    def output(self):
+        # Processed once, then served from cache.
+        if self._output is None:
+            self._output = self.process()
+        return self._output
+
+    def process(self):
+        """Processes the columnar capture into a BatchProcessedCapture."""
+        return BatchProcessedCapture(self.process_features(), self.columnar_capture)
+
+    def process_features(self):
+        """Computes the (N, 46) float32 per-packet feature matrix, without the window statistics."""
+        capture = self.columnar_capture
+        features = np.empty((len(capture), 46), dtype=np.float64)
+        features[:, 0] = self.process_ips(capture.ip_src)
+        features[:, 1] = self.process_ips(capture.ip_dst)
+        features[:, 2] = capture.length
+        features[:, 3] = self.normalize(capture.port_src, 65535)
+        features[:, 4] = self.normalize(capture.port_dst, 65535)
+        features[:, 5] = self.normalize(capture.ack, 4294967295)
+        features[:, 6:14] = self.process_flags(capture.flags)
+        features[:, 14] = self.normalize(capture.type, 65535)
+        features[:, 15] = self.normalize(capture.protocol, 255)
+        features[:, 16:46] = self.process_data(capture.data)
+        return features.astype(np.float32)
+
+    @staticmethod
+    def normalize(column, scale):
+        """Divides a numeric column by its maximum value, missing values (NaN) become -1."""
+        return np.where(np.isnan(column), -1.0, column / scale)
+
+    @staticmethod
+    def process_ips(ip_column):
+        """Encodes an IP column, looking each distinct address up only once in the shared IP cache."""
+        encoded = {}
+        for ip in ip_column:
+            if ip not in encoded:
+                encoded[ip] = ip_cache(ip)
+        return np.array([encoded[ip] for ip in ip_column], dtype=np.float64)
+
+    @classmethod
+    def process_flags(cls, flags_column):
+        """Encodes the TCP flags bitmasks into the 8 columns of ProcessedPacket.process_flags."""
+        is_set = (flags_column[:, None] >> cls.flag_bits) & 1
+        has_flags = (flags_column >= 0)[:, None]
+        return np.where(has_flags & (is_set == 1), 1.0, -1.0)
+
+    @staticmethod
+    def payload_codes(data):
+        """Integer values of a payload: unicode code points if it decodes as UTF-8, raw bytes otherwise."""
+        if data.isascii():
+            return np.frombuffer(data, dtype=np.uint8)
+        try:
+            decoded = data.decode()
+        except UnicodeDecodeError:
+            return np.frombuffer(data, dtype=np.uint8)
+        return np.frombuffer(decoded.encode('utf-32-le'), dtype=np.uint32)
+
+    @staticmethod
+    def process_data(data_column, target_length=30):
+        """Vectorized ProcessedPacket.process_data over a payload column."""
+        size = len(data_column)
+        values = np.full((size, target_length), -1.0)
+        removed_sums = np.zeros(size, dtype=np.int64)
+        has_data = np.zeros(size, dtype=bool)
+        for i, data in enumerate(data_column):
+            if data is None:
+                continue
+            has_data[i] = True
+            codes = BatchProcessor.payload_codes(bytes(data))
+            values[i, :min(len(codes), target_length)] = codes[:target_length]
+            removed_sums[i] = int(codes[target_length:].sum())
+
+        # Spread the sum of truncated values over the kept ones (no-op for payloads that were not truncated)
+        values += (removed_sums / target_length)[:, None]
+        values += np.arange(target_length) < (removed_sums % target_length)[:, None]
+
+        min_values = values.min(axis=1, keepdims=True)
+        spans = values.max(axis=1, keepdims=True) - min_values
+        normalized = np.divide(values - min_values, spans, out=np.zeros_like(values), where=spans > 0)
+        normalized[~has_data] = -1.0
+        return normalized
@@ -1,8 +1,13 @@
+import os
+import time
+import random
 import numpy as np
 import torch
-from torch.utils.data import DataLoader, TensorDataset,random_split
+from torch.utils.data import DataLoader, Dataset, random_split
 from model import MeanSharkNet
 import logging
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import torch.nn as nn
 import utils
@@ -15,124 +20,266 @@ def init_weights(m):
             nn.init.zeros_(m.bias)
 
 
+class ShardedDataset(Dataset):
+    """
+    Map-style dataset over (features, stats, labels) shards, typically memory-mapped .npy files:
+    a sample is only read from disk when a batch needs it, so the dataset size is limited by disk rather than RAM.
+    """
+    def __init__(self, shards):
+        self.shards = shards
+        self.offsets = np.cumsum([0] + [len(shard[2]) for shard in shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        shard_index = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        features, stats, labels = self.shards[shard_index]
+        i = index - self.offsets[shard_index]
+        return (torch.from_numpy(np.array(features[i], dtype=np.float32)),
+                torch.from_numpy(np.array(stats[i], dtype=np.float32)),
+                torch.tensor(labels[i], dtype=torch.long))
+
+    def __getstate__(self):
+        # Memory-mapped shards are sent to the DataLoader workers by file name, not by content
+        state = self.__dict__.copy()
+        state['shards'] = [tuple(('memmap', array.filename) if isinstance(array, np.memmap) else array
+                                 for array in shard) for shard in self.shards]
+        return state
+
+    def __setstate__(self, state):
+        state['shards'] = [tuple(np.load(array[1], mmap_mode='r') if isinstance(array, tuple) else array
+                                 for array in shard) for shard in state['shards']]
+        self.__dict__.update(state)
+
+
 class Trainer:
     """
     Manages the training, validation, and testing of the MeanSharkNet.
+    Samples are streamed from the (memory-mapped) dataset by DataLoader workers and moved to the device by batch.
     """
-    def __init__(self, mean_shark_dataset):
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        logging.info('Using device: {}'.format(device))
-
-        features = torch.tensor(mean_shark_dataset.features, dtype=torch.float32).to(device)
-        stats = torch.tensor(mean_shark_dataset.stats, dtype=torch.float32).to(device)
-        labels = torch.tensor(mean_shark_dataset.labels, dtype=torch.long).to(device)
+    def __init__(self, mean_shark_dataset, num_workers=2, seed=42, anomaly_check_interval=100, loss_spike_factor=10,
+                 checkpoint_dir="checkpoints", checkpoint_interval=10, patience=30):
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        logging.info('Using device: {}'.format(self.device))
 
-        self.dataset = TensorDataset(features, stats, labels)
+        self.dataset = ShardedDataset(mean_shark_dataset.shards)
         self.train_size = int(0.7 * len(self.dataset))
         self.val_size = int(0.15 * len(self.dataset))
         self.test_size = len(self.dataset) - self.train_size - self.val_size
-        self.train_dataset, self.val_dataset, self.test_dataset = random_split(self.dataset, [self.train_size, self.val_size, self.test_size])
+        self.train_dataset, self.val_dataset, self.test_dataset = random_split(
+            self.dataset, [self.train_size, self.val_size, self.test_size], generator=torch.Generator().manual_seed(seed))
         self.batch_size = 75
-        self.input_size = mean_shark_dataset.features.shape[2]
+        self.num_workers = num_workers
+        self.input_size = mean_shark_dataset.feature_shape[1]
         self.hidden_size = 70
         self.attention_head = 10
         self.output_size = len(np.unique(mean_shark_dataset.labels))
-        self.model = MeanSharkNet(self.input_size, self.hidden_size,self.output_size,self.attention_head).to(device)
+        self.model = MeanSharkNet(self.input_size, self.hidden_size,self.output_size,self.attention_head).to(self.device)
         self.criterion = torch.nn.CrossEntropyLoss()
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=0.00002)
         self.train_losses = []
         self.val_losses = []
         self.train_accuracies = []
         self.val_accuracies = []
+        # Gradient NaN/Inf check every anomaly_check_interval steps (None to disable), see check_anomalies
+        self.anomaly_check_interval = anomaly_check_interval
+        self.loss_spike_factor = loss_spike_factor
+        # Checkpoint every checkpoint_interval epochs, stop after patience epochs without validation improvement
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.patience = patience
+        self.epoch = 0
+        self.best_val_loss = float('inf')
+        self.best_epoch = 0
+        self.best_state = None
 
-    def train(self, num_epochs=350):
-        train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=True)
-        val_loader = DataLoader(self.val_dataset, batch_size=self.batch_size, shuffle=False)
+    def make_loader(self, dataset, shuffle):
+        """DataLoader with background workers prefetching batches, in pinned memory when training on GPU."""
+        return DataLoader(dataset, batch_size=self.batch_size, shuffle=shuffle, num_workers=self.num_workers,
+                          pin_memory=self.device.type == 'cuda', persistent_workers=self.num_workers > 0,
+                          prefetch_factor=4 if self.num_workers > 0 else None)
+
+    def to_device(self, x_packets, x_stats, y):
+        """Moves a batch to the device, asynchronously when it comes from pinned memory."""
+        return (x_packets.to(self.device, non_blocking=True), x_stats.to(self.device, non_blocking=True),
+                y.to(self.device, non_blocking=True))
+
+    def train(self, num_epochs=350, resume=None):
+        """
+        Trains the model. Loss and accuracy are accumulated on the device and read once per epoch;
+        gradients are checked for NaN/Inf only every anomaly_check_interval steps (see check_anomalies).
+        Training resumes from the checkpoint file resume if given, stops early after patience epochs without
+        validation loss improvement, and ends with the weights of the best epoch.
+        """
+        if resume is not None:
+            self.load_checkpoint(resume)
+        train_loader = self.make_loader(self.train_dataset, shuffle=True)
+        val_loader = self.make_loader(self.val_dataset, shuffle=False)
         logging.info("Training start")
         #torch.autograd.set_detect_anomaly(True)
 
-        for epoch in range(num_epochs):
-
+        for epoch in range(self.epoch, num_epochs):
+            epoch_start = time.perf_counter()
             self.model.train()
-            running_loss = 0.0
-            correct = 0
+            running_loss = torch.zeros((), device=self.device)
+            correct = torch.zeros((), dtype=torch.long, device=self.device)
             total = 0
-            for x_packets, x_stats, y in train_loader:
-                self.optimizer.zero_grad()
+            for step, batch in enumerate(train_loader):
+                x_packets, x_stats, y = self.to_device(*batch)
+                self.optimizer.zero_grad(set_to_none=True)
                 outputs = self.model(x_packets, x_stats)
                 loss = self.criterion(outputs, y)
                 loss.backward()
-                torch.nn.utils.clip_grad_norm_(self.model.parameters(), max_norm=1.0)
-                for name, param in self.model.named_parameters():
-                    if param.grad is not None:
-                        if torch.isnan(param.grad).any():
-                            print(f"NaN in gradients of {name}")
-                        elif torch.isinf(param.grad).any():
-                            print(f"Inf in gradients of {name}")
+                grad_norm = torch.nn.utils.clip_grad_norm_(self.model.parameters(), max_norm=1.0)
+                if self.anomaly_check_interval and step % self.anomaly_check_interval == 0:
+                    self.check_anomalies(loss, grad_norm, running_loss, step)
                 self.optimizer.step()
-                running_loss += loss.item()
-                _, predicted = torch.max(outputs, 1)
+                running_loss += loss.detach()
+                correct += (outputs.argmax(dim=1) == y).sum()
                 total += y.size(0)
-                correct += (predicted == y).sum().item()
 
-            self.train_losses.append(running_loss / len(train_loader))
-            self.train_accuracies.append(correct / total)
-            logging.info(f"Epoch {epoch + 1}, Loss: {running_loss / len(train_loader)}, Accuracy: {correct / total}")
+            # Single host sync of the epoch
+            train_loss = running_loss.item() / len(train_loader)
+            train_accuracy = correct.item() / total
+            elapsed = time.perf_counter() - epoch_start
+            self.train_losses.append(train_loss)
+            self.train_accuracies.append(train_accuracy)
+            logging.info(f"Epoch {epoch + 1}, Loss: {train_loss}, Accuracy: {train_accuracy}, "
+                         f"{len(train_loader) / elapsed:.1f} steps/s, {total / elapsed:.1f} samples/s")
 
-            self.model.eval()
-            val_loss = 0.0
-            correct = 0
-            total = 0
-            with torch.no_grad():
-                for x_packets, x_stats, y in val_loader:
-                    outputs = self.model(x_packets, x_stats)
-                    loss = self.criterion(outputs, y)
-                    val_loss += loss.item()
-                    _, predicted = torch.max(outputs, 1)
-                    total += y.size(0)
-                    correct += (predicted == y).sum().item()
-
-            self.val_losses.append(val_loss / len(val_loader))
-            self.val_accuracies.append(correct / total)
-            logging.info(f"Validation Loss: {val_loss / len(val_loader)}, Accuracy: {correct / total}")
+            val_loss, val_accuracy = self.evaluate(val_loader)
+            self.val_losses.append(val_loss)
+            self.val_accuracies.append(val_accuracy)
+            logging.info(f"Validation Loss: {val_loss}, Accuracy: {val_accuracy}")
+            self.epoch = epoch + 1
+
+            if val_loss < self.best_val_loss:
+                self.best_val_loss = val_loss
+                self.best_epoch = self.epoch
+                self.best_state = {name: value.detach().cpu().clone() for name, value in self.model.state_dict().items()}
+
+            if self.checkpoint_interval and self.epoch % self.checkpoint_interval == 0:
+                self.save_checkpoint()
+            if self.patience and self.epoch - self.best_epoch >= self.patience:
+                logging.info(f"Early stopping: no validation improvement for {self.patience} epochs")
+                break
 
+        self.save_checkpoint()
+        if self.best_state is not None:
+            self.model.load_state_dict(self.best_state)
+            logging.info(f"Best model kept: epoch {self.best_epoch}, validation loss {self.best_val_loss}")
         logging.info("training finished")
+        self.save_plots()
 
-        epochs = range(1, num_epochs + 1)
-        plt.figure()
-        plt.plot(epochs, self.train_losses, 'b', label='Training Loss')
-        plt.plot(epochs, self.val_losses, 'r', label='Validation Loss')
-        plt.title('Training and Validation Losses')
-        plt.xlabel('Epochs')
-        plt.ylabel('Loss')
-        plt.legend()
-        plt.show()
-
-        plt.figure()
-        plt.plot(epochs, self.train_accuracies, 'b', label='Training Accuracy')
-        plt.plot(epochs, self.val_accuracies, 'r', label='Validation Accuracy')
-        plt.title('Training and Validation Accuracies')
-        plt.xlabel('Epochs')
-        plt.ylabel('Accuracy')
-        plt.legend()
-        plt.show()
+    def save_plots(self, directory="."):
+        """Writes the loss and accuracy curves to PNG files (non-interactive, training can run unattended)."""
+        epochs = range(1, len(self.train_losses) + 1)
+        for name, train_values, val_values, label in (
+                ('losses', self.train_losses, self.val_losses, 'Loss'),
+                ('accuracies', self.train_accuracies, self.val_accuracies, 'Accuracy')):
+            figure = plt.figure()
+            plt.plot(epochs, train_values, 'b', label=f'Training {label}')
+            plt.plot(epochs, val_values, 'r', label=f'Validation {label}')
+            plt.title(f'Training and Validation {name.capitalize()}')
+            plt.xlabel('Epochs')
+            plt.ylabel(label)
+            plt.legend()
+            path = os.path.join(directory, f'training_{name}.png')
+            figure.savefig(path)
+            plt.close(figure)
+            logging.info(f"Plot saved to {path}")
 
-    def test(self):
-        logging.info("Start testing the model")
-        test_loader = DataLoader(self.test_dataset, batch_size=self.batch_size, shuffle=False)
+    def save_checkpoint(self, path=None):
+        """
+        Saves everything needed to resume training: model, optimizer, histories, best model and RNG states.
+        Written to checkpoint_dir/last.pt by default.
+        """
+        if path is None:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            path = os.path.join(self.checkpoint_dir, 'last.pt')
+        checkpoint = {
+            'epoch': self.epoch,
+            'model': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'train_losses': self.train_losses,
+            'val_losses': self.val_losses,
+            'train_accuracies': self.train_accuracies,
+            'val_accuracies': self.val_accuracies,
+            'best_val_loss': self.best_val_loss,
+            'best_epoch': self.best_epoch,
+            'best_state': self.best_state,
+            'rng': {
+                'torch': torch.get_rng_state(),
+                'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+                'numpy': np.random.get_state(),
+                'python': random.getstate(),
+            },
+        }
+        tmp_path = path + '.tmp'
+        torch.save(checkpoint, tmp_path)
+        os.replace(tmp_path, path)
+        logging.info(f"Checkpoint saved to {path} (epoch {self.epoch})")
+
+    def load_checkpoint(self, path):
+        """Restores a checkpoint written by save_checkpoint, training then continues at the next epoch."""
+        checkpoint = torch.load(path, map_location=self.device, weights_only=False)
+        self.epoch = checkpoint['epoch']
+        self.model.load_state_dict(checkpoint['model'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        self.train_losses = checkpoint['train_losses']
+        self.val_losses = checkpoint['val_losses']
+        self.train_accuracies = checkpoint['train_accuracies']
+        self.val_accuracies = checkpoint['val_accuracies']
+        self.best_val_loss = checkpoint['best_val_loss']
+        self.best_epoch = checkpoint['best_epoch']
+        self.best_state = checkpoint['best_state']
+        torch.set_rng_state(checkpoint['rng']['torch'].cpu())
+        if checkpoint['rng']['cuda'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(checkpoint['rng']['cuda'])
+        np.random.set_state(checkpoint['rng']['numpy'])
+        random.setstate(checkpoint['rng']['python'])
+        logging.info(f"Training resumed from {path} at epoch {self.epoch + 1}")
+
+    def check_anomalies(self, loss, grad_norm, running_loss, step):
+        """
+        Sampled anomaly check (it syncs with the device): the clipped gradients' total norm is not finite
+        as soon as one gradient holds a NaN or Inf. On such a step, or on a loss spike compared to the epoch's
+        mean loss so far, every parameter is scanned to report the faulty ones.
+        """
+        loss_value = loss.item()
+        mean_loss = running_loss.item() / step if step else loss_value
+        if torch.isfinite(grad_norm) and loss_value <= self.loss_spike_factor * mean_loss:
+            return
+        logging.warning(f"Anomaly at step {step}: loss {loss_value} (epoch mean {mean_loss}), "
+                        f"gradient norm {grad_norm.item()}")
+        for name, param in self.model.named_parameters():
+            if param.grad is not None:
+                if torch.isnan(param.grad).any():
+                    print(f"NaN in gradients of {name}")
+                elif torch.isinf(param.grad).any():
+                    print(f"Inf in gradients of {name}")
+
+    def evaluate(self, loader):
+        """Returns the mean loss and the accuracy of the model on a loader, with a single host sync."""
         self.model.eval()
-        test_loss = 0.0
-        correct = 0
+        total_loss = torch.zeros((), device=self.device)
+        correct = torch.zeros((), dtype=torch.long, device=self.device)
         total = 0
         with torch.no_grad():
-            for x_packets, x_stats, y in test_loader:
+            for batch in loader:
+                x_packets, x_stats, y = self.to_device(*batch)
                 outputs = self.model(x_packets, x_stats)
-                loss = self.criterion(outputs, y)
-                test_loss += loss.item()
-                _, predicted = torch.max(outputs, 1)
+                total_loss += self.criterion(outputs, y)
+                correct += (outputs.argmax(dim=1) == y).sum()
                 total += y.size(0)
-                correct += (predicted == y).sum().item()
-                print(f"Test Loss: {test_loss / len(test_loader)}, Accuracy: {correct / total}")
+        return total_loss.item() / len(loader), correct.item() / total
+
+    def test(self):
+        logging.info("Start testing the model")
+        test_loader = self.make_loader(self.test_dataset, shuffle=False)
+        test_loss, test_accuracy = self.evaluate(test_loader)
+        print(f"Test Loss: {test_loss}, Accuracy: {test_accuracy}")
         logging.info("testing the model finished")
 
 
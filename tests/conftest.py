@@ -0,0 +1,45 @@
+import os
+import sys
+import pytest
+from scapy.layers.dns import DNS, DNSQR
+from scapy.layers.inet import ICMP, IP, TCP, UDP
+from scapy.layers.inet6 import IPv6
+from scapy.layers.l2 import ARP, Ether
+from scapy.packet import Raw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def make_mixed_packets(nbr_of_packets=200, start_time=1700000000.0):
+    """
+    Packets of every kind the extractors handle (TCP with and without payload, UDP, DNS, ICMP, ARP, IPv6, UTF-8,
+    non-UTF-8 and truncated payloads), with increasing timestamps.
+    """
+    ether = Ether(src="02:00:00:00:00:01", dst="02:00:00:00:00:02")
+    templates = [
+        ether / IP(src="10.0.0.1", dst="10.0.0.2") / TCP(sport=40000, dport=80, flags='PA', seq=1, ack=1000)
+        / Raw(b"GET / HTTP/1.1\r\nHost: example.com\r\n\r\n"),
+        ether / IP(src="10.0.0.2", dst="10.0.0.1") / TCP(sport=80, dport=40000, flags='A', ack=4294967295),
+        ether / IP(src="10.0.0.3", dst="10.0.0.4") / TCP(sport=1234, dport=443, flags='SECU'),
+        ether / IP(src="192.168.1.5", dst="8.8.8.8") / UDP(sport=5353, dport=53) / DNS(qd=DNSQR(qname="example.com")),
+        ether / IP(src="192.168.1.5", dst="192.168.1.1") / UDP(sport=9999, dport=9999) / Raw(bytes(range(256))),
+        ether / IP(src="192.168.1.5", dst="1.1.1.1") / ICMP(),
+        ether / ARP(psrc="192.168.1.5", pdst="192.168.1.1"),
+        ether / IPv6(src="fd00::1", dst="fd00::2") / TCP(sport=2000, dport=22, flags='S'),
+        ether / IPv6(src="fe80::1", dst="ff02::1") / UDP(sport=546, dport=547) / Raw("héllo wörld ✓".encode()),
+        ether / IP(src="10.0.0.1", dst="10.0.0.9") / TCP(sport=40001, dport=8080, flags='FA')
+        / Raw(b"\xff\xfe\x00\x80" * 20),
+    ]
+    packets = []
+    for i in range(nbr_of_packets):
+        packet = templates[i % len(templates)].copy()
+        packet.time = start_time + i * 0.01
+        packets.append(packet)
+    return packets
+
+
+@pytest.fixture
+def mixed_packets():
+    return make_mixed_packets()
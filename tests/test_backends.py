@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+from scapy.utils import PcapReader
+from neural_network.extracting import DataExtractor
+from neural_network.processing import PACKETS_BY_SAMPLE, BatchProcessor
+from benchmarks.traffic import synthetic_pcap
+from conftest import ROOT, make_mixed_packets
+
+torch = pytest.importorskip('torch')
+from neural_network.model import MeanSharkNet, export_onnx
+from core.inference import OnnxModelManager
+from core.model_manager import compare_backends
+
+MODEL_PATH = os.path.join(ROOT, "neural_network", "model.pt")
+# Largest difference of the class probabilities allowed against eager
+MAX_ABS_DIFF = {'torchscript': 1e-5, 'compile': 1e-4, 'int8': 0.05, 'amp': 0.05}
+
+
+def make_windows(packets):
+    samples, x_stats = [], []
+    for start in range(0, len(packets) - PACKETS_BY_SAMPLE + 1, PACKETS_BY_SAMPLE):
+        processed = BatchProcessor(DataExtractor().extract_columns(packets[start:start + PACKETS_BY_SAMPLE])).process()
+        samples.append(processed.to_array())
+        x_stats.append(processed.stats)
+    return np.stack(samples), np.array(x_stats, dtype=np.float32)
+
+
+@pytest.fixture(scope='module')
+def windows(tmp_path_factory):
+    # Hand-built packets of every kind plus synthetic traffic with random payloads
+    with PcapReader(synthetic_pcap(str(tmp_path_factory.mktemp('pcaps')), 2000, seed=1)) as reader:
+        synthetic = list(reader)
+    mixed_samples, mixed_stats = make_windows(make_mixed_packets(1000))
+    synthetic_samples, synthetic_stats = make_windows(synthetic)
+    return np.concatenate((mixed_samples, synthetic_samples)), np.concatenate((mixed_stats, synthetic_stats))
+
+
+@pytest.mark.parametrize('backend', ['torchscript', 'compile', 'int8', 'amp'])
+def test_backend_agrees_with_eager(backend, windows):
+    samples, x_stats = windows
+    report = compare_backends(samples, x_stats, backends=(backend,), model_path=MODEL_PATH, repeats=1)[backend]
+    if backend == 'compile' and 'error' in report:
+        pytest.skip(f"torch.compile unavailable: {report['error']}")
+    assert 'error' not in report, report.get('error')
+    assert report['agreement'] == 1.0
+    assert report['max_abs_diff'] <= MAX_ABS_DIFF[backend]
+
+
+def test_onnx_export_agrees_with_pytorch(windows, tmp_path):
+    pytest.importorskip('onnxruntime')
+    pytest.importorskip('onnx')
+    model = MeanSharkNet(46, 70, 2, 10)
+    model.load_state_dict(torch.load(MODEL_PATH, weights_only=True, map_location='cpu'))
+    onnx_path = str(tmp_path / "model.onnx")
+    model.train()
+    export_onnx(model, onnx_path)
+    # The caller's model is left as it was
+    assert model.training
+
+    samples, x_stats = windows
+    report = compare_backends(samples, x_stats, backends=('onnx',), model_path=MODEL_PATH, onnx_path=onnx_path,
+                              repeats=1)['onnx']
+    assert 'error' not in report, report.get('error')
+    assert report['agreement'] == 1.0
+    assert report['max_abs_diff'] <= 1e-4
+    # The exported batch dimension is dynamic
+    labels, probabilities = OnnxModelManager(onnx_path).predict_batch(samples[:3], x_stats[:3])
+    assert len(labels) == 3 and probabilities.shape == (3, 2)
@@ -0,0 +1,181 @@
+import time
+import threading
+import numpy as np
+import pytest
+from scapy.utils import PcapReader
+from neural_network.extracting import DataExtractor
+from neural_network.processing import BatchProcessor
+from core.inference import BaseModelManager
+from core.pipeline import PacketManager
+from core.flows import FlowTable
+from core.retention import PacketRetention
+from benchmarks.traffic import generate_pcap
+from conftest import make_mixed_packets
+
+
+class RecordingModelManager(BaseModelManager):
+    """Model manager recording the inputs of every batch, every window is classified as normal."""
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def predict_batch(self, samples, x_stats):
+        with self.lock:
+            self.batches.append((np.array(samples), np.array(x_stats)))
+        return [0] * len(samples), np.tile([1.0, 0.0], (len(samples), 1))
+
+
+def run_packet_manager(packets, on_verdict=None, nbr_of_workers=1, **options):
+    model_manager = RecordingModelManager()
+    verdicts = []
+    packet_manager = PacketManager(model_manager, on_verdict or verdicts.append, max_batch_size=1, **options)
+    packet_manager.start_workers(nbr_of_workers)
+    try:
+        for packet in packets:
+            packet_manager.packet_thread(packet, policy='block')
+        packet_manager.join()
+        packet_manager.flush()
+        packet_manager.join()
+    finally:
+        packet_manager.stop_workers()
+    return model_manager, verdicts
+
+
+def test_model_receives_the_doubled_window(mixed_packets):
+    model_manager, verdicts = run_packet_manager(mixed_packets)
+    assert len(verdicts) == 1
+    (samples, x_stats), = model_manager.batches
+    assert samples.shape == (1, 400, 46)
+    assert x_stats.shape == (1, 4)
+    np.testing.assert_array_equal(samples[0, :200], samples[0, 200:])
+
+
+def run_with_timeout(function, timeout=60):
+    # Runs function in a thread, a pipeline that hangs fails the test instead of blocking the suite
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the pipeline hangs"
+    return result[0]
+
+
+def test_failing_chunk_does_not_stall_the_workers(monkeypatch):
+    extract_columns = DataExtractor.extract_columns
+    calls = []
+
+    def failing_extract_columns(self, split_capture=None, timestamps=None):
+        calls.append(len(split_capture))
+        if len(calls) == 2:
+            raise ValueError("malformed packet")
+        return extract_columns(self, split_capture, timestamps)
+
+    monkeypatch.setattr(DataExtractor, 'extract_columns', failing_extract_columns)
+    packets = make_mixed_packets(600)
+    _, verdicts = run_with_timeout(lambda: run_packet_manager(packets))
+    assert [verdict['first_packet'] for verdict in verdicts] == [0, 400]
+
+
+def test_workers_keep_the_packet_order():
+    packets = make_mixed_packets(2000)
+    _, verdicts = run_with_timeout(lambda: run_packet_manager(packets, nbr_of_workers=4))
+    assert [verdict['first_packet'] for verdict in verdicts] == list(range(0, 2000, 200))
+    assert all(verdict['packets'] == 200 for verdict in verdicts)
+
+
+def test_failing_on_verdict_does_not_block_join():
+    published = []
+
+    def on_verdict(verdict):
+        published.append(verdict['sample'])
+        if len(published) == 1:
+            raise BrokenPipeError("output closed")
+
+    run_with_timeout(lambda: run_packet_manager(make_mixed_packets(600), on_verdict))
+    assert published == [0, 1, 2]
+
+
+def test_stop_workers_stops_the_batcher(mixed_packets):
+    packet_manager = PacketManager(RecordingModelManager())
+    packet_manager.start_workers(2)
+    batcher_thread = packet_manager.batcher.thread
+    for packet in mixed_packets:
+        packet_manager.packet_thread(packet, policy='block')
+    packet_manager.join()
+    run_with_timeout(packet_manager.stop_workers)
+    assert not batcher_thread.is_alive()
+    assert packet_manager.batcher.thread is None
+
+
+def run_with_pauses(packets, pause_every, pause, **options):
+    # Feeds the packets with pauses longer than the time windows, like a slow replay
+    def run():
+        verdicts = []
+        packet_manager = PacketManager(RecordingModelManager(), verdicts.append, max_batch_size=1, **options)
+        packet_manager.start_workers()
+        try:
+            for i, packet in enumerate(packets):
+                if i and i % pause_every == 0:
+                    packet_manager.join()
+                    time.sleep(pause)
+                packet_manager.packet_thread(packet, policy='block')
+            packet_manager.join()
+            packet_manager.flush()
+            packet_manager.join()
+        finally:
+            packet_manager.stop_workers()
+        return sorted((verdict.get('flow'), verdict['first_packet'], verdict['packets']) for verdict in verdicts)
+
+    return run_with_timeout(run)
+
+
+def test_offline_time_windows_close_on_packet_timestamps():
+    # 100 packets 10 ms apart: windows of 30 packets by their timestamps, however slowly they are processed
+    packets = make_mixed_packets(100)
+    windows = run_with_pauses(packets, 25, 0.4, mode='time', window_time=0.295, live=False)
+    assert windows == [(None, 0, 30), (None, 30, 30), (None, 60, 30), (None, 90, 10)]
+    live_windows = run_with_pauses(packets, 25, 0.4, mode='time', window_time=0.295, live=True)
+    # A live capture closes them on the local clock during the pauses
+    assert live_windows == [(None, 0, 25), (None, 25, 25), (None, 50, 25), (None, 75, 25)]
+
+
+def test_sharded_flows_match_in_process_flows():
+    packets = make_mixed_packets(1000)
+    options = dict(flows='5-tuple', mode='first', window_time=0.5, live=False)
+    in_process = run_with_pauses(packets, 300, 0.6, **options)
+    assert in_process == run_with_pauses(packets, 300, 0.6, **options)
+    assert in_process == run_with_pauses(packets, 300, 0.6, flow_processes=2, **options)
+
+
+@pytest.mark.parametrize('flow_processes', [0, 2])
+def test_every_flow_gets_a_verdict(tmp_path, flow_processes):
+    # Hundreds of short flows: most never reach 200 packets, they are classified when the file ends
+    with PcapReader(generate_pcap(str(tmp_path / "flows.pcap"), 3000, nbr_of_flows=300, seed=3)) as reader:
+        packets = list(reader)
+    flows = set(FlowTable('5-tuple').flow_keys(DataExtractor().extract_columns(packets)))
+    _, verdicts = run_with_timeout(lambda: run_packet_manager(packets, flows='5-tuple',
+                                                              flow_processes=flow_processes, live=False))
+    assert {verdict['flow'] for verdict in verdicts} == flows
+    # Every packet is classified exactly once
+    assert sum(verdict['packets'] for verdict in verdicts) == len(packets)
+
+
+def test_evicted_flow_is_classified():
+    packets = make_mixed_packets(30)
+    # One flow at a time: every new flow evicts the previous one
+    table = FlowTable('5-tuple', mode='count', max_flows=1)
+    columns = DataExtractor().extract_columns(packets)
+    samples = table.push(columns, BatchProcessor(columns).process_features(), range(len(packets)))
+    samples += table.flush()
+    assert sum(len(sample[0]) for sample in samples) == len(packets)
+    assert all(sample[1].to_array().shape == (400, 46) for sample in samples)
+
+
+def test_failing_spill_does_not_stall_the_workers(monkeypatch):
+    def failing_spill(self):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(PacketRetention, 'spill', failing_spill)
+    packets = make_mixed_packets(1000)
+    _, verdicts = run_with_timeout(lambda: run_packet_manager(packets, nbr_of_workers=2, memory_windows=1))
+    assert [verdict['first_packet'] for verdict in verdicts] == list(range(0, 1000, 200))
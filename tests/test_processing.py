@@ -0,0 +1,97 @@
+import numpy as np
+from scapy.layers.l2 import Ether
+from neural_network.extracting import DataExtractor
+from neural_network.processing import BatchProcessedCapture, BatchProcessor, Processor
+from core.capture import RawFrame
+
+
+def reference_output(packets):
+    return Processor(DataExtractor().extract_data(split_capture=packets)).output
+
+
+def reference_stats(output):
+    return [output.bitrate_normalized, output.ip_amount_normalized, output.port_amount_normalized,
+            output.total_time_normalized]
+
+
+def test_batch_features_match_processor(mixed_packets):
+    expected = reference_output(mixed_packets)
+    processed = BatchProcessor(DataExtractor().extract_columns(mixed_packets)).process()
+    assert processed.features.shape == (len(mixed_packets), 46)
+    assert processed.features.dtype == np.float32
+    np.testing.assert_allclose(processed.features, np.array(expected.processed_packets, dtype=np.float32),
+                               rtol=1e-6, atol=1e-7)
+
+
+def test_batch_stats_match_processor(mixed_packets):
+    expected = reference_output(mixed_packets)
+    processed = BatchProcessor(DataExtractor().extract_columns(mixed_packets)).process()
+    np.testing.assert_allclose(processed.stats, reference_stats(expected), rtol=1e-9)
+
+
+def test_every_packet_kind_matches_on_its_own(mixed_packets):
+    # One window per kind of packet, so that a column off for a single kind is not averaged out
+    for packet in mixed_packets[:10]:
+        window = [packet, packet.copy()]
+        window[1].time = packet.time + 1
+        expected = reference_output(window)
+        processed = BatchProcessor(DataExtractor().extract_columns(window)).process()
+        np.testing.assert_allclose(processed.features, np.array(expected.processed_packets, dtype=np.float32),
+                                   rtol=1e-6, atol=1e-7, err_msg=packet.summary())
+        np.testing.assert_allclose(processed.stats, reference_stats(expected), rtol=1e-9, err_msg=packet.summary())
+
+
+def test_raw_frames_match_dissected_packets(mixed_packets):
+    frames = [RawFrame(bytes(packet), float(packet.time)) for packet in mixed_packets]
+    dissected = [Ether(bytes(packet)) for packet in mixed_packets]
+    for packet, original in zip(dissected, mixed_packets):
+        packet.time = original.time
+    expected = BatchProcessor(DataExtractor().extract_columns(dissected)).process()
+    processed = BatchProcessor(DataExtractor().extract_columns(frames)).process()
+    np.testing.assert_array_equal(processed.features, expected.features)
+    np.testing.assert_allclose(processed.stats, expected.stats)
+
+
+def test_model_input_is_the_doubled_window(mixed_packets):
+    # model.pt was trained on the 200-packet window followed by itself: (400, 46) per sample
+    output = reference_output(mixed_packets)
+    tensor = np.array(output.to_array(), dtype=np.float32)
+    assert tensor.shape == (400, 46)
+    np.testing.assert_array_equal(tensor[:200], tensor[200:])
+    np.testing.assert_array_equal(tensor[:200], np.array(output.processed_packets, dtype=np.float32))
+
+    processed = BatchProcessor(DataExtractor().extract_columns(mixed_packets)).process()
+    batch_tensor = processed.to_array()
+    assert batch_tensor.shape == (400, 46)
+    assert batch_tensor.dtype == np.float32
+    np.testing.assert_allclose(batch_tensor, tensor, rtol=1e-6, atol=1e-7)
+
+
+def test_model_stats_vector(mixed_packets):
+    lengths = [len(packet) for packet in mixed_packets]
+    total_time = float(mixed_packets[-1].time - mixed_packets[0].time)
+    columns = DataExtractor().extract_columns(mixed_packets)
+    ips = {ip for pair in zip(columns.ip_src, columns.ip_dst) if None not in pair for ip in pair}
+    has_ports = ~(np.isnan(columns.port_src) | np.isnan(columns.port_dst))
+    ports = set(columns.port_src[has_ports]) | set(columns.port_dst[has_ports])
+    # The formulas the model was trained with, port_amount_normalized included as it is
+    expected = [sum(lengths) / total_time / 100000000, (len(ips) - 2) / (200 * 2 - 2),
+                len(ports) - 2 / (200 * 2 - 2), total_time / 60]
+    np.testing.assert_allclose(reference_stats(reference_output(mixed_packets)), expected, rtol=1e-9)
+    np.testing.assert_allclose(BatchProcessor(columns).process().stats, expected, rtol=1e-9)
+
+
+def test_short_window_is_padded_to_the_model_input(mixed_packets):
+    columns = DataExtractor().extract_columns(mixed_packets[:50])
+    features = BatchProcessor(columns).process_features()
+    tensor = BatchProcessedCapture(features, columns, 200).to_array()
+    assert tensor.shape == (400, 46)
+    assert (tensor[:150] == -1).all()
+    np.testing.assert_array_equal(tensor[150:200], features)
+    np.testing.assert_array_equal(tensor[:200], tensor[200:])
+
+
+def test_processor_output_is_computed_once(mixed_packets):
+    processor = Processor(DataExtractor().extract_data(split_capture=mixed_packets))
+    assert processor.output is processor.output
+    assert len(processor.output) == len(mixed_packets)
@@ -0,0 +1,66 @@
+import os
+import threading
+import core.retention
+from scapy.utils import PcapReader, RawPcapReader
+from core.capture import RawFrame
+from core.retention import PacketRetention
+from conftest import make_mixed_packets
+
+
+def test_spilled_raw_frames_keep_their_capture_time(tmp_path):
+    packets = make_mixed_packets(50)
+    frames = [RawFrame(bytes(packet), float(packet.time) + 0.123456) for packet in packets]
+    retention = PacketRetention(10, str(tmp_path), segment_size=2000, max_segments=100)
+    retention.extend(frames)
+    assert retention.spilled == 40
+    for frame, packet in zip(frames, retention.take(range(50))):
+        assert bytes(packet) == bytes(frame)
+        assert abs(float(packet.time) - frame.time) < 1e-6
+
+    segment = retention.segments[0]
+    with RawPcapReader(segment.path) as reader:
+        _, metadata = next(iter(reader))
+    assert abs(metadata.sec + metadata.usec / 1e6 - frames[0].time) < 1e-6
+    retention.close()
+
+
+def test_extend_without_spill_keeps_the_packets_in_memory(tmp_path):
+    packets = make_mixed_packets(30)
+    retention = PacketRetention(10, str(tmp_path))
+    retention.extend(packets, spill=False)
+    assert retention.spilled == 0
+    assert len(retention) == 30
+    retention.spill()
+    assert retention.spilled == 20
+    assert [float(packet.time) for packet in retention] == [float(packet.time) for packet in packets]
+    retention.close()
+
+
+def test_reading_a_segment_does_not_block_the_workers(tmp_path, monkeypatch):
+    packets = make_mixed_packets(30)
+    retention = PacketRetention(10, str(tmp_path))
+    retention.extend(packets)
+    appended = []
+
+    class AppendingPcapReader(PcapReader):
+        # A worker appends packets while the segment is read
+        def read_packet(self, size=65535):
+            worker = threading.Thread(target=retention.extend, args=(packets[:1], False))
+            worker.start()
+            worker.join(5)
+            appended.append(not worker.is_alive())
+            return super().read_packet(size)
+
+    monkeypatch.setattr(core.retention, 'PcapReader', AppendingPcapReader)
+    taken = retention.take([0, 5, 25])
+    assert appended == [True, True]
+    assert [bytes(packet) for packet in taken] == [bytes(packets[i]) for i in (0, 5, 25)]
+    retention.close()
+
+
+def test_deleted_segment_gives_none(tmp_path):
+    retention = PacketRetention(10, str(tmp_path), segment_size=1, max_segments=100)
+    retention.extend(make_mixed_packets(30))
+    os.remove(retention.segments[0].path)
+    assert retention.take([0])[0] is None
+    retention.close()
@@ -0,0 +1,61 @@
+import threading
+import collections
+
+
+class UpdateBus:
+    """
+    GUI Update Bus.
+    Worker threads never touch Tk widgets: they post events, and the Tk main loop drains them in batches on a
+    root.after timer at frame_rate frames per second, at most max_events_per_frame events per frame (the rest
+    waits for the next frames).
+    Each kind of event has one handler, called once per frame with the list of the events of the frame, or with
+    the last one only for coalesced kinds (e.g. the network health).
+    """
+    def __init__(self, root, frame_rate=30, max_events_per_frame=500):
+        self.root = root
+        self.interval = max(1, int(1000 / frame_rate))
+        self.max_events_per_frame = max_events_per_frame
+        self.events = collections.deque()
+        self.lock = threading.Lock()
+        # kind -> (handler, coalesce)
+        self.handlers = {}
+        self.is_running = False
+
+    def subscribe(self, kind, handler, coalesce=False):
+        """Registers the handler of a kind of event (main thread)."""
+        self.handlers[kind] = (handler, coalesce)
+
+    def post(self, kind, payload=None):
+        """Queues an event, can be called from any thread."""
+        with self.lock:
+            self.events.append((kind, payload))
+
+    def clear(self):
+        """Discards the queued events (e.g. when the capture is reset)."""
+        with self.lock:
+            self.events.clear()
+
+    def start(self):
+        """Starts draining the queue from the Tk main loop."""
+        if not self.is_running:
+            self.is_running = True
+            self.root.after(self.interval, self.drain)
+
+    def stop(self):
+        self.is_running = False
+
+    def drain(self):
+        """Hands the events of one frame to their handlers, then schedules the next frame."""
+        if not self.is_running:
+            return
+        with self.lock:
+            events = [self.events.popleft() for _ in range(min(len(self.events), self.max_events_per_frame))]
+
+        batches = {}
+        for kind, payload in events:
+            batches.setdefault(kind, []).append(payload)
+        for kind, payloads in batches.items():
+            if kind in self.handlers:
+                handler, coalesce = self.handlers[kind]
+                handler(payloads[-1] if coalesce else payloads)
+        self.root.after(self.interval, self.drain)